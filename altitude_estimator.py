@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+
+# Altitude / vertical velocity estimator fusing sonar, barometer and the
+# flight controller's own altitude estimate (MSP_ALTITUDE).
+#
+# A small Kalman filter with state [altitude, vertical velocity, baro bias]
+# runs a constant-velocity model. Each source reports when it has data, with
+# its own timestamp. The filter predicts forward to that time and applies a
+# scalar update, and measurements with implausible innovations are gated out.
+# Sonar is only trusted below SONAR_MAX_RANGE. The baro reads absolute
+# pressure altitude, so its offset to ground level is tracked as a bias state.
+#
+# After every update the filter publishes (t, altitude, velocity) as one
+# tuple. estimate(t) extrapolates from it without locking, so the control
+# loop can run faster than any sensor and never waits on one.
+
+SONAR_MAX_RANGE = 4.0  # meters
+
+# Measurement noise (standard deviation, meters)
+SONAR_STD = 0.03
+BARO_STD = 0.5
+FC_STD = 0.3
+
+ACCEL_NOISE = 2.0  # m/s^2, how hard the model expects the vehicle to accelerate
+BIAS_DRIFT = 0.05  # m/sqrt(s), baro drift (temperature, weather)
+GATE_SIGMA = 5.0  # Reject measurements further than this many sigma out
+MAX_EXTRAPOLATION = 0.5  # seconds, hold the estimate after this long without data
+
+_SONAR = (1.0, 0.0, 0.0)
+_FC = (1.0, 0.0, 0.0)
+_BARO = (1.0, 0.0, 1.0)
+
+
+class AltitudeEstimator:
+    def __init__(self, accel_noise=ACCEL_NOISE, bias_drift=BIAS_DRIFT,
+                 sonar_std=SONAR_STD, baro_std=BARO_STD, fc_std=FC_STD,
+                 sonar_max_range=SONAR_MAX_RANGE, gate_sigma=GATE_SIGMA,
+                 clock=time.monotonic):
+        self.q_accel = accel_noise ** 2
+        self.q_bias = bias_drift ** 2
+        self.r_sonar = sonar_std ** 2
+        self.r_baro = baro_std ** 2
+        self.r_fc = fc_std ** 2
+        self.sonar_max_range = sonar_max_range
+        self.gate_sigma = gate_sigma
+        self.clock = clock
+        self._lock = threading.Lock()
+
+        self.accepted = {"sonar": 0, "baro": 0, "fc": 0}
+        self.rejected = {"sonar": 0, "baro": 0, "fc": 0}
+        self.reset()
+
+    # Start over on the ground: altitude 0, velocity 0, baro bias unknown
+    def reset(self, altitude=0.0, t=None):
+        with self._lock:
+            self._t = self.clock() if t is None else t
+            self._x = [altitude, 0.0, 0.0]
+            self._P = [[0.01, 0.0, 0.0],
+                       [0.0, 0.01, 0.0],
+                       [0.0, 0.0, 0.0]]
+            self._bias_known = False
+            self.published = (self._t, altitude, 0.0)
+
+    def _predict(self, t):
+        dt = t - self._t
+        if dt <= 0:
+            return  # Late measurement: apply it at the current state time
+        self._t = t
+        x, P = self._x, self._P
+        x[0] += x[1] * dt
+
+        # P = F P F' + Q for F = [[1, dt, 0], [0, 1, 0], [0, 0, 1]]
+        p00, p01, p02 = P[0]
+        p11, p12 = P[1][1], P[1][2]
+        p22 = P[2][2]
+        q = self.q_accel
+        n00 = p00 + 2 * dt * p01 + dt * dt * p11 + q * dt ** 4 / 4
+        n01 = p01 + dt * p11 + q * dt ** 3 / 2
+        n02 = p02 + dt * p12
+        n11 = p11 + q * dt * dt
+        n22 = p22 + self.q_bias * dt
+        P[0][0], P[0][1], P[0][2] = n00, n01, n02
+        P[1][0], P[1][1] = n01, n11
+        P[2][0], P[2][2] = n02, n22
+
+    # Scalar Kalman update for measurement z = H x with variance r
+    def _update(self, H, z, r):
+        x, P = self._x, self._P
+        PH = [P[i][0] * H[0] + P[i][1] * H[1] + P[i][2] * H[2] for i in range(3)]
+        S = H[0] * PH[0] + H[1] * PH[1] + H[2] * PH[2] + r
+        innovation = z - (H[0] * x[0] + H[1] * x[1] + H[2] * x[2])
+        if innovation * innovation > self.gate_sigma ** 2 * S:
+            return False
+        K = [ph / S for ph in PH]
+        for i in range(3):
+            x[i] += K[i] * innovation
+            for j in range(3):
+                P[i][j] -= K[i] * PH[j]
+        return True
+
+    def _measure(self, source, H, z, r, t):
+        with self._lock:
+            self._predict(self.clock() if t is None else t)
+            ok = self._update(H, z, r)
+            self.published = (self._t, self._x[0], self._x[1])
+        if ok:
+            self.accepted[source] += 1
+        else:
+            self.rejected[source] += 1
+        return ok
+
+    # Sonar range to the ground in meters
+    def add_sonar(self, altitude, t=None):
+        if altitude is None or altitude > self.sonar_max_range:
+            return False
+        return self._measure("sonar", _SONAR, altitude, self.r_sonar, t)
+
+    # Barometric altitude in meters (any reference)
+    def add_baro(self, altitude, t=None):
+        if not self._bias_known:
+            # The first reading defines the baro offset to ground level
+            with self._lock:
+                self._x[2] = altitude - self._x[0]
+                self._P[2][2] = self.r_baro
+                self._bias_known = True
+        return self._measure("baro", _BARO, altitude, self.r_baro, t)
+
+    # Altitude reported by the flight controller (MSP_ALTITUDE), meters
+    def add_fc_altitude(self, altitude, t=None):
+        return self._measure("fc", _FC, altitude, self.r_fc, t)
+
+    # (altitude, vertical velocity) extrapolated to time t, constant time
+    def estimate(self, t=None):
+        t0, altitude, velocity = self.published
+        if t is None:
+            t = self.clock()
+        dt = t - t0
+        if dt > MAX_EXTRAPOLATION:
+            dt = MAX_EXTRAPOLATION
+        return altitude + velocity * dt, velocity
+
+    def altitude(self, t=None):
+        return self.estimate(t)[0]
+
+    def altitude_std(self):
+        with self._lock:
+            return math.sqrt(self._P[0][0])
@@ -0,0 +1,104 @@
+import bisect
+import math
+
+# Altitude-hold controller: turns altitude error (meters) into a throttle
+# channel value (microseconds, 1000-2000).
+#
+# The loop runs at a fixed rate (see control_loop.py), so everything that
+# depends only on dt and the gains - integral and derivative scale factors,
+# the derivative filter coefficient - is computed once up front. update()
+# then does plain float arithmetic on attributes and builds no lists, dicts
+# or tuples, which keeps it cheap enough for a 200 Hz loop on the Pi.
+
+HOVER_THROTTLE = 1500  # Throttle that roughly holds altitude (feed-forward)
+MIN_THROTTLE = 1000
+MAX_THROTTLE = 2000
+
+# Default gains, in throttle microseconds per meter (per meter*s, per m/s)
+DEFAULT_KP = 120.0
+DEFAULT_KI = 30.0
+DEFAULT_KD = 60.0
+
+
+class AltitudeController:
+    __slots__ = (
+        'dt', 'hover_throttle', 'min_throttle', 'max_throttle', 'i_limit',
+        '_alpha', '_bounds', '_bands', '_band',
+        '_kp', '_ki_dt', '_kd_dt',
+        '_integral', '_derivative', '_previous', 'output',
+    )
+
+    # schedule: optional list of (altitude_upper_bound, kp, ki, kd). The
+    # first band whose bound is above the measured altitude is used, and
+    # the last band covers everything above. Without a schedule the single
+    # kp/ki/kd set applies everywhere.
+    def __init__(self, kp=DEFAULT_KP, ki=DEFAULT_KI, kd=DEFAULT_KD, dt=0.02,
+                 hover_throttle=HOVER_THROTTLE, min_throttle=MIN_THROTTLE,
+                 max_throttle=MAX_THROTTLE, i_limit=200.0, d_cutoff_hz=5.0,
+                 schedule=None):
+        if dt <= 0:
+            raise ValueError(f"Controller dt must be positive, got {dt}")
+        self.dt = dt
+        self.hover_throttle = hover_throttle
+        self.min_throttle = min_throttle
+        self.max_throttle = max_throttle
+        self.i_limit = i_limit
+
+        # First-order low-pass on the derivative term
+        rc = 1.0 / (2.0 * math.pi * d_cutoff_hz)
+        self._alpha = dt / (rc + dt)
+
+        if not schedule:
+            schedule = [(math.inf, kp, ki, kd)]
+        schedule = sorted(schedule)
+        self._bounds = [bound for bound, _, _, _ in schedule[:-1]]
+        self._bands = [(kp, ki * dt, kd / dt) for _, kp, ki, kd in schedule]
+        self._select_band(0)
+        self.reset()
+
+    def _select_band(self, band):
+        self._band = band
+        self._kp, self._ki_dt, self._kd_dt = self._bands[band]
+
+    def reset(self, altitude=None):
+        self._integral = 0.0
+        self._derivative = 0.0
+        self._previous = altitude
+        self.output = self.hover_throttle
+
+    # One controller step; returns the throttle channel value
+    def update(self, setpoint, altitude):
+        band = bisect.bisect_right(self._bounds, altitude)
+        if band != self._band:
+            self._select_band(band)
+
+        error = setpoint - altitude
+
+        # Derivative on measurement (no kick when the setpoint steps), filtered
+        previous = self._previous
+        if previous is not None:
+            raw = (previous - altitude) * self._kd_dt
+            self._derivative += self._alpha * (raw - self._derivative)
+        self._previous = altitude
+
+        p = self._kp * error
+        unclamped = self.hover_throttle + p + self._integral + self._derivative
+
+        # Anti-windup: only integrate while the output is not saturated in
+        # the direction the error is pushing, and clamp the integrator
+        if not ((unclamped >= self.max_throttle and error > 0) or
+                (unclamped <= self.min_throttle and error < 0)):
+            integral = self._integral + self._ki_dt * error
+            if integral > self.i_limit:
+                integral = self.i_limit
+            elif integral < -self.i_limit:
+                integral = -self.i_limit
+            self._integral = integral
+
+        output = self.hover_throttle + p + self._integral + self._derivative
+        if output > self.max_throttle:
+            output = self.max_throttle
+        elif output < self.min_throttle:
+            output = self.min_throttle
+        self.output = int(output + 0.5)
+        return self.output
@@ -1,61 +1,23 @@
+import os
 import serial
 import struct
 import time
 
-class MSP:
-    def __init__(self, port, baudrate=115200):
-        self.ser = serial.Serial(port, baudrate, timeout=1)
-        time.sleep(2)  # Wait for connection to establish
-        
-    def send_cmd(self, cmd, data=None):
-        if data is None:
-            data = []
-        size = len(data)
-        checksum = 0
-        
-        # Calculate checksum
-        checksum ^= size
-        checksum ^= cmd
-        for i in data:
-            checksum ^= i
-        
-        # Construct message
-        msg = b'$M<' + struct.pack('<BB', size, cmd)
-        msg += bytes(data)
-        msg += struct.pack('<B', checksum)
-        
-        # Send message
-        self.ser.write(msg)
-        
-    def read_response(self, cmd):
-        header = self.ser.read(3)  # $M>
-        if len(header) != 3:
-            print("Error: No proper header received")
-            return None
-            
-        size = ord(self.ser.read(1))
-        command = ord(self.ser.read(1))
-        
-        if command != cmd:
-            print(f"Error: Expected command {cmd}, got {command}")
-            return None
-            
-        data = self.ser.read(size)
-        checksum = ord(self.ser.read(1))
-        
-        return data
-    
+from msp_messages import MSP_SET_ARMED, MSP_STATUS_EX, decode_status_ex
+from msp_transport import MSPClient
+
+class MSP(MSPClient):
     def arm(self):
         # Method 1: Using MSP_SET_ARMED (direct arming)
         print("Attempting to arm using MSP_SET_ARMED...")
-        self.send_cmd(216, [1])  # MSP_SET_ARMED = 216
-        return self.read_response(216)
+        self.send_cmd(MSP_SET_ARMED, [1])
+        return self.read_response(MSP_SET_ARMED)
     
     def disarm(self):
         # Direct disarming
         print("Disarming...")
-        self.send_cmd(216, [0])  # MSP_SET_ARMED = 216
-        return self.read_response(216)
+        self.send_cmd(MSP_SET_ARMED, [0])
+        return self.read_response(MSP_SET_ARMED)
     
     def arm_via_channels(self):
         # Method 2: Arming by setting channel values (simulating stick positions)
@@ -91,33 +53,20 @@ class MSP:
         
         return True
     
-    def set_raw_rc(self, channels):
-        # MSP_SET_RAW_RC = 200
-        data = []
-        for ch in channels:
-            data.extend([ch & 0xFF, (ch >> 8) & 0xFF])
-        self.send_cmd(200, data)
-        return self.read_response(200)
-    
-    def get_status(self):
-        # MSP_STATUS_EX = 150
-        self.send_cmd(150)
-        data = self.read_response(150)
-        
-        if data and len(data) >= 14:
-            arming_flags = data[2] + (data[3] << 8)
-            arming_disable_flags = data[6] + (data[7] << 8) + (data[8] << 16) + (data[9] << 24)
-            return {
-                "armed": bool(arming_flags & 1),
-                "arming_flags": arming_flags,
-                "arming_disable_flags": arming_disable_flags
-            }
-        return None
+    def get_status(self, snapshot=None):
+        data = self._payload(MSP_STATUS_EX, snapshot)
+        
+        if not data:
+            return None
+        try:
+            return decode_status_ex(data)
+        except struct.error:
+            return None  # Short payload
 
 # Main script
 if __name__ == "__main__":
-    # Change this to your actual serial port
-    serial_port = "/dev/ttyACM0"
+    # Change this to your actual serial port (or set MSP_PORT, e.g. to a sitl_fc.py pty)
+    serial_port = os.environ.get("MSP_PORT", "/dev/ttyACM0")
     
     try:
         print(f"Connecting to flight controller on {serial_port}...")
@@ -134,13 +83,13 @@ if __name__ == "__main__":
         # Check current arming status
         status = msp.get_status()
         if status:
-            print(f"Current armed state: {'ARMED' if status['armed'] else 'DISARMED'}")
-            if status['arming_disable_flags'] > 0:
-                print(f"Warning: Arming disable flags present: {status['arming_disable_flags']}")
-                print("Some flags might prevent arming. Common flags:")
-                if status['arming_disable_flags'] & 1:
+            print(f"Current armed state: {'ARMED' if status.armed else 'DISARMED'}")
+            reasons = status.arming_disable_reasons
+            if reasons:
+                print(f"Warning: Arming disable flags present: {', '.join(reasons)}")
+                if "RXLOSS" in reasons:
                     print("- RXLOSS: No valid receiver signal")
-                if status['arming_disable_flags'] & 32:
+                if "MSP" in reasons:
                     print("- MSP: Arming via MSP is disabled")
         
         # Try method 1: Direct MSP arming
@@ -150,7 +99,7 @@ if __name__ == "__main__":
         
         # Check if armed
         status = msp.get_status()
-        if status and status['armed']:
+        if status and status.armed:
             print("✅ Successfully armed via direct MSP command!")
         else:
             print("❌ Direct MSP arming failed.")
@@ -162,7 +111,7 @@ if __name__ == "__main__":
             
             # Check if armed
             status = msp.get_status()
-            if status and status['armed']:
+            if status and status.armed:
                 print("✅ Successfully armed via RC channels!")
             else:
                 print("❌ RC channel arming failed.")
@@ -177,7 +126,7 @@ if __name__ == "__main__":
                 print("- 'save'")
         
         # Keep armed for 10 seconds
-        if status and status['armed']:
+        if status and status.armed:
             print("\nDrone is armed! Staying armed for 10 seconds...")
             for i in range(10, 0, -1):
                 print(f"{i} seconds remaining...")
@@ -192,7 +141,7 @@ if __name__ == "__main__":
         # Verify disarmed
         status = msp.get_status()
         if status:
-            print(f"Final armed state: {'ARMED' if status['armed'] else 'DISARMED'}")
+            print(f"Final armed state: {'ARMED' if status.armed else 'DISARMED'}")
             
     except serial.SerialException as e:
         print(f"Serial error: {e}")
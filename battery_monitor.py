@@ -0,0 +1,222 @@
+import bisect
+import collections
+import struct
+import threading
+import time
+
+from control_loop import ControlLoop
+from msp_messages import MSP_ANALOG, MSP_BATTERY_STATE, decode_analog, decode_battery_state
+
+# Continuous LiPo battery monitor.
+#
+# Samples MSP_BATTERY_STATE (falling back to MSP_ANALOG) at a low fixed rate
+# on its own thread and keeps a rolling window of (time, voltage, current,
+# mAh drawn). Each sample is turned into a resting-voltage estimate by
+# adding back the sag the current causes through the pack's internal
+# resistance. The resistance itself is fitted over the window whenever the
+# current has varied enough. The resting voltage goes through a LiPo
+# discharge table to get the state of charge. That is cross-checked with
+# coulomb counting when the pack capacity is configured.
+#
+# Remaining flight time is the charge above the reserve divided by the mean
+# current over the window.
+#
+# The flight loop never waits on the monitor. It reads `state` (published
+# as one tuple) or checks the `critical` Event, and listener(level, reason)
+# is called from the monitor thread whenever the level escalates. Levels
+# only ever go up: a pack recovering at low throttle does not clear a
+# warning.
+
+SAMPLE_RATE_HZ = 2.0
+WINDOW = 30.0  # seconds of samples kept for the fits
+
+# Resting voltage per cell -> fraction of charge remaining (typical LiPo)
+LIPO_DISCHARGE = (
+    (3.27, 0.00), (3.61, 0.05), (3.69, 0.10), (3.71, 0.15), (3.73, 0.20),
+    (3.75, 0.25), (3.77, 0.30), (3.79, 0.35), (3.80, 0.40), (3.82, 0.45),
+    (3.84, 0.50), (3.85, 0.55), (3.87, 0.60), (3.91, 0.65), (3.95, 0.70),
+    (3.98, 0.75), (4.02, 0.80), (4.08, 0.85), (4.11, 0.90), (4.15, 0.95),
+    (4.20, 1.00),
+)
+_DISCHARGE_VOLTS = [v for v, _ in LIPO_DISCHARGE]
+
+INTERNAL_RESISTANCE = 0.015  # ohm per cell, starting guess before a fit
+MIN_FIT_CURRENT_SPREAD = 3.0  # amps of current variation needed to fit resistance
+RESISTANCE_LIMITS = (0.002, 0.1)  # ohm per cell
+
+RESERVE = 0.10  # fraction of charge kept in the pack at touchdown
+WARNING_SECONDS = 60.0  # warn when the predicted flight time drops below this
+CRITICAL_SECONDS = 20.0  # land now below this
+BROWNOUT_CELL_VOLTAGE = 3.3  # loaded volts per cell; land now below this
+STALE_AFTER = 3.0  # seconds without a battery sample before CRITICAL
+
+OK = 0
+WARNING = 1
+CRITICAL = 2
+LEVEL_NAMES = ("OK", "WARNING", "CRITICAL")
+
+
+# Fraction of charge remaining for a resting cell voltage
+def state_of_charge(cell_voltage):
+    i = bisect.bisect_left(_DISCHARGE_VOLTS, cell_voltage)
+    if i == 0:
+        return 0.0
+    if i == len(LIPO_DISCHARGE):
+        return 1.0
+    (v0, s0), (v1, s1) = LIPO_DISCHARGE[i - 1], LIPO_DISCHARGE[i]
+    return s0 + (s1 - s0) * (cell_voltage - v0) / (v1 - v0)
+
+
+# Cell count from a full-ish pack voltage, for FCs that report 0 cells
+def guess_cells(voltage):
+    return max(1, int(voltage / 4.25) + 1) if voltage > 0 else 0
+
+
+class BatteryState:
+    __slots__ = ('t', 'voltage', 'current', 'mah_drawn', 'cells', 'cell_voltage',
+                 'resting_cell_voltage', 'resistance', 'charge', 'remaining_mah',
+                 'flight_seconds', 'level')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def __repr__(self):
+        seconds = "?" if self.flight_seconds is None else f"{self.flight_seconds:.0f}s"
+        return (f"BatteryState({self.voltage:.2f}V {self.current:.1f}A, "
+                f"{self.charge * 100:.0f}%, {seconds} left, {LEVEL_NAMES[self.level]})")
+
+
+class BatteryMonitor:
+    def __init__(self, mux, rate_hz=SAMPLE_RATE_HZ, window=WINDOW, reserve=RESERVE,
+                 capacity_mah=None, listener=None, clock=time.monotonic):
+        self.mux = mux
+        self.rate_hz = rate_hz
+        self.window = window
+        self.reserve = reserve
+        self.capacity_mah = capacity_mah  # None: use what the FC reports
+        self.listener = listener
+        self.clock = clock
+        self.samples = collections.deque()
+        self.resistance = INTERNAL_RESISTANCE
+        self.cells = 0
+        self.level = OK
+        self.reason = None
+        self.state = None
+        self.critical = threading.Event()
+        self.missed = 0
+        self._last_sample = None
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        self._last_sample = self.clock()
+        self._loop = ControlLoop(self.rate_hz)
+        self._thread = threading.Thread(target=self._loop.run, args=(self._step,),
+                                        name="battery-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.stop()
+            self._thread.join()
+            self._loop = self._thread = None
+
+    def _step(self, now, dt):
+        snapshot = self.mux.request_many((MSP_BATTERY_STATE, MSP_ANALOG), timeout=0.5 / self.rate_hz)
+        reading = None
+        try:
+            data = snapshot.payload(MSP_BATTERY_STATE)
+            if data is not None:
+                reading = decode_battery_state(data)
+            else:
+                data = snapshot.payload(MSP_ANALOG)
+                if data is not None:
+                    reading = decode_analog(data)
+        except struct.error:
+            reading = None
+        if reading is None:
+            self.missed += 1
+            if now - self._last_sample > STALE_AFTER:
+                self._raise(CRITICAL, "no battery telemetry")
+            return False
+        self._last_sample = now
+        self.add_sample(now, reading.voltage, reading.current, reading.mah_drawn,
+                        reading.cells, reading.capacity)
+        return False
+
+    def _fit_resistance(self, cells):
+        # Least-squares slope of voltage against current over the window
+        n = len(self.samples)
+        currents = [s[2] for s in self.samples]
+        if n < 4 or max(currents) - min(currents) < MIN_FIT_CURRENT_SPREAD:
+            return
+        mean_i = sum(currents) / n
+        mean_v = sum(s[1] for s in self.samples) / n
+        cov = sum((s[2] - mean_i) * (s[1] - mean_v) for s in self.samples)
+        var = sum((i - mean_i) ** 2 for i in currents)
+        low, high = RESISTANCE_LIMITS
+        self.resistance = min(high, max(low, -cov / var / cells))
+
+    # Feed one sample; normally called from the monitor thread
+    def add_sample(self, t, voltage, current, mah_drawn, cells=0, capacity=0):
+        if cells:
+            self.cells = cells
+        elif not self.cells:
+            self.cells = guess_cells(voltage)
+        cells = self.cells or 1
+        samples = self.samples
+        samples.append((t, voltage, current, mah_drawn))
+        while samples and t - samples[0][0] > self.window:
+            samples.popleft()
+        self._fit_resistance(cells)
+
+        cell_voltage = voltage / cells
+        resting = cell_voltage + current * self.resistance
+        charge = state_of_charge(resting)
+
+        capacity = self.capacity_mah or capacity
+        remaining_mah = None
+        if capacity:
+            # Trust whichever of voltage and coulomb counting is more pessimistic
+            remaining_mah = min(charge * capacity, capacity - mah_drawn)
+            charge = max(0.0, remaining_mah / capacity)
+
+        mean_current = sum(s[2] for s in samples) / len(samples)
+        flight_seconds = None
+        if capacity and mean_current > 0:
+            usable = remaining_mah - self.reserve * capacity
+            flight_seconds = max(0.0, usable / (mean_current * 1000.0 / 3600.0))
+        elif len(samples) >= 2:
+            # No capacity: extrapolate how fast the charge estimate is falling
+            t0, v0, i0, _ = samples[0]
+            rate = (state_of_charge(v0 / cells + i0 * self.resistance) - charge) / (t - t0)
+            if rate > 0:
+                flight_seconds = max(0.0, (charge - self.reserve) / rate)
+
+        if cell_voltage < BROWNOUT_CELL_VOLTAGE:
+            self._raise(CRITICAL, f"cell voltage {cell_voltage:.2f}V under load")
+        elif charge <= self.reserve:
+            self._raise(CRITICAL, f"charge {charge * 100:.0f}% at reserve")
+        elif flight_seconds is not None and flight_seconds < CRITICAL_SECONDS:
+            self._raise(CRITICAL, f"{flight_seconds:.0f}s of flight left")
+        elif flight_seconds is not None and flight_seconds < WARNING_SECONDS:
+            self._raise(WARNING, f"{flight_seconds:.0f}s of flight left")
+
+        self.state = BatteryState(
+            t=t, voltage=voltage, current=current, mah_drawn=mah_drawn, cells=cells,
+            cell_voltage=cell_voltage, resting_cell_voltage=resting,
+            resistance=self.resistance, charge=charge, remaining_mah=remaining_mah,
+            flight_seconds=flight_seconds, level=self.level)
+        return self.state
+
+    def _raise(self, level, reason):
+        if level <= self.level:
+            return
+        self.level = level
+        self.reason = reason
+        if level == CRITICAL:
+            self.critical.set()
+        if self.listener is not None:
+            self.listener(level, reason)
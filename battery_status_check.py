@@ -1,121 +1,43 @@
+import os
 import serial
-import struct
-import time
 
-class MSP:
-    def __init__(self, port, baudrate=115200):
-        self.ser = serial.Serial(port, baudrate, timeout=1)
-        time.sleep(2)  # Wait for connection to establish
-        
-    def send_cmd(self, cmd, data=None):
-        if data is None:
-            data = []
-        size = len(data)
-        checksum = 0
-        
-        # Calculate checksum
-        checksum ^= size
-        checksum ^= cmd
-        for i in data:
-            checksum ^= i
-        
-        # Construct message
-        msg = b'$M<' + struct.pack('<BB', size, cmd)
-        msg += bytes(data)
-        msg += struct.pack('<B', checksum)
-        
-        # Send message
-        self.ser.write(msg)
-        
-    def read_response(self, cmd):
-        header = self.ser.read(3)  # $M>
-        if len(header) != 3:
-            print("Error: No proper header received")
-            return None
-            
-        size = ord(self.ser.read(1))
-        command = ord(self.ser.read(1))
-        
-        if command != cmd:
-            print(f"Error: Expected command {cmd}, got {command}")
-            return None
-            
-        data = self.ser.read(size)
-        checksum = ord(self.ser.read(1))
-        
-        return data
-    
-    def get_battery_status(self):
-        # MSP_BATTERY_STATE = 130
-        self.send_cmd(130)
-        data = self.read_response(130)
+from battery_monitor import INTERNAL_RESISTANCE, state_of_charge
+from msp_messages import MSP_ANALOG, MSP_BATTERY_STATE, decode_analog, decode_battery_state
+from msp_transport import MSPClient
+
+class MSP(MSPClient):
+    def get_battery_status(self, snapshot=None):
+        data = self._payload(MSP_BATTERY_STATE, snapshot)
         
-        if data is None or len(data) < 8:
+        if data is None or len(data) < 9:
             print("Failed to get battery data")
             return None
-            
-        # Parse battery data
-        battery = {}
-        # First byte is cell count, may be 0 if not detected
-        battery['cell_count'] = data[0]
-        
-        # Next 2 bytes are capacity in mAh
-        battery['capacity'] = data[1] + (data[2] << 8)
-        
-        # Next 2 bytes are voltage in 10mV steps
-        voltage_raw = data[3] + (data[4] << 8)
-        battery['voltage'] = voltage_raw / 100.0  # Convert to volts
-        
-        # Next 2 bytes are drawn current in 10mA steps
-        current_raw = data[5] + (data[6] << 8)
-        battery['current'] = current_raw / 100.0  # Convert to amps
-        
-        # Next 2 bytes are mAh drawn
-        battery['mah_drawn'] = data[7] + (data[8] << 8)
-        
-        # Calculate remaining battery percentage (estimation)
-        if battery['capacity'] > 0:
-            battery['remaining'] = max(0, min(100, 100 - (battery['mah_drawn'] * 100 / battery['capacity'])))
-        else:
-            # If capacity not configured, estimate from voltage
-            # Assuming LiPo with 3.3V min and 4.2V max per cell
-            if battery['cell_count'] > 0:
-                voltage_per_cell = battery['voltage'] / battery['cell_count']
-                battery['remaining'] = max(0, min(100, (voltage_per_cell - 3.3) * 100 / 0.9))
-            else:
-                battery['remaining'] = "Unknown"
-        
-        return battery
+        return decode_battery_state(data)
 
-    def get_analog(self):
-        # MSP_ANALOG = 110
-        self.send_cmd(110)
-        data = self.read_response(110)
+    # Remaining charge in percent, or None if it cannot be estimated
+    def remaining_percent(self, battery):
+        if battery.capacity > 0:
+            return max(0, min(100, 100 - (battery.mah_drawn * 100 / battery.capacity)))
+        # If capacity not configured, estimate from voltage: add back the
+        # sag under the current draw and look it up in the LiPo discharge curve
+        if battery.cells > 0:
+            voltage_per_cell = battery.voltage / battery.cells
+            resting = voltage_per_cell + battery.current * INTERNAL_RESISTANCE
+            return round(state_of_charge(resting) * 100)
+        return None
+
+    def get_analog(self, snapshot=None):
+        data = self._payload(MSP_ANALOG, snapshot)
         
         if data is None or len(data) < 7:
             print("Failed to get analog data")
             return None
-            
-        analog = {}
-        # First byte is battery voltage in 0.1V steps
-        analog['voltage'] = data[0] / 10.0  # Convert to volts
-        
-        # Next 2 bytes are mAh drawn
-        analog['mah_drawn'] = data[1] + (data[2] << 8)
-        
-        # Next byte is RSSI (0-255)
-        analog['rssi'] = data[3]
-        
-        # Next 2 bytes are amperage in 0.01A steps
-        amperage_raw = data[4] + (data[5] << 8)
-        analog['current'] = amperage_raw / 100.0  # Convert to amps
-        
-        return analog
+        return decode_analog(data)
 
 # Test script
 if __name__ == "__main__":
-    # Change this to your actual serial port
-    serial_port = "/dev/ttyACM0"
+    # Change this to your actual serial port (or set MSP_PORT, e.g. to a sitl_fc.py pty)
+    serial_port = os.environ.get("MSP_PORT", "/dev/ttyACM0")
     
     try:
         print(f"Connecting to flight controller on {serial_port}...")
@@ -123,22 +45,26 @@ if __name__ == "__main__":
         
         print("\n--- CHECKING BATTERY STATUS ---")
         
+        # Ask for the detailed battery state and the basic analog info in one
+        # pipelined round trip
+        snapshot = msp.request_many([MSP_BATTERY_STATE, MSP_ANALOG])
+        
         # First try the detailed battery state (newer Betaflight)
-        battery = msp.get_battery_status()
+        battery = msp.get_battery_status(snapshot)
         
         if battery:
             print("\nDetailed Battery Information:")
-            print(f"Cell Count: {battery['cell_count']} cells")
-            print(f"Capacity: {battery['capacity']} mAh")
-            print(f"Voltage: {battery['voltage']:.2f}V")
-            print(f"Current: {battery['current']:.2f}A")
-            print(f"mAh Drawn: {battery['mah_drawn']} mAh")
-            print(f"Battery Remaining: {battery['remaining']}" + 
-                  ("%" if isinstance(battery['remaining'], (int, float)) else ""))
+            remaining = msp.remaining_percent(battery)
+            print(f"Cell Count: {battery.cells} cells")
+            print(f"Capacity: {battery.capacity} mAh")
+            print(f"Voltage: {battery.voltage:.2f}V")
+            print(f"Current: {battery.current:.2f}A")
+            print(f"mAh Drawn: {battery.mah_drawn} mAh")
+            print(f"Battery Remaining: {'Unknown' if remaining is None else f'{remaining}%'}")
                   
             # Calculate estimated cell voltages
-            if battery['cell_count'] > 0:
-                voltage_per_cell = battery['voltage'] / battery['cell_count']
+            if battery.cells > 0:
+                voltage_per_cell = battery.voltage / battery.cells
                 print(f"Voltage per cell: {voltage_per_cell:.2f}V")
                 
                 # Battery health indicator
@@ -152,17 +78,17 @@ if __name__ == "__main__":
                     print("Battery Status: CRITICAL - LAND IMMEDIATELY!")
             
         # Try also the basic analog info (works on all versions)
-        analog = msp.get_analog()
+        analog = msp.get_analog(snapshot)
         
         if analog:
             if not battery:  # Only show if detailed info not available
                 print("\nBasic Battery Information:")
-                print(f"Voltage: {analog['voltage']:.1f}V")
-                print(f"Current: {analog['current']:.2f}A")
-                print(f"mAh Drawn: {analog['mah_drawn']} mAh")
+                print(f"Voltage: {analog.voltage:.1f}V")
+                print(f"Current: {analog.current:.2f}A")
+                print(f"mAh Drawn: {analog.mah_drawn} mAh")
             
             # RSSI information
-            rssi_percent = analog['rssi'] * 100 // 255
+            rssi_percent = analog.rssi * 100 // 1023
             print(f"\nReceiver Signal Strength (RSSI): {rssi_percent}%")
             
             if rssi_percent < 30:
@@ -0,0 +1,139 @@
+import array
+import time
+
+# Fixed-rate control loop scheduler.
+#
+# Deadlines are laid out on a monotonic clock at start + n * period, so the
+# loop rate does not drift with however long each step (and its serial I/O)
+# takes. A late tick runs immediately to catch up; if the loop falls more than
+# max_catchup periods behind, the missed deadlines are skipped instead of
+# being replayed in a burst.
+
+# Sleep until this close to the deadline, then spin for the last bit.
+# time.sleep() on the Pi typically overshoots by 50-100 us.
+SPIN_WINDOW = 0.0005
+
+
+# Per-tick timing statistics for a control loop
+class LoopStats:
+    __slots__ = ('period', 'ticks', 'overruns', 'skipped', 'jitter_max',
+                 'jitter_sum', 'step_max', 'step_sum', '_recent', '_index')
+
+    def __init__(self, period, history=1024):
+        self.period = period
+        self._recent = array.array('d', bytes(8 * history))
+        self.reset()
+
+    def reset(self):
+        self.ticks = 0
+        self.overruns = 0  # Steps that took longer than one period
+        self.skipped = 0  # Deadlines dropped after falling too far behind
+        self.jitter_max = 0.0
+        self.jitter_sum = 0.0
+        self.step_max = 0.0
+        self.step_sum = 0.0
+        self._index = 0
+
+    # jitter: how late the tick started; duration: how long the step ran
+    def record(self, jitter, duration):
+        self.ticks += 1
+        self.jitter_sum += jitter
+        if jitter > self.jitter_max:
+            self.jitter_max = jitter
+        self.step_sum += duration
+        if duration > self.step_max:
+            self.step_max = duration
+        if duration > self.period:
+            self.overruns += 1
+        recent = self._recent
+        recent[self._index % len(recent)] = jitter
+        self._index += 1
+
+    @property
+    def jitter_mean(self):
+        return self.jitter_sum / self.ticks if self.ticks else 0.0
+
+    @property
+    def step_mean(self):
+        return self.step_sum / self.ticks if self.ticks else 0.0
+
+    # Jitter percentile (0-100) over the most recent ticks
+    def jitter_percentile(self, pct):
+        n = min(self._index, len(self._recent))
+        if n == 0:
+            return 0.0
+        samples = sorted(self._recent[:n])
+        return samples[min(n - 1, int(pct / 100.0 * n))]
+
+    def as_dict(self):
+        return {
+            "rate_hz": 1.0 / self.period,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "jitter_mean_ms": self.jitter_mean * 1000.0,
+            "jitter_p50_ms": self.jitter_percentile(50) * 1000.0,
+            "jitter_p99_ms": self.jitter_percentile(99) * 1000.0,
+            "jitter_max_ms": self.jitter_max * 1000.0,
+            "step_mean_ms": self.step_mean * 1000.0,
+            "step_max_ms": self.step_max * 1000.0,
+        }
+
+
+class ControlLoop:
+    def __init__(self, rate_hz, max_catchup=2, spin=SPIN_WINDOW, clock=time.monotonic):
+        if rate_hz <= 0:
+            raise ValueError(f"Control loop rate must be positive, got {rate_hz}")
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.max_catchup = max_catchup
+        self.spin = spin
+        self.clock = clock
+        self.stats = LoopStats(self.period)
+        self._running = False
+
+    def stop(self):
+        self._running = False
+
+    def _wait_until(self, deadline):
+        clock = self.clock
+        remaining = deadline - clock()
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while clock() < deadline:
+            pass
+
+    # Call step(now, dt) once per period until it returns True, stop() is
+    # called or duration seconds have passed. Returns the loop statistics.
+    def run(self, step, duration=None):
+        clock = self.clock
+        period = self.period
+        stats = self.stats
+        start = clock()
+        end = None if duration is None else start + duration
+        deadline = start
+        previous = start
+        self._running = True
+
+        while self._running:
+            self._wait_until(deadline)
+            now = clock()
+            if end is not None and now >= end:
+                break
+
+            done = step(now, now - previous)
+            finished = clock()
+            stats.record(now - deadline, finished - now)
+            previous = now
+            if done:
+                break
+
+            deadline += period
+            behind = finished - deadline
+            if behind > self.max_catchup * period:
+                missed = int(behind // period) + 1
+                stats.skipped += missed
+                deadline += missed * period
+
+        self._running = False
+        return stats
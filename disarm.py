@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
 from msp import MultiWii
-from util import push16
 import time
 
+from control_loop import ControlLoop
+from rc_override import RCOverride
+
 board = MultiWii("/dev/ttyACM0")
 
 time.sleep(1.0)
@@ -11,15 +13,11 @@ time.sleep(1.0)
 board.enable_arm()
 board.arm()
 
-while True:
-    buf = []
-    push16(buf, 1500)
-    push16(buf, 1500)
-    push16(buf, 1500)
-    push16(buf, 1500)
-    push16(buf, 1500)
-    push16(buf, 1000)
-    push16(buf, 1000)
-    push16(buf, 1000)
-    board.sendCMD(MultiWii.SET_RAW_RC, buf)
-    time.sleep(0.05)
+# RC values streamed to the board, encoded once into a reusable frame
+rc = RCOverride([1500, 1500, 1500, 1500, 1500, 1000, 1000, 1000])
+
+# Stream RC values at a steady 20 Hz instead of sleeping 50 ms after each send
+def step(now, dt):
+    board.ser.write(rc.frame)
+
+ControlLoop(20).run(step)
@@ -0,0 +1,244 @@
+import argparse
+import array
+import sys
+
+import numpy as np
+
+from flight_recorder import (KIND_MSP_IN, KIND_VALUES, RECORD_HEADER, STREAM_BARO,
+                             STREAM_CONTROL, STREAM_ESTIMATE, STREAM_SONAR, FlightLog)
+from msp_messages import MSP_ALTITUDE, MSP_ANALOG, MSP_BATTERY_STATE, MSP_MOTOR, MSP_RX, REGISTRY
+
+# Columnar export of flight logs recorded by flight_recorder.py.
+#
+# Each telemetry stream is decoded in bulk into a NumPy structured array with
+# a time column 't' (seconds since the recorder started) followed by values in
+# SI units. The decoding does no per-frame Python work. The record offsets
+# from the log index are turned into one fancy-indexing gather over the
+# memory-mapped file. The gathered rows are then viewed through a
+# structured dtype built from the payload layout in msp_messages.MESSAGES.
+#
+# resample()/align() put several streams onto one common clock, and the
+# result can be saved as NPZ:
+#
+#   python flight_export.py logs/flight_20250101_120000.bin -o flight.npz --rate 50
+#
+#   data = np.load("flight.npz")
+#   data["battery"]["voltage"], data["aligned.altitude"]["altitude"]
+
+# Record header, as written by FlightRecorder
+HEADER_DTYPE = np.dtype([('sync', '<u2'), ('kind', 'u1'), ('flags', 'u1'), ('id', '<u2'),
+                         ('length', '<u2'), ('time', '<f8')])
+assert HEADER_DTYPE.itemsize == RECORD_HEADER.size
+
+# MSP_* payload fields as numpy dtypes, built from the registry's struct codes
+def _dtype(fields):
+    return np.dtype([(field[0], '<' + field[1]) for field in fields])
+
+
+# Field names for the STREAM_* value records
+STREAM_FIELDS = {
+    "sonar": (STREAM_SONAR, ('altitude',)),
+    "baro": (STREAM_BARO, ('altitude',)),
+    "estimate": (STREAM_ESTIMATE, ('altitude', 'velocity')),
+    "control": (STREAM_CONTROL, ('setpoint', 'altitude', 'throttle')),
+}
+
+
+# size bytes from start in each record. Records shorter than that repeat
+# their last byte instead of reading into the record that follows.
+def _gather(buffer, offsets, start, size, ends=None):
+    columns = np.arange(start, start + size, dtype=np.uint64)
+    index = offsets[:, None] + columns
+    if ends is not None:
+        index = np.minimum(index, ends[:, None] - 1)
+    return buffer[index]
+
+
+# (times, payload lengths, payload byte rows) for one kind/id. Records
+# shorter than min_size are dropped; rows are size bytes, or the shortest
+# payload when size is None.
+def _records(log, kind, ident, min_size=0, size=None):
+    offsets = np.frombuffer(log.index.get((kind, ident), array.array('Q')), dtype=np.uint64)
+    buffer = np.frombuffer(log.buffer, dtype=np.uint8)
+    headers = _gather(buffer, offsets, 0, HEADER_DTYPE.itemsize).view(HEADER_DTYPE)[:, 0]
+    keep = headers['length'] >= max(min_size, 1)
+    offsets, headers = offsets[keep], headers[keep]
+    lengths = headers['length'].astype(np.uint64)
+    if size is None:
+        size = int(lengths.min()) if len(headers) else min_size
+    rows = _gather(buffer, offsets, HEADER_DTYPE.itemsize, size,
+                   offsets + HEADER_DTYPE.itemsize + lengths)
+    del buffer  # Release the export so the log can be closed
+    return headers['time'] - log.mono_start, lengths, rows
+
+
+def _table(t, fields):
+    dtype = [('t', '<f8')] + [(name, '<f8', np.shape(value)[1:]) for name, value in fields]
+    table = np.empty(len(t), dtype)
+    table['t'] = t
+    for name, value in fields:
+        table[name] = value
+    return table
+
+
+# Every field of a registry message in engineering units, decoded the way
+# its decoder does it: replies shorter than the base fields are dropped, and
+# extra fields missing from older firmware take their fallback field's value
+# (NaN without one)
+def _msp(log, cmd):
+    message = REGISTRY[cmd]
+    base, full = _dtype(message.fields), _dtype(message.fields + message.extra)
+    t, lengths, rows = _records(log, KIND_MSP_IN, cmd, min_size=base.itemsize, size=full.itemsize)
+    raw = np.ascontiguousarray(rows).view(full)[:, 0]
+    short = lengths < full.itemsize
+    columns = {}
+    for field in message.fields + message.extra:
+        values = raw[field[0]] / field[2] if len(field) > 2 and field[2] != 1 else raw[field[0]]
+        if field in message.extra:
+            fallback = columns[field[3]] if len(field) > 3 else np.nan
+            values = np.where(short, fallback, values)
+        columns[field[0]] = values
+    return t, columns
+
+
+def decode_altitude(log):
+    t, msp = _msp(log, MSP_ALTITUDE)
+    return _table(t, [('altitude', msp['altitude']), ('vario', msp['vario'])])
+
+
+def decode_analog(log):
+    t, msp = _msp(log, MSP_ANALOG)
+    return _table(t, [('voltage', msp['voltage']), ('current', msp['current']),
+                      ('mah_drawn', msp['mah_drawn']), ('rssi', msp['rssi'])])
+
+
+def decode_battery(log):
+    t, msp = _msp(log, MSP_BATTERY_STATE)
+    return _table(t, [('voltage', msp['voltage']), ('current', msp['current']),
+                      ('mah_drawn', msp['mah_drawn']), ('cells', msp['cells']),
+                      ('state', msp['state'])])
+
+
+# uint16 array payloads (MSP_RX channels, MSP_MOTOR outputs)
+def _u16_columns(log, cmd, name):
+    t, _, rows = _records(log, KIND_MSP_IN, cmd, min_size=2)
+    rows = rows[:, :rows.shape[1] & ~1]
+    return _table(t, [(name, np.ascontiguousarray(rows).view('<u2'))])
+
+
+def decode_rx(log):
+    return _u16_columns(log, MSP_RX, 'channels')
+
+
+def decode_motor(log):
+    return _u16_columns(log, MSP_MOTOR, 'motors')
+
+
+def decode_stream(log, name):
+    stream, fields = STREAM_FIELDS[name]
+    size = 8 * len(fields)
+    t, _, rows = _records(log, KIND_VALUES, stream, min_size=size, size=size)
+    values = np.ascontiguousarray(rows).view('<f8')
+    return _table(t, [(field, values[:, i]) for i, field in enumerate(fields)])
+
+
+DECODERS = {
+    "altitude": decode_altitude,
+    "analog": decode_analog,
+    "battery": decode_battery,
+    "rx": decode_rx,
+    "motor": decode_motor,
+}
+
+
+# Every stream present in the log, by name
+def export(log):
+    series = {}
+    for name, decode in DECODERS.items():
+        table = decode(log)
+        if len(table):
+            series[name] = table
+    for name in STREAM_FIELDS:
+        table = decode_stream(log, name)
+        if len(table):
+            series[name] = table
+    return series
+
+
+# Resample a table onto clock. 'linear' interpolates; 'previous' holds the
+# last sample (for switches, RC channels and other stepwise values).
+# Samples outside the table's time range hold its first/last value.
+def resample(table, clock, method='linear'):
+    clock = np.asarray(clock, dtype=np.float64)
+    out = np.empty(len(clock), table.dtype)
+    out['t'] = clock
+    t = table['t']
+    if method == 'previous':
+        index = np.clip(np.searchsorted(t, clock, side='right') - 1, 0, len(t) - 1)
+        for name in table.dtype.names[1:]:
+            out[name] = table[name][index]
+    elif method == 'linear':
+        for name in table.dtype.names[1:]:
+            values = table[name]
+            if values.ndim == 1:
+                out[name] = np.interp(clock, t, values)
+            else:
+                for i in range(values.shape[1]):
+                    out[name][:, i] = np.interp(clock, t, values[:, i])
+    else:
+        raise ValueError(f"Unknown resample method {method!r}")
+    return out
+
+
+# Common clock at rate_hz over the time span every stream covers
+def common_clock(series, rate_hz):
+    start = max(table['t'][0] for table in series.values())
+    end = min(table['t'][-1] for table in series.values())
+    if end <= start:
+        return np.empty(0)
+    return np.arange(start, end, 1.0 / rate_hz)
+
+
+STEPWISE = ("rx", "battery")
+
+
+def align(series, rate_hz):
+    series = {name: table for name, table in series.items() if len(table)}
+    if not series:
+        return {}
+    clock = common_clock(series, rate_hz)
+    return {name: resample(table, clock, 'previous' if name in STEPWISE else 'linear')
+            for name, table in series.items()}
+
+
+def save_npz(path, series, aligned=None):
+    arrays = dict(series)
+    for name, table in (aligned or {}).items():
+        arrays[f"aligned.{name}"] = table
+    np.savez_compressed(path, **arrays)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a flight log to NumPy arrays")
+    parser.add_argument("log", help="flight log written by flight_recorder.py")
+    parser.add_argument("-o", "--output", help="write an .npz file")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="also resample every stream onto a common clock at this rate, Hz")
+    args = parser.parse_args(argv)
+
+    with FlightLog(args.log) as log:
+        series = export(log)
+    aligned = align(series, args.rate) if args.rate > 0 else None
+    for name, table in series.items():
+        span = table['t'][-1] - table['t'][0]
+        print(f"{name:9} {len(table):7} samples  {span:7.1f}s  {', '.join(table.dtype.names[1:])}")
+    if aligned:
+        print(f"aligned   {len(next(iter(aligned.values()))):7} samples at {args.rate:g} Hz")
+    if args.output:
+        save_npz(args.output, series, aligned)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import array
+import collections
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+# Binary, append-only flight recorder.
+#
+# File layout:
+#
+#   file header   magic b'ANAVLOG1', u16 format version, u16 reserved,
+#                 f64 wall-clock start time, f64 monotonic start time
+#   records       16-byte header + payload, back to back
+#
+# Record header ('<HBBHHd'):
+#   sync     0xA55A, lets a reader spot corruption
+#   kind     KIND_MSP_IN / KIND_MSP_OUT / KIND_VALUES
+#   flags    MSP direction byte for frames, 0 otherwise
+#   id       MSP command ID, or stream ID for KIND_VALUES
+#   length   payload length in bytes
+#   time     monotonic timestamp, seconds
+#
+# MSP frames are stored with their raw payload. Local sensor and controller
+# state is stored as KIND_VALUES records of little-endian doubles.
+#
+# Producers only pack a header and queue it with the payload under a lock.
+# A writer thread joins the queued records and writes them in batches.
+# FlightLog opens a finished (or still growing) file with mmap and indexes
+# the records by (kind, id) for random-access replay.
+#
+#   python flight_recorder.py logs/flight_20250101_120000.bin   # summary
+
+MAGIC = b'ANAVLOG1'
+FORMAT_VERSION = 1
+FILE_HEADER = struct.Struct('<8sHHdd')
+RECORD_HEADER = struct.Struct('<HBBHHd')
+RECORD_SYNC = 0xA55A
+
+KIND_MSP_IN = 0  # Frame received from the flight controller
+KIND_MSP_OUT = 1  # Frame sent to the flight controller
+KIND_VALUES = 2  # Local state, payload is a packed array of doubles
+
+# Stream IDs for KIND_VALUES records
+STREAM_SONAR = 1  # (altitude m,)
+STREAM_BARO = 2  # (altitude m,)
+STREAM_ESTIMATE = 3  # (altitude m, vertical velocity m/s)
+STREAM_CONTROL = 4  # (setpoint m, measured altitude m, throttle)
+
+FLUSH_INTERVAL = 0.2  # seconds between writer batches
+MAX_PENDING = 65536  # records; beyond this new records are dropped, never block
+
+
+class FlightRecorder:
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL, clock=time.monotonic):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, FORMAT_VERSION, 0, time.time(), clock()))
+            self._file.flush()
+        self._pending = collections.deque()
+        # Producers run on several threads (mux reader, sampler, control loop,
+        # telemetry); the lock keeps each header next to its payload
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+        self.records = 0
+        self.dropped = 0
+        self.bytes_written = 0
+        self._thread = threading.Thread(target=self._run, name="flight-recorder", daemon=True)
+        self._thread.start()
+
+    def _queue(self, kind, flags, ident, payload, t):
+        header = RECORD_HEADER.pack(RECORD_SYNC, kind, flags, ident, len(payload),
+                                    self.clock() if t is None else t)
+        with self._lock:
+            if len(self._pending) >= 2 * MAX_PENDING:  # header + payload per record
+                self.dropped += 1
+                return
+            self._pending.append(header)
+            self._pending.append(payload)
+            self.records += 1
+
+    # An MSP frame, received (outgoing=False) or sent
+    def record_frame(self, frame, t=None, outgoing=False):
+        self._queue(KIND_MSP_OUT if outgoing else KIND_MSP_IN, frame.direction,
+                    frame.cmd, bytes(frame.payload), t)
+
+    # A raw MSP payload, e.g. the RC override frame body that was just sent
+    def record_payload(self, cmd, payload, t=None, outgoing=True, direction=0x3C):
+        self._queue(KIND_MSP_OUT if outgoing else KIND_MSP_IN, direction, cmd, bytes(payload), t)
+
+    # A tuple of floats for one of the STREAM_* streams
+    def record_values(self, stream, values, t=None):
+        self._queue(KIND_VALUES, 0, stream, struct.pack(f'<{len(values)}d', *values), t)
+
+    def _write_pending(self):
+        pending = self._pending
+        chunks = []
+        # deque.popleft is thread-safe against the producers' append
+        while pending:
+            chunks.append(pending.popleft())
+        if chunks:
+            data = b''.join(chunks)
+            self._file.write(data)
+            self._file.flush()
+            self.bytes_written += len(data)
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._write_pending()
+        self._write_pending()
+
+    def flush(self):
+        self._wake.set()
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Memory-mapped reader with a (kind, id) -> record offsets index
+class FlightLog:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            raise ValueError(f"{path}: not a flight log (too short)")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.wall_start, self.mono_start = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not a flight log (bad magic)")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported flight log version {version}")
+        self.offsets = array.array('Q')
+        self.index = {}
+        self.corrupt_records = 0
+        self._build_index()
+
+    def _build_index(self):
+        data = self._map
+        end = len(data)
+        offset = FILE_HEADER.size
+        unpack = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        while offset + header_size <= end:
+            sync, kind, _, ident, length, _ = unpack(data, offset)
+            if sync != RECORD_SYNC:
+                # Corrupt record: scan forward for the next sync word
+                self.corrupt_records += 1
+                offset = data.find(b'\x5a\xa5', offset + 1)
+                if offset < 0:
+                    break
+                continue
+            if offset + header_size + length > end:
+                break  # Truncated last record (recorder still writing or crashed)
+            self.offsets.append(offset)
+            key = (kind, ident)
+            if key not in self.index:
+                self.index[key] = array.array('Q')
+            self.index[key].append(offset)
+            offset += header_size + length
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # The whole mapped file, for bulk decoding (see flight_export.py)
+    @property
+    def buffer(self):
+        return self._map
+
+    def _read(self, offset):
+        _, kind, flags, ident, length, t = RECORD_HEADER.unpack_from(self._map, offset)
+        start = offset + RECORD_HEADER.size
+        return kind, flags, ident, t, memoryview(self._map)[start:start + length]
+
+    # Record i in file order as (kind, flags, id, time, payload memoryview)
+    def __getitem__(self, i):
+        return self._read(self.offsets[i])
+
+    def count(self, kind, ident):
+        return len(self.index.get((kind, ident), ()))
+
+    def keys(self):
+        return sorted(self.index)
+
+    # (time, payload) for every record of one kind/id, in file order
+    def records(self, kind, ident):
+        for offset in self.index.get((kind, ident), ()):
+            _, _, _, t, payload = self._read(offset)
+            yield t, payload
+
+    def frames(self, cmd, outgoing=False):
+        return self.records(KIND_MSP_OUT if outgoing else KIND_MSP_IN, cmd)
+
+    # (time, tuple of floats) for a STREAM_* stream
+    def values(self, stream):
+        for t, payload in self.records(KIND_VALUES, stream):
+            yield t, struct.unpack(f'<{len(payload) // 8}d', payload)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+KIND_NAMES = {KIND_MSP_IN: "msp-in", KIND_MSP_OUT: "msp-out", KIND_VALUES: "values"}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("usage: python flight_recorder.py FLIGHT_LOG", file=sys.stderr)
+        return 2
+    with FlightLog(argv[0]) as log:
+        duration = log[len(log) - 1][3] - log.mono_start if len(log) else 0.0
+        print(f"{log.path}: {len(log)} records, {duration:.1f}s, "
+              f"started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(log.wall_start))}")
+        if log.corrupt_records:
+            print(f"  {log.corrupt_records} corrupt records skipped")
+        for kind, ident in log.keys():
+            print(f"  {KIND_NAMES.get(kind, kind):8} {ident:5}  {log.count(kind, ident)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,136 +1,358 @@
-import serial
+import os
 import time
-import struct
 import threading
 import sys
 
+from altitude_estimator import AltitudeEstimator
+from altitude_pid import AltitudeController
+from battery_monitor import LEVEL_NAMES, BatteryMonitor
+from control_loop import ControlLoop
+from flight_recorder import STREAM_CONTROL, STREAM_ESTIMATE, STREAM_SONAR, FlightRecorder
+from hcsr04 import HCSR04
+from link_watchdog import LinkWatchdog
+from mission import FAILED, MissionRunner, load_mission
+from msp_messages import (MSP_ALTITUDE, MSP_BATTERY_STATE, MSP_MOTOR, MSP_RX, MSP_STATUS_EX,
+                          decode_altitude)
+from msp_transport import MSPMultiplexer, connect_msp
+from rc_override import AUX1, DEFAULT_CHANNELS, RCOverride
+from telemetry_server import TelemetryServer, parse_address
+
 # Constants and Configuration
-MSP_PORT = '/dev/ttyACM0'
+MSP_PORT = os.environ.get('MSP_PORT', '/dev/ttyACM0')  # e.g. a sitl_fc.py pty
 BAUD_RATE = 921600
 TAKEOFF_ALTITUDE = 3.75  # meters
 HOVER_ALTITUDE = 3.75  # meters (constant altitude hold)
 LANDING_ALTITUDE = 0.2  # meters (safe landing threshold)
+CONTROL_RATE_HZ = 50  # RC override update rate for takeoff/hover/land
+TELEMETRY_RATE_HZ = 10  # MSP_ALTITUDE polling rate
+LANDING_DESCENT_RATE = 0.3  # m/s, how fast the landing setpoint comes down
+
+# RC override channels while flying: sticks centered, AUX1 held in the arm
+# position (same value arm.py uses for arming via channels)
+FLIGHT_CHANNELS = list(DEFAULT_CHANNELS)
+FLIGHT_CHANNELS[AUX1] = 1800
+ARM_HOLD_TIME = 0.5  # seconds the arm switch is held with throttle low
+
+# Binary flight logs (see flight_recorder.py); empty disables recording
+FLIGHT_LOG_DIR = os.environ.get('FLIGHT_LOG_DIR', 'logs')
 
-# MSP commands
-MSP_STATUS = 0x10
-MSP_SET_RAW_RC = 0x13
-MSP_RAW_IMU = 0x12
-MSP_ALTITUDE = 0x15  # Altitude data
+# Ground-station telemetry (see telemetry_server.py): UDP and WebSocket
+# host:port to serve on; empty disables. Loopback only by default; set
+# TELEMETRY_UDP=0.0.0.0:15550 to serve a ground-station laptop on the LAN.
+TELEMETRY_UDP = os.environ.get('TELEMETRY_UDP', '127.0.0.1:15550')
+TELEMETRY_WS = os.environ.get('TELEMETRY_WS', '')
 
-# Initialize Serial Communication with Betaflight
+# Polled together every telemetry tick; all of it ends up in the flight log
+TELEMETRY_COMMANDS = (MSP_ALTITUDE, MSP_BATTERY_STATE, MSP_STATUS_EX, MSP_RX, MSP_MOTOR)
+
+# Initialize Serial Communication with Betaflight: returns as soon as the
+# FC answers (and on MSP v2 if it supports it)
 def init_msp_connection():
     try:
-        ser = serial.Serial(MSP_PORT, BAUD_RATE, timeout=1)
-        time.sleep(2)  # Wait for Betaflight to initialize
-        return ser
+        link = connect_msp(MSP_PORT, BAUD_RATE)
+        print(f"Connected: {link.info}")
+        return link
     except Exception as e:
         print(f"Error initializing MSP connection: {e}")
         sys.exit(1)
 
 # Send MSP Command
-def send_msp_command(ser, command, payload=b''):
-    length = len(payload)
-    checksum = 0
-    packet = bytearray([0x24, 0x4D, 0x53, 0x50, length, command])
-    
-    # Append payload and calculate checksum
-    packet.extend(payload)
-    for byte in packet:
-        checksum ^= byte
-    packet.append(checksum)
-    
-    # Send to the flight controller
-    ser.write(packet)
-    ser.flush()
-
-# Read MSP Response
-def read_msp_response(ser):
-    # Read until the start byte is detected
-    while True:
-        byte = ser.read(1)
-        if byte == b'\x24':  # start byte
-            header = ser.read(4)  # header length 4 bytes
-            if header == b'MSP':
-                length = ord(ser.read(1))
-                command = ord(ser.read(1))
-                payload = ser.read(length)
-                checksum = ord(ser.read(1))
-                # Validate checksum here
-                return command, payload
-        time.sleep(0.01)
-
-# Altitude Measurement from HC-SR04 Sensor (simple version)
+def send_msp_command(link, command, payload=b''):
+    link.send(command, payload)
+
+# Read MSP Response: next checksum-verified frame as (command, payload),
+# or None if nothing arrives within the timeout
+def read_msp_response(link, timeout=1.0):
+    frame = link.read_frame(timeout)
+    if frame is None:
+        return None
+    return frame.cmd, frame.payload
+
+# Altitude estimate fused from the HC-SR04 sonar and the flight controller's
+# own altitude (MSP_ALTITUDE). Sensors feed it from their own threads;
+# reading it never waits for an echo or a serial reply.
+estimator = AltitudeEstimator()
+altimeter = None
+recorder = None
+
+def on_sonar(altitude, stamp):
+    estimator.add_sonar(altitude, stamp)
+    if recorder is not None:
+        recorder.record_values(STREAM_SONAR, (altitude,), stamp)
+
+def start_altimeter(backend=None):
+    global altimeter
+    altimeter = HCSR04(backend, listener=on_sonar).start()
+    return altimeter
+
+# Record every MSP frame the multiplexer reads, plus sensor and controller
+# state. Writing happens on the recorder's own thread.
+def start_recorder(mux, log_dir=FLIGHT_LOG_DIR):
+    global recorder
+    if not log_dir:
+        return None
+    os.makedirs(log_dir, exist_ok=True)
+    path = os.path.join(log_dir, time.strftime('flight_%Y%m%d_%H%M%S.bin'))
+    recorder = FlightRecorder(path)
+    mux.subscribe(None, recorder.record_frame)
+    print(f"Recording flight to {path}")
+    return recorder
+
+def stop_recorder():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+def record_control(setpoint, altitude, throttle):
+    if recorder is not None:
+        recorder.record_values(STREAM_CONTROL, (setpoint, altitude, throttle))
+    if telemetry is not None:
+        telemetry.state.update_control(setpoint, altitude, throttle)
+
+# Stream the latest state to ground-station clients. The control loop only
+# stores samples; the publisher thread does all the socket work.
+telemetry = None
+
+def start_telemetry(mux):
+    global telemetry
+    if not TELEMETRY_UDP and not TELEMETRY_WS:
+        return None
+    server = TelemetryServer(udp_address=parse_address(TELEMETRY_UDP) if TELEMETRY_UDP else None,
+                             ws_address=parse_address(TELEMETRY_WS) if TELEMETRY_WS else None)
+    try:
+        server.start()
+    except OSError as e:
+        print(f"Telemetry server not started: {e}")  # Fly without it
+        return None
+    telemetry = server
+    mux.subscribe(None, telemetry.state.record_frame)
+    print(f"Serving telemetry: UDP {telemetry.udp_address}, WebSocket {telemetry.ws_address}")
+    return telemetry
+
+def stop_telemetry():
+    global telemetry
+    if telemetry is not None:
+        telemetry.stop()
+        telemetry = None
+
+# Battery monitor on its own low-rate thread (see battery_monitor.py). The
+# control loops only check its failsafe flag.
+battery = None
+
+def on_battery_event(level, reason):
+    print(f"Battery {LEVEL_NAMES[level]}: {reason}")
+
+def start_battery_monitor(mux):
+    global battery
+    battery = BatteryMonitor(mux, listener=on_battery_event).start()
+    return battery
+
+def battery_failsafe():
+    return battery is not None and battery.critical.is_set()
+
 def read_altitude():
-    # This is a placeholder. In real code, use GPIO to trigger and read from the HC-SR04
-    return 1.0  # Simulate 1m altitude for testing
+    return estimator.altitude()
+
+# Altitude-hold PID shared by takeoff, hover and landing
+def make_altitude_controller(rate_hz=CONTROL_RATE_HZ):
+    return AltitudeController(dt=1.0 / rate_hz)
+
+# Reusable MSP_SET_RAW_RC frame in the link's MSP version
+def make_rc_override(link):
+    return RCOverride(FLIGHT_CHANNELS, link.version)
+
+# Patch the throttle channel in place and send the whole RC frame
+def send_throttle(link, rc, throttle):
+    rc.set_throttle(throttle)
+    link.write_frame(rc.frame)
+
+# Arm / disarm through the RC override stream: hold throttle low with AUX1
+# in the arm (or disarm) position for ARM_HOLD_TIME
+def set_arm_switch(link, rc, armed, rate_hz=CONTROL_RATE_HZ):
+    print("Arming..." if armed else "Disarming...")
+    rc.set_channel(AUX1, FLIGHT_CHANNELS[AUX1] if armed else 1000)
+
+    def step(now, dt):
+        send_throttle(link, rc, 1000)
+        return False
+
+    return ControlLoop(rate_hz).run(step, ARM_HOLD_TIME)
 
 # Takeoff Procedure
-def takeoff(ser):
+def takeoff(link, controller=None, rc=None, rate_hz=CONTROL_RATE_HZ):
     print("Starting takeoff...")
-    while True:
+    if controller is None:
+        controller = make_altitude_controller(rate_hz)
+    if rc is None:
+        rc = make_rc_override(link)
+
+    def step(now, dt):
         current_altitude = read_altitude()
         if current_altitude >= TAKEOFF_ALTITUDE:
             print(f"Reached takeoff altitude: {current_altitude}m")
-            break
-        else:
-            # Send a command to the flight controller to ascend
-            payload = struct.pack('<H', 1000)  # Example: throttle
-            send_msp_command(ser, MSP_SET_RAW_RC, payload)
-            time.sleep(0.1)
+            return True
+        if battery_failsafe():
+            return True
+        # Climb towards the takeoff altitude
+        throttle = controller.update(TAKEOFF_ALTITUDE, current_altitude)
+        send_throttle(link, rc, throttle)
+        record_control(TAKEOFF_ALTITUDE, current_altitude, throttle)
+        return False
+
+    return ControlLoop(rate_hz).run(step)
 
-# Hover and Maintain Altitude
-def hover(ser):
+# Hover and Maintain Altitude (until the duration is up, if given, or the
+# battery failsafe trips)
+def hover(link, controller=None, rc=None, rate_hz=CONTROL_RATE_HZ, duration=None):
     print("Hovering...")
-    while True:
+    if controller is None:
+        controller = make_altitude_controller(rate_hz)
+    if rc is None:
+        rc = make_rc_override(link)
+    loop = ControlLoop(rate_hz)
+
+    def step(now, dt):
         current_altitude = read_altitude()
-        if abs(current_altitude - HOVER_ALTITUDE) > 0.1:
-            payload = struct.pack('<H', 1000)  # Adjust throttle for hovering
-            send_msp_command(ser, MSP_SET_RAW_RC, payload)
-        else:
-            print(f"Maintaining hover at: {current_altitude}m")
-        time.sleep(1)
+        # RC override has to be refreshed every tick, even when on target
+        throttle = controller.update(HOVER_ALTITUDE, current_altitude)
+        send_throttle(link, rc, throttle)
+        record_control(HOVER_ALTITUDE, current_altitude, throttle)
+        if loop.stats.ticks % int(rate_hz) == 0:
+            print(f"Maintaining hover at: {current_altitude}m (throttle {throttle})")
+        return battery_failsafe()
+
+    return loop.run(step, duration)
 
-# Landing Procedure
-def land(ser):
+# Landing Procedure: walk the altitude setpoint down at LANDING_DESCENT_RATE
+def land(link, controller=None, rc=None, rate_hz=CONTROL_RATE_HZ):
     print("Initiating landing...")
-    while True:
+    if controller is None:
+        controller = make_altitude_controller(rate_hz)
+    if rc is None:
+        rc = make_rc_override(link)
+    setpoint = read_altitude()
+    descent_step = LANDING_DESCENT_RATE / rate_hz
+
+    def step(now, dt):
+        nonlocal setpoint
         current_altitude = read_altitude()
         if current_altitude <= LANDING_ALTITUDE:
             print(f"Landing complete. Altitude: {current_altitude}m")
-            break
-        else:
-            payload = struct.pack('<H', 1000)  # Example: gradual throttle reduction
-            send_msp_command(ser, MSP_SET_RAW_RC, payload)
-            time.sleep(0.1)
+            return True
+        setpoint = max(0.0, setpoint - descent_step)
+        throttle = controller.update(setpoint, current_altitude)
+        send_throttle(link, rc, throttle)
+        record_control(setpoint, current_altitude, throttle)
+        return False
+
+    return ControlLoop(rate_hz).run(step)
+
+# Fly a compiled mission (see mission.py) as one fixed-rate loop: each tick
+# the runner advances the mission and hands back the altitude setpoint. If
+# the mission's landing times out, land() takes over the descent.
+def fly_mission(link, actions, controller=None, rc=None, rate_hz=CONTROL_RATE_HZ):
+    if controller is None:
+        controller = make_altitude_controller(rate_hz)
+    if rc is None:
+        rc = make_rc_override(link)
+    runner = MissionRunner(actions, LANDING_ALTITUDE)
 
-# Emergency Handler (Low Battery, UART Disconnect)
-def emergency_handler(ser):
+    def step(now, dt):
+        current_altitude = read_altitude()
+        if battery_failsafe():
+            runner.abort(now, f"battery {battery.reason}")
+        setpoint = runner.step(now, current_altitude)
+        if setpoint is None:
+            if runner.status != FAILED:
+                send_throttle(link, rc, 1000)  # Landed: throttle to minimum
+            return True
+        throttle = controller.update(setpoint, current_altitude)
+        send_throttle(link, rc, throttle)
+        record_control(setpoint, current_altitude, throttle)
+        return False
+
+    ControlLoop(rate_hz).run(step)
+    if runner.status == FAILED:
+        # Still airborne: keep descending under control, never cut throttle
+        land(link, controller, rc, rate_hz)
+    return runner
+
+# Emergency Handler (Low Battery, UART Disconnect): controlled descent from
+# wherever the drone is. Cutting the throttle would drop it out of the sky.
+def emergency_handler(link, controller=None, rc=None):
     print("Emergency landing triggered...")
-    # Send command to initiate immediate landing
-    payload = struct.pack('<H', 1000)  # Example: throttle to zero
-    send_msp_command(ser, MSP_SET_RAW_RC, payload)
-
-# Telemetry logging
-def log_telemetry(ser):
-    while True:
-        command, payload = read_msp_response(ser)
-        if command == MSP_ALTITUDE:
-            altitude_data = struct.unpack('<H', payload)
-            print(f"Altitude: {altitude_data[0]} meters")
-        time.sleep(0.5)
-
-# Main Autonomous Flight Logic
-def autonomous_flight():
-    ser = init_msp_connection()
+    return land(link, controller, rc)
+
+# Telemetry logging: requests go through the multiplexer, so the replies
+# can never be consumed by the control loop (or the other way round).
+# TELEMETRY_COMMANDS are polled as one pipelined batch at TELEMETRY_RATE_HZ;
+# FC altitude is fed to the estimator and printed every half second.
+def log_telemetry(mux):
+    loop = ControlLoop(TELEMETRY_RATE_HZ)
+
+    def step(now, dt):
+        snapshot = mux.request_many(TELEMETRY_COMMANDS, timeout=loop.period)
+        payload = snapshot.payload(MSP_ALTITUDE)
+        if payload is not None and len(payload) >= 6:
+            estimator.add_fc_altitude(decode_altitude(payload).altitude, time.monotonic())
+        if recorder is not None:
+            recorder.record_values(STREAM_ESTIMATE, estimator.estimate(now), now)
+        if telemetry is not None:
+            telemetry.state.update_estimate(*estimator.estimate(now))
+        if loop.stats.ticks % max(1, TELEMETRY_RATE_HZ // 2) == 0:
+            altitude, velocity = estimator.estimate()
+            print(f"Altitude: {altitude:.2f} meters ({velocity:+.2f} m/s)")
+        return False
+
+    loop.run(step)
+
+# Main Autonomous Flight Logic. With a mission file the mission is flown;
+# otherwise the fixed Takeoff -> Hover -> Landing sequence runs.
+def autonomous_flight(mission_path=None, altimeter_backend=None):
+    # Load and validate the mission before touching the hardware
+    actions = load_mission(mission_path) if mission_path else None
+
+    link = init_msp_connection()
+    start_altimeter(altimeter_backend)
+
+    # One reader thread owns the port; control and telemetry share it
+    mux = MSPMultiplexer(link)
+    start_recorder(mux)
+    start_telemetry(mux)
+    mux.start()
+    # Re-open the port and replay the RC override if the UART drops out
+    watchdog = LinkWatchdog(mux, MSP_PORT, BAUD_RATE).start()
+    start_battery_monitor(mux)
 
     # Start telemetry logging in background
-    telemetry_thread = threading.Thread(target=log_telemetry, args=(ser,))
+    telemetry_thread = threading.Thread(target=log_telemetry, args=(mux,), daemon=True)
     telemetry_thread.start()
 
-    # Run the flight sequence: Takeoff -> Hover -> Landing
-    takeoff(ser)
-    hover(ser)
-    land(ser)
+    # One altitude controller for the whole flight so the integrator
+    # carries across phases
+    controller = make_altitude_controller()
+    rc = make_rc_override(mux)
+    try:
+        set_arm_switch(mux, rc, True)
+        if actions is not None:
+            runner = fly_mission(mux, actions, controller, rc)
+            print(f"Mission finished: {runner.status}")
+        else:
+            takeoff(mux, controller, rc)
+            hover(mux, controller, rc)
+            if battery_failsafe():
+                emergency_handler(mux, controller, rc)
+            else:
+                land(mux, controller, rc)
+        set_arm_switch(mux, rc, False)
+    finally:
+        battery.stop()
+        watchdog.stop()
+        mux.stop()
+        stop_recorder()
+        stop_telemetry()
+        print(f"MSP link health: {mux.health.as_dict()}")
 
 if __name__ == "__main__":
-    autonomous_flight()
+    autonomous_flight(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,204 @@
+import random
+import threading
+import time
+
+# HC-SR04 ultrasonic altitude sensor.
+#
+# Instead of busy-waiting on the echo pin, the backend timestamps the rising
+# and falling edges of the echo pulse (GPIO edge callbacks on the Pi) and the
+# sampler thread just waits for the falling edge. Pings run at a fixed rate in
+# their own thread. The latest filtered reading is published as one tuple
+# assignment, so control loops read altitude without taking a lock or waiting
+# for an echo.
+
+SPEED_OF_SOUND = 343.0  # m/s at ~20 C
+MIN_RANGE = 0.02  # meters
+MAX_RANGE = 4.0  # meters, beyond this the HC-SR04 is unreliable
+ECHO_TIMEOUT = 0.025  # seconds, longest echo we wait for (~4.3 m)
+DEFAULT_PING_RATE = 20  # Hz, leave time for echoes to die out between pings
+
+# Default BCM pins, see Wiring_Representation
+TRIGGER_PIN = 23
+ECHO_PIN = 24
+
+
+# Edge-timed backend for the Raspberry Pi using RPi.GPIO edge detection
+class GPIOBackend:
+    def __init__(self, trigger_pin=TRIGGER_PIN, echo_pin=ECHO_PIN):
+        import RPi.GPIO as GPIO
+
+        self.GPIO = GPIO
+        self.trigger_pin = trigger_pin
+        self.echo_pin = echo_pin
+        self._rise = None
+        self._fall = None
+        self._done = threading.Event()
+
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(trigger_pin, GPIO.OUT, initial=GPIO.LOW)
+        GPIO.setup(echo_pin, GPIO.IN)
+        GPIO.add_event_detect(echo_pin, GPIO.BOTH, callback=self._edge)
+
+    def _edge(self, channel):
+        now = time.monotonic()
+        if self.GPIO.input(self.echo_pin):
+            self._rise = now
+        elif self._rise is not None:
+            self._fall = now
+            self._done.set()
+
+    # Fire a 10 us trigger pulse and return the echo pulse width in seconds,
+    # or None if no echo came back within timeout
+    def ping(self, timeout=ECHO_TIMEOUT):
+        self._rise = self._fall = None
+        self._done.clear()
+        self.GPIO.output(self.trigger_pin, True)
+        time.sleep(0.00001)
+        self.GPIO.output(self.trigger_pin, False)
+        if not self._done.wait(timeout):
+            return None
+        return self._fall - self._rise
+
+    def close(self):
+        self.GPIO.remove_event_detect(self.echo_pin)
+        self.GPIO.cleanup((self.trigger_pin, self.echo_pin))
+
+
+# Simulated sensor for testing on plain Linux. distance is either a number
+# or a callable returning the true distance in meters; noise adds Gaussian
+# error and dropout is the probability that an echo never arrives.
+class SimulatedBackend:
+    def __init__(self, distance=1.0, noise=0.0, dropout=0.0, seed=None):
+        self.distance = distance
+        self.noise = noise
+        self.dropout = dropout
+        self._random = random.Random(seed)
+
+    def ping(self, timeout=ECHO_TIMEOUT):
+        distance = self.distance() if callable(self.distance) else self.distance
+        if self._random.random() < self.dropout:
+            return None
+        distance += self._random.gauss(0.0, self.noise) if self.noise else 0.0
+        width = 2.0 * max(distance, 0.0) / SPEED_OF_SOUND
+        if width > timeout:
+            return None
+        return width
+
+    def close(self):
+        pass
+
+
+# Median-of-N filter with outlier rejection over a small fixed window
+class MedianFilter:
+    __slots__ = ('_window', '_index', '_count', '_rejects', 'max_jump')
+
+    def __init__(self, size=5, max_jump=0.5):
+        self._window = [0.0] * size
+        self._index = 0
+        self._count = 0
+        self._rejects = 0
+        self.max_jump = max_jump  # meters, reject readings this far from the median
+
+    def median(self):
+        if self._count == 0:
+            return None
+        samples = sorted(self._window[:self._count])
+        return samples[self._count // 2]
+
+    # Add a reading; returns the new median, or None if it was rejected.
+    # A full window of consecutive rejects means the jump is real (e.g. the
+    # ground came into range), so the filter restarts from the new value.
+    def add(self, value):
+        size = len(self._window)
+        if self._count == size:
+            current = self.median()
+            if abs(value - current) > self.max_jump:
+                self._rejects += 1
+                if self._rejects < size:
+                    return None
+                self._count = 0
+                self._index = 0
+        self._rejects = 0
+        self._window[self._index] = value
+        self._index = (self._index + 1) % size
+        if self._count < size:
+            self._count += 1
+        return self.median()
+
+
+class HCSR04:
+    # listener, if given, is called as listener(altitude, timestamp) from the
+    # sampler thread for every accepted reading
+    def __init__(self, backend=None, rate_hz=DEFAULT_PING_RATE, filter_size=5, max_jump=0.5,
+                 listener=None):
+        self.backend = backend if backend is not None else GPIOBackend()
+        self.listener = listener
+        self.period = 1.0 / rate_hz
+        self.filter = MedianFilter(filter_size, max_jump)
+
+        # (altitude in meters, monotonic timestamp) of the latest good reading
+        self.latest = (None, 0.0)
+
+        self.pings = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="hcsr04", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.backend.close()
+
+    # One blocking measurement in meters (unfiltered), or None
+    def measure(self):
+        width = self.backend.ping(ECHO_TIMEOUT)
+        self.pings += 1
+        if width is None:
+            self.timeouts += 1
+            return None
+        distance = width * SPEED_OF_SOUND / 2.0
+        if not MIN_RANGE <= distance <= MAX_RANGE:
+            self.timeouts += 1
+            return None
+        return distance
+
+    # Latest filtered altitude; returns default if nothing fresher than
+    # max_age seconds is available
+    def altitude(self, max_age=None, default=None):
+        value, stamp = self.latest
+        if value is None:
+            return default
+        if max_age is not None and time.monotonic() - stamp > max_age:
+            return default
+        return value
+
+    def _run(self):
+        deadline = time.monotonic()
+        while self._running:
+            distance = self.measure()
+            stamp = time.monotonic()
+            if distance is not None:
+                filtered = self.filter.add(distance)
+                if filtered is None:
+                    self.rejected += 1
+                else:
+                    self.latest = (filtered, stamp)
+                    if self.listener is not None:
+                        self.listener(filtered, stamp)
+            deadline += self.period
+            remaining = deadline - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+            else:
+                deadline = time.monotonic()
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import serial
+
+from msp_messages import MSP_API_VERSION
+from msp_transport import open_msp_port
+
+# Watchdog and automatic reconnect for an MSPMultiplexer link.
+#
+# Two failure modes are covered:
+#   - the device vanishes (USB CDC reset, cable): reads/writes raise and the
+#     multiplexer's reader thread asks the watchdog for a new port
+#   - the device stays but stops answering: the watchdog sends an
+#     MSP_API_VERSION heartbeat whenever the link has been quiet for half the
+#     deadline, and forces a reconnect when nothing at all has been received
+#     for `deadline` seconds
+#
+# Reconnecting re-opens the same port path (use a udev symlink such as
+# /dev/serial/by-id/... so it survives re-enumeration) with exponential
+# backoff. There is no settle delay. The multiplexer replays the last RC
+# override frame the moment the port is back, before the FC's RX-loss
+# failsafe kicks in. After `max_outage` seconds without a port the watchdog
+# gives up and pending/future requests fail with the last error.
+#
+# Link health (latency, error rate, outages, reconnects) is in mux.health.
+
+DEADLINE = 0.25  # seconds without any reply before the link counts as stalled
+MAX_OUTAGE = 5.0  # seconds of reconnect attempts before giving up
+BACKOFF_MIN = 0.005  # seconds, first retry delay
+BACKOFF_MAX = 0.2  # seconds, retry delay cap
+
+
+class LinkWatchdog:
+    def __init__(self, mux, port=None, baudrate=None, deadline=DEADLINE, max_outage=MAX_OUTAGE,
+                 backoff=(BACKOFF_MIN, BACKOFF_MAX), opener=open_msp_port, listener=None):
+        ser = mux.transport.ser
+        self.mux = mux
+        self.port = port or ser.port
+        self.baudrate = baudrate or ser.baudrate
+        self.deadline = deadline
+        self.max_outage = max_outage
+        self.backoff_min, self.backoff_max = backoff
+        self.opener = opener
+        self.listener = listener  # listener(event, detail): "lost", "restored", "failed"
+        self.attempts = 0
+        self._heartbeat = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self.mux.reconnect = self._reconnect
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="msp-watchdog", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.mux.reconnect == self._reconnect:
+            self.mux.reconnect = None
+
+    def _notify(self, event, detail):
+        if self.listener is not None:
+            self.listener(event, detail)
+        else:
+            print(f"MSP link {event}: {detail}")
+
+    # Called on the multiplexer's reader thread; returns a new serial port,
+    # or None once max_outage has passed
+    def _reconnect(self, reason):
+        start = time.monotonic()
+        self._notify("lost", reason)
+        try:
+            self.mux.transport.ser.close()  # Release the dead device node now
+        except (serial.SerialException, OSError):
+            pass
+        delay = self.backoff_min
+        while self.mux.running:
+            self.attempts += 1
+            try:
+                ser = self.opener(self.port, self.baudrate)
+            except (serial.SerialException, OSError) as e:
+                elapsed = time.monotonic() - start
+                if elapsed + delay > self.max_outage:
+                    self._notify("failed", f"no port after {elapsed:.1f}s ({e})")
+                    return None
+                time.sleep(delay)
+                delay = min(delay * 2, self.backoff_max)
+                continue
+            self._notify("restored", f"after {(time.monotonic() - start) * 1000:.0f} ms")
+            return ser
+        return None
+
+    def _run(self):
+        mux = self.mux
+        period = self.deadline / 4
+        while self._running and mux.running:
+            time.sleep(period)
+            if not mux.health.link_up:
+                continue
+            quiet = time.monotonic() - mux.last_rx
+            heartbeat = self._heartbeat
+            if heartbeat is not None and heartbeat.done():
+                self._heartbeat = heartbeat = None
+            if quiet > self.deadline:
+                if heartbeat is not None:
+                    mux.cancel(MSP_API_VERSION, heartbeat)
+                    self._heartbeat = None
+                mux.request_reconnect(f"no reply for {quiet * 1000:.0f} ms")
+            elif quiet > self.deadline / 2 and heartbeat is None:
+                self._heartbeat = mux.submit(MSP_API_VERSION)
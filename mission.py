@@ -0,0 +1,236 @@
+import json
+import math
+
+# Mission engine for the waypoint format in 1.json:
+#
+#   {"version": 1, "mission": {"waypoints": [
+#       {"action": "TAKEOFF" | "WAYPOINT" | "LAND", "params": {...},
+#        "lat": ..., "lon": ..., "alt": ...}, ...]}}
+#
+# A mission file is validated and compiled once into a list of MissionAction
+# objects. MissionRunner then steps through them from the control loop: every
+# tick it gets the current altitude and returns the altitude setpoint for the
+# controller, without blocking. Each action has its own completion criterion
+# and timeout.
+#
+# Only altitude is flown for now. lat/lon are validated and kept on each
+# action, but there is no horizontal navigation yet.
+#
+# Optional per-action params:
+#   speed      climb/descent rate for the setpoint ramp, m/s
+#   tolerance  how close to the target altitude counts as reached, meters
+#   hold       seconds to hold once reached (WAYPOINT)
+#   timeout    seconds before the action is given up on
+
+MISSION_VERSION = 1
+ACTIONS = ("TAKEOFF", "WAYPOINT", "LAND")
+
+DEFAULT_TAKEOFF_ALTITUDE = 3.75  # meters, used when TAKEOFF has alt 0 and nothing follows
+DEFAULT_SPEED = 0.5  # m/s
+DEFAULT_LAND_SPEED = 0.3  # m/s
+DEFAULT_TOLERANCE = 0.15  # meters
+LANDED_ALTITUDE = 0.2  # meters
+TIMEOUT_MARGIN = 15.0  # seconds added to the time the ramp alone should take
+
+RUNNING = "running"
+COMPLETE = "complete"
+ABORTED = "aborted"  # Timed out or aborted (e.g. battery failsafe), landed early
+FAILED = "failed"  # Landing itself timed out; the caller must keep descending
+
+
+class MissionError(ValueError):
+    pass
+
+
+class MissionAction:
+    __slots__ = ('index', 'kind', 'altitude', 'lat', 'lon', 'speed',
+                 'tolerance', 'hold', 'timeout')
+
+    def __init__(self, index, kind, altitude, lat=None, lon=None, speed=DEFAULT_SPEED,
+                 tolerance=DEFAULT_TOLERANCE, hold=0.0, timeout=None):
+        self.index = index
+        self.kind = kind
+        self.altitude = altitude
+        self.lat = lat
+        self.lon = lon
+        self.speed = speed
+        self.tolerance = tolerance
+        self.hold = hold
+        self.timeout = timeout
+
+    def __repr__(self):
+        return (f"MissionAction({self.index}, {self.kind}, alt={self.altitude}m, "
+                f"timeout={self.timeout}s)")
+
+
+def _number(value, what, low=-math.inf, high=math.inf):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not low <= value <= high:
+        raise MissionError(f"{what} must be a number in [{low}, {high}], got {value!r}")
+    return float(value)
+
+
+def _param(params, name, default, what, low=0.0):
+    if name not in params:
+        return default
+    return _number(params[name], f"{what} params.{name}", low)
+
+
+# Validate a parsed mission document and compile it into MissionActions
+def compile_mission(document):
+    if not isinstance(document, dict):
+        raise MissionError("Mission must be a JSON object")
+    if document.get("version") != MISSION_VERSION:
+        raise MissionError(f"Unsupported mission version: {document.get('version')!r}")
+    waypoints = (document.get("mission") or {}).get("waypoints")
+    if not isinstance(waypoints, list) or not waypoints:
+        raise MissionError("Mission has no waypoints")
+
+    actions = []
+    for index, waypoint in enumerate(waypoints):
+        what = f"Waypoint {index}"
+        if not isinstance(waypoint, dict):
+            raise MissionError(f"{what} must be an object")
+        kind = waypoint.get("action")
+        if kind not in ACTIONS:
+            raise MissionError(f"{what}: unknown action {kind!r}")
+        params = waypoint.get("params", {})
+        if not isinstance(params, dict):
+            raise MissionError(f"{what}: params must be an object")
+
+        lat = _number(waypoint.get("lat"), f"{what} lat", -90.0, 90.0)
+        lon = _number(waypoint.get("lon"), f"{what} lon", -180.0, 180.0)
+        altitude = _number(waypoint.get("alt"), f"{what} alt", 0.0)
+        speed = _param(params, "speed", DEFAULT_LAND_SPEED if kind == "LAND" else DEFAULT_SPEED, what)
+        if speed <= 0:
+            raise MissionError(f"{what}: params.speed must be positive")
+        timeout = _param(params, "timeout", None, what)
+        if timeout is not None and timeout <= 0:
+            raise MissionError(f"{what}: params.timeout must be positive")
+
+        actions.append(MissionAction(
+            index, kind, altitude, lat, lon, speed,
+            tolerance=_param(params, "tolerance", DEFAULT_TOLERANCE, what),
+            hold=_param(params, "hold", 0.0, what),
+            timeout=timeout,
+        ))
+
+    if actions[0].kind != "TAKEOFF":
+        raise MissionError("Mission must start with TAKEOFF")
+    if actions[-1].kind != "LAND":
+        raise MissionError("Mission must end with LAND")
+
+    # TAKEOFF with alt 0 (as the planner writes it) climbs to the altitude of
+    # the next airborne action
+    for i, action in enumerate(actions):
+        if action.kind == "TAKEOFF" and action.altitude <= 0:
+            following = [a.altitude for a in actions[i + 1:] if a.kind == "WAYPOINT"]
+            action.altitude = following[0] if following else DEFAULT_TAKEOFF_ALTITUDE
+        if action.kind == "LAND":
+            action.altitude = 0.0
+
+    # Default timeouts from the altitude change each action has to make
+    previous = 0.0
+    for action in actions:
+        if action.timeout is None:
+            action.timeout = abs(action.altitude - previous) / action.speed + action.hold + TIMEOUT_MARGIN
+        previous = action.altitude
+    return actions
+
+
+def load_mission(path):
+    with open(path) as f:
+        try:
+            document = json.load(f)
+        except json.JSONDecodeError as e:
+            raise MissionError(f"{path}: {e}") from None
+    return compile_mission(document)
+
+
+# Non-blocking mission state machine, stepped once per control tick
+class MissionRunner:
+    def __init__(self, actions, landed_altitude=LANDED_ALTITUDE):
+        self.actions = actions
+        self.landed_altitude = landed_altitude
+        self.status = RUNNING
+        self.aborted = False
+        self.index = -1
+        self.action = None
+        self.setpoint = 0.0
+        self._started = None
+        self._reached = None
+        self._previous = None
+
+    @property
+    def done(self):
+        return self.status != RUNNING
+
+    def _begin(self, action, now):
+        self.action = action
+        self._started = now
+        self._reached = None
+        print(f"Mission: {action.kind} to {action.altitude:.2f}m (action {action.index})")
+
+    def _advance(self, now):
+        self.index += 1
+        if self.index >= len(self.actions):
+            self.status = ABORTED if self.aborted else COMPLETE
+            self.action = None
+            print(f"Mission {self.status}")
+            return
+        self._begin(self.actions[self.index], now)
+
+    # Give up on the current action and land where we are (timeouts, battery
+    # failsafe). Does nothing if the mission is already landing.
+    def abort(self, now, reason="timed out"):
+        if self.status != RUNNING or self.action is None or self.action.kind == "LAND":
+            return
+        print(f"Mission: {self.action.kind} (action {self.action.index}) {reason}, landing")
+        self.aborted = True
+        land = MissionAction(self.action.index, "LAND", 0.0, speed=DEFAULT_LAND_SPEED)
+        land.timeout = self.setpoint / land.speed + TIMEOUT_MARGIN
+        self.index = len(self.actions)
+        self._begin(land, now)
+
+    # Advance the mission to time now given the measured altitude; returns
+    # the altitude setpoint, or None once the mission has finished
+    def step(self, now, altitude):
+        if self.status != RUNNING:
+            return None
+        if self.action is None:
+            self.setpoint = altitude
+            self._advance(now)
+        dt = 0.0 if self._previous is None else now - self._previous
+        self._previous = now
+        action = self.action
+
+        if now - self._started > action.timeout:
+            if action.kind == "LAND":
+                print("Mission: landing timed out")
+                self.status = FAILED
+                return None
+            self.abort(now)
+            action = self.action
+
+        # Ramp the setpoint towards the target at the action's speed
+        max_step = action.speed * dt
+        error = action.altitude - self.setpoint
+        if abs(error) <= max_step:
+            self.setpoint = action.altitude
+        else:
+            self.setpoint += max_step if error > 0 else -max_step
+
+        # Completion criteria
+        if action.kind == "LAND":
+            finished = altitude <= self.landed_altitude
+        elif abs(altitude - action.altitude) <= action.tolerance:
+            if self._reached is None:
+                self._reached = now
+            finished = now - self._reached >= action.hold
+        else:
+            finished = False
+
+        if finished:
+            self._advance(now)
+            if self.status != RUNNING:
+                return None
+        return self.setpoint
@@ -0,0 +1,429 @@
+import argparse
+import bisect
+import json
+import os
+import statistics
+import struct
+import sys
+import time
+from concurrent.futures import wait
+
+from control_loop import ControlLoop
+from msp_messages import (MSP_ESC_SENSOR_DATA, MSP_MOTOR, MSP_SET_MOTOR, MSP_STATUS_EX, REGISTRY,
+                          decode_esc_sensor_data, decode_motor, decode_status_ex)
+from msp_transport import MSPMultiplexer, connect_msp
+
+# Motor test engine: drives MSP_SET_MOTOR through a step/ramp profile and
+# measures how each motor follows it.
+#
+# Every tick of a fixed-rate loop sends the profile's motor values when
+# they change and pipelines MSP_MOTOR (plus MSP_ESC_SENSOR_DATA when the FC
+# has ESC telemetry) without waiting for the replies. Each reply is stamped
+# halfway between its request and its arrival. Once the profile is done,
+# every step in the command is matched against the samples that followed:
+#
+#   latency   command sent -> output (or rpm) moves 10% of the step
+#   settling  command sent -> output stays within the settle band
+#   mismatch  mean |output - command| once settled
+#   tracking  RMS of output - command over the whole run, ramps included,
+#             with the command shifted by the motor's median latency
+#   rpm       each motor's settled rpm against the mean of the motors
+#             driven with the same command
+#
+#   python motor_bench.py --profile staircase          # PROPS OFF, all motors at once
+#   python motor_bench.py --motors 1,3 --sequential --json
+#
+# Refuses to run while the FC is armed and always stops the motors on exit.
+
+MOTOR_STOP = 1000
+MAX_TEST_VALUE = 1400  # outputs above this need --max
+MOTOR_COUNT = 4
+SAMPLE_RATE_HZ = 200
+
+MIN_STEP = 20  # command change that counts as a step rather than part of a ramp
+RESPONSE_FRACTION = 0.1  # share of a step the output must move to count as a response
+SETTLE_BAND = 10  # output units, or 5% of the step if larger
+RPM_SETTLE_FRACTION = 0.05
+RPM_SETTLE_MIN = 200
+
+LATENCY_LIMIT = 0.1  # seconds
+SETTLE_LIMIT = 0.3  # seconds
+MISMATCH_LIMIT = 15  # output units
+RPM_MISMATCH_LIMIT = 0.1  # fraction of the mean rpm
+
+
+# Profile segments: (duration, start value, end value)
+def step(value, hold):
+    return ((hold, value, value),)
+
+
+def ramp(start, end, duration):
+    return ((duration, start, end),)
+
+
+# Every run ends with the motors stopped and sampled for SETTLE_LIMIT more
+PROFILES = {
+    "step": step(1150, 0.5),
+    "staircase": sum((step(v, 0.3) for v in (1100, 1200, 1300, 1200, 1100)), ()),
+    "ramp": ramp(MOTOR_STOP, 1300, 1.5) + ramp(1300, MOTOR_STOP, 1.5),
+}
+
+
+class Profile:
+    def __init__(self, segments):
+        self.segments = tuple(segments)
+        self.starts = []
+        t = 0.0
+        for duration, _, _ in self.segments:
+            self.starts.append(t)
+            t += duration
+        self.duration = t
+
+    @property
+    def peak(self):
+        return max(max(start, end) for _, start, end in self.segments)
+
+    # Commanded value t seconds into the profile
+    def value(self, t):
+        i = max(0, bisect.bisect_right(self.starts, t) - 1)
+        duration, start, end = self.segments[i]
+        if duration <= 0 or start == end:
+            return end if t >= self.starts[i] + duration else start
+        fraction = min(1.0, (t - self.starts[i]) / duration)
+        return int(round(start + (end - start) * fraction))
+
+
+class MotorResult:
+    __slots__ = ('motor', 'steps', 'latency', 'latency_max', 'settling_max', 'mismatch',
+                 'tracking_rms', 'rpm_latency_max', 'rpm_settling_max', 'rpm_final',
+                 'rpm_deviation', 'samples', 'problems')
+
+    def __init__(self, motor):
+        self.motor = motor  # 1-based
+        self.steps = 0
+        self.latency = None  # median over the steps, seconds
+        self.latency_max = None
+        self.settling_max = None
+        self.mismatch = None
+        self.tracking_rms = None
+        self.rpm_latency_max = None
+        self.rpm_settling_max = None
+        self.rpm_final = []  # settled rpm per step
+        self.rpm_deviation = None  # worst settled rpm against the other motors
+        self.samples = 0
+        self.problems = []
+
+    @property
+    def passed(self):
+        return not self.problems
+
+    def as_dict(self):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields["passed"] = self.passed
+        return fields
+
+
+def _ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f} ms"
+
+
+# Steps in one motor's command: (time, old value, new value, window end)
+def _steps(commands, motor, end):
+    changes = []
+    previous = MOTOR_STOP
+    for t, values in commands:
+        if values[motor] != previous:
+            changes.append((t, previous, values[motor]))
+            previous = values[motor]
+    steps = []
+    for i, (t, old, new) in enumerate(changes):
+        if abs(new - old) >= MIN_STEP:
+            steps.append((t, old, new, changes[i + 1][0] if i + 1 < len(changes) else end))
+    return steps
+
+
+# (latency, settling time, settled samples) of one step response. Latency
+# is None if the value never moved, settling None if it never settled.
+def _response(samples, t0, old, new, band):
+    moved = RESPONSE_FRACTION * abs(new - old)
+    latency = settling = None
+    for t, value in samples:
+        if latency is None and abs(value - old) >= moved:
+            latency = t - t0
+        if abs(value - new) > band:
+            settling = None
+        elif settling is None:
+            settling = t - t0
+    settled = [value for t, value in samples if settling is not None and t - t0 >= settling]
+    return latency, settling, settled
+
+
+# Delay (in sample periods up to LATENCY_LIMIT * 2) that best lines the
+# output up with the command, for profiles without steps
+def _best_lag(out, commands, motor, period):
+    times = [t for t, _ in commands]
+    best = None
+    for n in range(int(2 * LATENCY_LIMIT / period) + 1):
+        lag = n * period
+        error = _tracking_rms(out, commands, times, motor, lag)
+        if best is None or error < best[1]:
+            best = (lag, error)
+    return best[0] if best else None
+
+
+def _tracking_rms(out, commands, times, motor, lag):
+    squares = 0.0
+    for t, value in out:
+        i = bisect.bisect_right(times, t - lag) - 1
+        squares += (value - (commands[i][1][motor] if i >= 0 else MOTOR_STOP)) ** 2
+    return (squares / len(out)) ** 0.5 if out else None
+
+
+def _esc_rpm(data):
+    return decode_esc_sensor_data(data).rpm
+
+
+def _window(samples, times, start, end):
+    return samples[bisect.bisect_right(times, start):bisect.bisect_left(times, end)]
+
+
+class MotorBench:
+    def __init__(self, mux, motor_count=MOTOR_COUNT, rate_hz=SAMPLE_RATE_HZ, timeout=0.5,
+                 max_value=MAX_TEST_VALUE):
+        self.mux = mux
+        self.motor_count = motor_count
+        self.rate_hz = rate_hz
+        self.timeout = timeout
+        self.max_value = max_value
+        self.esc_telemetry = None  # known after the first run
+        self.duration = 0.0
+
+    def _set_motors(self, values):
+        self.mux.send(MSP_SET_MOTOR, REGISTRY[MSP_SET_MOTOR].encode(*values))
+
+    # Record the reply to a sample request (runs on the MSP reader thread)
+    def _sample(self, samples, decode, sent, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        frame = future.result()
+        if frame.is_error:
+            return
+        try:
+            values = decode(frame.payload)
+        except (struct.error, IndexError):
+            return
+        samples.append(((sent + time.monotonic()) / 2, values))
+
+    def _check_disarmed(self):
+        frame = self.mux.request(MSP_STATUS_EX, timeout=self.timeout)
+        if frame is None or frame.is_error:
+            raise RuntimeError("No MSP_STATUS_EX reply; not spinning motors blind")
+        if decode_status_ex(frame.payload).armed:
+            raise RuntimeError("FC is armed; motor test refused")
+        if self.esc_telemetry is None:
+            frame = self.mux.request(MSP_ESC_SENSOR_DATA, timeout=self.timeout)
+            self.esc_telemetry = frame is not None and not frame.is_error and frame.payload[:1] != b'\x00'
+
+    # Drive the profile on the given motors (0-based) at once; returns
+    # (commands, outputs, rpm) as lists of (time, values)
+    def _drive(self, profile, motors):
+        commands, outputs, rpm = [], [], []
+        pending = []
+        requests = [(MSP_MOTOR, outputs, decode_motor)]
+        if self.esc_telemetry:
+            requests.append((MSP_ESC_SENSOR_DATA, rpm, _esc_rpm))
+        last = None
+        start = None
+
+        def tick(now, dt):
+            nonlocal last, start, pending
+            if start is None:
+                start = now
+            t = now - start
+            value = MOTOR_STOP if t >= profile.duration else min(self.max_value, profile.value(t))
+            values = [value if i in motors else MOTOR_STOP for i in range(8)]
+            if values != last:
+                commands.append((time.monotonic(), values))
+                self._set_motors(values)
+                last = values
+            sent = time.monotonic()
+            futures = self.mux.submit_many([cmd for cmd, _, _ in requests])
+            for (cmd, samples, decode), future in zip(requests, futures):
+                future.add_done_callback(
+                    lambda f, samples=samples, decode=decode: self._sample(samples, decode, sent, f))
+                pending.append((cmd, future))
+            pending = [(cmd, f) for cmd, f in pending if not f.done()]
+            return t >= profile.duration + SETTLE_LIMIT
+
+        try:
+            ControlLoop(self.rate_hz).run(tick)
+        finally:
+            self._set_motors([MOTOR_STOP] * 8)
+        wait([f for _, f in pending], self.timeout)
+        for cmd, future in pending:
+            if not future.done():
+                self.mux.cancel(cmd, future)
+        outputs.sort(key=lambda s: s[0])
+        rpm.sort(key=lambda s: s[0])
+        return commands, outputs, rpm
+
+    def _analyse(self, motor, commands, outputs, rpm, end):
+        result = MotorResult(motor + 1)
+        result.samples = len(outputs)
+        out = [(t, values[motor]) for t, values in outputs if motor < len(values)]
+        out_times = [t for t, _ in out]
+        speed = [(t, values[motor]) for t, values in rpm if motor < len(values)]
+        rpm_times = [t for t, _ in speed]
+        latencies, settlings, errors = [], [], []
+        rpm_latencies, rpm_settlings = [], []
+        steps = _steps(commands, motor, end)
+        result.steps = len(steps)
+        for t0, old, new, t1 in steps:
+            window = _window(out, out_times, t0, t1)
+            band = max(SETTLE_BAND, 0.05 * abs(new - old))
+            latency, settling, settled = _response(window, t0, old, new, band)
+            if latency is None:
+                result.problems.append(f"no output response to {old}->{new}")
+                continue
+            latencies.append(latency)
+            if settling is None:
+                result.problems.append(f"output did not settle at {new}")
+            else:
+                settlings.append(settling)
+                errors.extend(abs(value - new) for value in settled)
+            if not speed:
+                continue
+            window = _window(speed, rpm_times, t0, t1)
+            if len(window) < 3:
+                continue
+            before = _window(speed, rpm_times, 0.0, t0)
+            initial = before[-1][1] if before else 0
+            final = sum(value for _, value in window[-3:]) / 3
+            result.rpm_final.append(final)
+            band = max(RPM_SETTLE_MIN, RPM_SETTLE_FRACTION * abs(final))
+            latency, settling, _ = _response(window, t0, initial, final, band)
+            if new > MOTOR_STOP and final < RPM_SETTLE_MIN:
+                result.problems.append(f"not spinning at {new}")
+            if latency is not None:
+                rpm_latencies.append(latency)
+            if settling is not None:
+                rpm_settlings.append(settling)
+
+        if latencies:
+            result.latency = statistics.median(latencies)
+            result.latency_max = max(latencies)
+        if settlings:
+            result.settling_max = max(settlings)
+        if errors:
+            result.mismatch = sum(errors) / len(errors)
+        if rpm_latencies:
+            result.rpm_latency_max = max(rpm_latencies)
+        if rpm_settlings:
+            result.rpm_settling_max = max(rpm_settlings)
+
+        # Tracking error against the command, delayed by the typical latency
+        if result.latency is None and out and not steps:
+            result.latency = result.latency_max = _best_lag(out, commands, motor, 1.0 / self.rate_hz)
+        result.tracking_rms = _tracking_rms(out, commands, [t for t, _ in commands], motor,
+                                            result.latency or 0.0)
+
+        if result.latency_max is not None and result.latency_max > LATENCY_LIMIT:
+            result.problems.append(f"latency {_ms(result.latency_max)}")
+        if result.settling_max is not None and result.settling_max > SETTLE_LIMIT:
+            result.problems.append(f"settling {_ms(result.settling_max)}")
+        if result.mismatch is not None and result.mismatch > MISMATCH_LIMIT:
+            result.problems.append(f"output off command by {result.mismatch:.0f}")
+        if not out:
+            result.problems.append("no MSP_MOTOR samples")
+        return result
+
+    # Run profile on motors (1-based, default all) together, or one after
+    # another with sequential=True. Returns {motor: MotorResult}.
+    def run(self, profile, motors=None, sequential=False):
+        if not isinstance(profile, Profile):
+            profile = Profile(profile)
+        if profile.peak > self.max_value:
+            raise ValueError(f"Profile peaks at {profile.peak}, above the {self.max_value} limit")
+        motors = [m - 1 for m in (motors or range(1, self.motor_count + 1))]
+        self._check_disarmed()
+        start = time.monotonic()
+        results = {}
+        for group in ([[m] for m in motors] if sequential else [motors]):
+            commands, outputs, rpm = self._drive(profile, group)
+            end = time.monotonic()
+            for motor in group:
+                results[motor + 1] = self._analyse(motor, commands, outputs, rpm, end)
+        self.duration = time.monotonic() - start
+
+        # Settled rpm against the mean of every motor at the same step
+        finals = [r.rpm_final for r in results.values() if r.rpm_final]
+        for result in results.values():
+            deviations = []
+            for i, final in enumerate(result.rpm_final):
+                mean = sum(f[i] for f in finals if i < len(f)) / sum(1 for f in finals if i < len(f))
+                if mean >= RPM_SETTLE_MIN:
+                    deviations.append(abs(final - mean) / mean)
+            if deviations:
+                result.rpm_deviation = max(deviations)
+                if result.rpm_deviation > RPM_MISMATCH_LIMIT:
+                    result.problems.append(f"rpm {result.rpm_deviation * 100:.0f}% off the others")
+        return results
+
+
+def print_report(results, duration, esc_telemetry):
+    passed = all(r.passed for r in results.values())
+    print(f"MOTOR TEST {'PASS' if passed else 'FAIL'}  ({duration:.2f}s, "
+          f"ESC telemetry {'yes' if esc_telemetry else 'no'})")
+    for motor, r in results.items():
+        mismatch = "-" if r.mismatch is None else f"{r.mismatch:.1f}"
+        tracking = "-" if r.tracking_rms is None else f"{r.tracking_rms:.1f}"
+        line = (f"  M{motor}  latency {_ms(r.latency)} (max {_ms(r.latency_max)})  "
+                f"settle {_ms(r.settling_max)}  mismatch {mismatch}  tracking {tracking}")
+        if r.rpm_final:
+            deviation = "-" if r.rpm_deviation is None else f"{r.rpm_deviation * 100:.1f}%"
+            line += f"  rpm {max(r.rpm_final):.0f} (latency {_ms(r.rpm_latency_max)}, " \
+                    f"settle {_ms(r.rpm_settling_max)}, off mean {deviation})"
+        print(line)
+        for problem in r.problems:
+            print(f"      {problem}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Motor response test over MSP (PROPS OFF!)")
+    parser.add_argument("--port", default=os.environ.get("MSP_PORT", "/dev/ttyACM0"))
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="step")
+    parser.add_argument("--motors", default=None, help="comma-separated, 1-based (default all)")
+    parser.add_argument("--count", type=int, default=MOTOR_COUNT, help="number of motors")
+    parser.add_argument("--sequential", action="store_true", help="one motor at a time")
+    parser.add_argument("--rate", type=float, default=SAMPLE_RATE_HZ, help="sample rate, Hz")
+    parser.add_argument("--max", type=int, default=MAX_TEST_VALUE, help="highest output allowed")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--yes", action="store_true", help="skip the props-off confirmation")
+    args = parser.parse_args(argv)
+
+    if not args.yes and input("Props removed? Type 'YES' to continue: ") != "YES":
+        print("Test cancelled for safety reasons.")
+        return 1
+    motors = [int(m) for m in args.motors.split(",")] if args.motors else None
+
+    transport = connect_msp(args.port, args.baudrate)
+    mux = MSPMultiplexer(transport).start()
+    try:
+        bench = MotorBench(mux, args.count, args.rate, max_value=args.max)
+        results = bench.run(PROFILES[args.profile], motors, args.sequential)
+    finally:
+        mux.stop()
+        transport.close()
+    if args.json:
+        print(json.dumps({"passed": all(r.passed for r in results.values()),
+                          "duration_ms": round(bench.duration * 1000.0, 1),
+                          "esc_telemetry": bench.esc_telemetry,
+                          "motors": {m: r.as_dict() for m, r in results.items()}}, indent=2))
+    else:
+        print_report(results, bench.duration, bench.esc_telemetry)
+    return 0 if all(r.passed for r in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
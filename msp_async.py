@@ -0,0 +1,181 @@
+import asyncio
+import os
+import struct
+import sys
+
+from msp_messages import (MSP_ALTITUDE, MSP_ANALOG, MSP_BATTERY_STATE, MSP_MOTOR, MSP_RX,
+                          MSP_STATUS_EX, decode_altitude, decode_analog,
+                          decode_battery_state, decode_motor, decode_rx, decode_status_ex)
+from msp_transport import READY_TIMEOUT, MSPMultiplexer, connect_msp, split_request
+from rc_override import RCOverride
+
+# asyncio front end for the MSP stack.
+#
+# The MSPMultiplexer reader thread stays the only thing that reads the port.
+# Its concurrent.futures results are bridged onto the event loop. Any number
+# of coroutines can then await requests at the same time: sensor sampling,
+# telemetry, mission logic, a ground-link server. Each await has its own
+# timeout, and a slow or missing reply only holds up the coroutine waiting
+# for it. Cancelling an await removes its waiter, so a late reply is not
+# handed to somebody else.
+#
+#   async with await AsyncMSPClient.connect("/dev/ttyACM0") as msp:
+#       status, battery = await asyncio.gather(msp.status(), msp.battery())
+#
+# Typed calls return what the msp_messages decoders do (a slotted record
+# or a list), and None on timeout or when the flight controller rejects the
+# command.
+
+class AsyncMSPClient:
+    def __init__(self, mux, timeout=1.0):
+        self.mux = mux
+        self.timeout = timeout
+        self.rc = None
+
+    # Open the port and run the readiness handshake off the event loop, then
+    # start the reader thread. Raises TimeoutError if the FC never answers.
+    @classmethod
+    async def connect(cls, port, baudrate=115200, timeout=1.0, ready_timeout=READY_TIMEOUT):
+        loop = asyncio.get_running_loop()
+        transport = await loop.run_in_executor(None, connect_msp, port, baudrate, ready_timeout)
+        return cls(MSPMultiplexer(transport).start(), timeout)
+
+    @property
+    def info(self):
+        return self.mux.transport.info
+
+    @property
+    def version(self):
+        return self.mux.version
+
+    # Reply frame for cmd, or None after timeout seconds. Cancelling the
+    # awaiting task withdraws the request.
+    async def request(self, cmd, data=None, timeout=None):
+        future = self.mux.submit(cmd, data)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if not future.done() or future.cancelled():
+                self.mux.cancel(cmd, future)
+
+    # Reply payload, or None on timeout / error reply
+    async def payload(self, cmd, data=None, timeout=None):
+        frame = await self.request(cmd, data, timeout)
+        if frame is None or frame.is_error:
+            return None
+        return frame.payload
+
+    # Several requests (command IDs or (cmd, data)) in one write; returns
+    # {cmd: payload or None}
+    async def request_many(self, requests, timeout=None):
+        requests = [split_request(request) for request in requests]
+        if not requests:
+            return {}
+        commands = [cmd for cmd, _ in requests]
+        futures = self.mux.submit_many(requests)
+        try:
+            await asyncio.wait([asyncio.wrap_future(f) for f in futures],
+                               timeout=self.timeout if timeout is None else timeout)
+        finally:
+            for cmd, future in zip(commands, futures):
+                if not future.done() or future.cancelled():
+                    self.mux.cancel(cmd, future)
+        payloads = {}
+        for cmd, future in zip(commands, futures):
+            ok = future.done() and not future.cancelled() and future.exception() is None
+            frame = future.result() if ok else None
+            payloads[cmd] = None if frame is None or frame.is_error else frame.payload
+        return payloads
+
+    async def _decoded(self, cmd, decode, timeout):
+        data = await self.payload(cmd, timeout=timeout)
+        if data is None:
+            return None
+        try:
+            return decode(data)
+        except struct.error:
+            return None  # Short payload
+
+    async def status(self, timeout=None):
+        return await self._decoded(MSP_STATUS_EX, decode_status_ex, timeout)
+
+    async def battery(self, timeout=None):
+        return await self._decoded(MSP_BATTERY_STATE, decode_battery_state, timeout)
+
+    async def analog(self, timeout=None):
+        return await self._decoded(MSP_ANALOG, decode_analog, timeout)
+
+    async def altitude(self, timeout=None):
+        return await self._decoded(MSP_ALTITUDE, decode_altitude, timeout)
+
+    async def rx(self, timeout=None):
+        return await self._decoded(MSP_RX, decode_rx, timeout)
+
+    async def motors(self, timeout=None):
+        return await self._decoded(MSP_MOTOR, decode_motor, timeout)
+
+    # Send MSP_SET_RAW_RC without waiting for the ack (the reader thread
+    # drops it); the write is a few bytes and does not block the loop
+    def set_raw_rc(self, channels):
+        if self.rc is None or self.rc.count != len(channels):
+            self.rc = RCOverride(channels, self.version)
+        else:
+            self.rc.set_channels(channels)
+        self.mux.write_frame(self.rc.frame)
+
+    # Async iterator over every frame of cmd the reader thread sees
+    async def frames(self, cmd, maxsize=64):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize)
+
+        def put(frame):
+            if not queue.full():
+                queue.put_nowait(frame)
+
+        def listener(frame):
+            loop.call_soon_threadsafe(put, frame)
+
+        self.mux.subscribe(cmd, listener)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.mux.unsubscribe(cmd, listener)
+
+    async def close(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.mux.stop)
+        self.mux.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+# Example: status, battery and altitude polled at independent rates
+async def monitor(port, duration=10.0):
+    async with await AsyncMSPClient.connect(port) as msp:
+        async def every(period, name, call):
+            while True:
+                value = await call()
+                print(f"{name}: {value if value is not None else 'no response'}")
+                await asyncio.sleep(period)
+
+        tasks = [asyncio.create_task(every(1.0, "Status", msp.status)),
+                 asyncio.create_task(every(0.5, "Battery", msp.battery)),
+                 asyncio.create_task(every(0.2, "Altitude", msp.altitude))]
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(monitor(os.environ.get("MSP_PORT", "/dev/ttyACM0"),
+                        float(sys.argv[1]) if len(sys.argv) > 1 else 10.0))
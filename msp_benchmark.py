@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from control_loop import ControlLoop
+from msp_messages import (MSP_ALTITUDE, MSP_ANALOG, MSP_BATTERY_STATE, MSP_MOTOR, MSP_RX,
+                          MSP_STATUS_EX, decode_analog, decode_battery_state, decode_rx,
+                          decode_status_ex)
+from msp_protocol import DIRECTION_RESPONSE, MSPParser, encode_v1, encode_v2
+from msp_transport import MSPTransport, open_msp_port
+from rc_override import DEFAULT_CHANNELS, RCOverride
+from sitl_fc import SimulatedFC
+
+# Latency and throughput benchmarks for the MSP stack.
+#
+# Runs against the sitl_fc.py pty stand-in, so the numbers include real
+# pty/serial syscalls but no flight controller. Three groups are measured:
+#
+#   codec      frames/sec for encoding, RC override patching, parsing and
+#              typed payload decoding
+#   roundtrip  request -> reply latency percentiles per MSP command, plus
+#              one pipelined batch of all of them
+#   loop       control-loop jitter at several rates, each tick sending an
+#              RC override frame like the flight loops do
+#
+# The whole suite runs --repeat times and each metric is the median of the
+# runs. Results are written as JSON. --compare flags any metric that got
+# worse than a previous run by more than --threshold:
+#
+#   python msp_benchmark.py --output bench.json
+#   python msp_benchmark.py --compare bench.json
+
+POLL_COMMANDS = {
+    "MSP_STATUS_EX": MSP_STATUS_EX,
+    "MSP_RX": MSP_RX,
+    "MSP_MOTOR": MSP_MOTOR,
+    "MSP_ALTITUDE": MSP_ALTITUDE,
+    "MSP_ANALOG": MSP_ANALOG,
+    "MSP_BATTERY_STATE": MSP_BATTERY_STATE,
+}
+LOOP_RATES = (50, 100, 200, 250)
+
+# Metrics where a bigger number is better; everything else is a latency
+HIGHER_IS_BETTER = ("per_sec",)
+# Reported but never gated on: a handful of late wakeups dominate the
+# maxima, p99s and means of a few hundred samples, and they swing by 2x
+# between identical runs. Latencies are gated on p50/p90 instead.
+UNGATED = ("max_ms", "p99_ms", "mean_ms")
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    if n == 0:
+        return {}
+
+    def pct(p):
+        return samples[min(n - 1, int(p / 100.0 * n))] * 1000.0
+
+    return {
+        "count": n,
+        "mean_ms": sum(samples) / n * 1000.0,
+        "p50_ms": pct(50),
+        "p90_ms": pct(90),
+        "p99_ms": pct(99),
+        "max_ms": samples[-1] * 1000.0,
+    }
+
+
+# Run fn repeatedly for about duration seconds; returns calls per second
+def _rate(fn, duration):
+    calls = 0
+    start = time.perf_counter()
+    end = start + duration
+    while True:
+        for _ in range(100):
+            fn()
+        calls += 100
+        now = time.perf_counter()
+        if now >= end:
+            return calls / (now - start)
+
+
+def bench_codec(duration=1.0):
+    payload = bytes(range(16))
+    rc = RCOverride(DEFAULT_CHANNELS)
+    throttle = [1000]
+
+    def patch_throttle():
+        throttle[0] = 1000 + (throttle[0] + 7) % 1000
+        rc.set_throttle(throttle[0])
+
+    # A stream of mixed telemetry replies, parsed in UART-sized chunks
+    stream = b''.join(encode_v1(cmd, payload, DIRECTION_RESPONSE) for cmd in POLL_COMMANDS.values())
+    stream = stream * 50
+    frames_per_stream = len(POLL_COMMANDS) * 50
+
+    def parse_stream():
+        parser = MSPParser()
+        for i in range(0, len(stream), 256):
+            parser.feed(stream[i:i + 256])
+
+    # Typed payload decoding straight off the parser's memoryview payloads
+    replies = MSPParser().feed(b''.join((
+        encode_v1(MSP_STATUS_EX, bytes(22), DIRECTION_RESPONSE),
+        encode_v1(MSP_BATTERY_STATE, bytes(11), DIRECTION_RESPONSE),
+        encode_v1(MSP_ANALOG, bytes(9), DIRECTION_RESPONSE),
+        encode_v1(MSP_RX, bytes(16), DIRECTION_RESPONSE))))
+    decoders = (decode_status_ex, decode_battery_state, decode_analog, decode_rx)
+
+    def decode_payloads():
+        for frame, decode in zip(replies, decoders):
+            decode(frame.payload)
+
+    return {
+        "encode_v1_per_sec": _rate(lambda: encode_v1(MSP_RX, payload), duration),
+        "encode_v2_per_sec": _rate(lambda: encode_v2(MSP_RX, payload), duration),
+        "rc_override_per_sec": _rate(patch_throttle, duration),
+        "decode_per_sec": _rate(parse_stream, duration) * frames_per_stream,
+        "payload_decode_per_sec": _rate(decode_payloads, duration) * len(decoders),
+    }
+
+
+def bench_roundtrip(transport, count=500):
+    results = {}
+    for name, cmd in POLL_COMMANDS.items():
+        samples = []
+        misses = 0
+        for _ in range(count):
+            start = time.perf_counter()
+            frame = transport.request(cmd, timeout=0.5)
+            if frame is None:
+                misses += 1
+                continue
+            samples.append(time.perf_counter() - start)
+        results[name] = dict(_percentiles(samples), misses=misses)
+
+    samples = []
+    for _ in range(count):
+        snapshot = transport.request_many(list(POLL_COMMANDS.values()), timeout=0.5)
+        if snapshot.complete:
+            samples.append(snapshot.latency)
+    results["batch_all"] = _percentiles(samples)
+    return results
+
+
+def bench_loop(transport, rates=LOOP_RATES, duration=2.0):
+    results = {}
+    rc = RCOverride(DEFAULT_CHANNELS, transport.version)
+    for rate in rates:
+        def step(now, dt):
+            rc.set_throttle(1000)
+            transport.write_frame(rc.frame)
+            # Drop the acks so they do not pile up; read only what has already
+            # arrived, a blocking poll() would add up to READ_SLICE per tick
+            if transport.ser.in_waiting:
+                transport.poll()
+            transport.drain()
+            return False
+
+        stats = ControlLoop(rate).run(step, duration)
+        results[f"{rate}hz"] = stats.as_dict()
+    return results
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(latency=0.0, count=500, loop_duration=2.0, codec_duration=1.0):
+    results = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "sim_latency_ms": latency * 1000.0,
+        "codec": bench_codec(codec_duration),
+    }
+    with SimulatedFC(latency=latency) as sim:
+        transport = MSPTransport(open_msp_port(sim.port))
+        try:
+            transport.handshake()
+            results["msp_version"] = transport.version
+            results["roundtrip"] = bench_roundtrip(transport, count)
+            results["loop"] = bench_loop(transport, duration=loop_duration)
+        finally:
+            transport.close()
+    return results
+
+
+# Per-metric median over several runs, with the same layout as one run
+def _median(runs):
+    merged = {}
+    for key, value in runs[0].items():
+        values = [run[key] for run in runs if key in run]
+        if isinstance(value, dict):
+            merged[key] = _median(values)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            merged[key] = statistics.median(values)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+# Metrics that got worse than baseline by more than threshold (a fraction),
+# leaving out the UNGATED tail metrics. Latency changes smaller than min_delta_ms are scheduling noise and ignored.
+def compare(baseline, current, threshold=0.2, min_delta_ms=0.05):
+    old = _flatten(baseline)
+    new = _flatten(current)
+    regressions = []
+    for name, value in new.items():
+        if name not in old or not name.endswith(("_ms", "_per_sec")) or old[name] <= 0:
+            continue
+        if name.endswith(UNGATED):
+            continue
+        if name.endswith("_ms") and abs(value - old[name]) < min_delta_ms:
+            continue
+        change = (value - old[name]) / old[name]
+        if name.endswith(HIGHER_IS_BETTER):
+            change = -change
+        if change > threshold:
+            regressions.append((name, old[name], value, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MSP stack latency/throughput benchmarks")
+    parser.add_argument("--output", help="write JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="previous JSON results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative change counted as a regression (default 0.2)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.05,
+                        help="ignore latency changes smaller than this (default 0.05)")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated reply latency, s")
+    parser.add_argument("--count", type=int, default=500, help="round trips per command")
+    parser.add_argument("--loop-duration", type=float, default=2.0, help="seconds per loop rate")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs to take the per-metric median of (default 3)")
+    args = parser.parse_args(argv)
+
+    results = _median([run(args.latency, args.count, args.loop_duration)
+                       for _ in range(max(1, args.repeat))])
+    results["repeat"] = max(1, args.repeat)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold, args.min_delta_ms)
+        for name, old, new, change in regressions:
+            print(f"REGRESSION {name}: {old:.4g} -> {new:.4g} ({change:+.0%})", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
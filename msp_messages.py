@@ -0,0 +1,327 @@
+import struct
+
+# MSP message registry.
+#
+# Every MSP message the tools use is one entry in MESSAGES at the bottom:
+# name, command ID, direction and payload layout (Betaflight layouts). At
+# import each layout is compiled once into a precompiled struct.Struct and a
+# slotted record type, plus a generated decoder that unpacks and scales in
+# one pass. REGISTRY maps both the ID and the name to the MSPMessage, and
+# for each entry the module exports, generated from the table and listed in
+# __all__,
+#
+#   MSP_<NAME>      the command ID
+#   <record>        the record type (BatteryReading, ...), if it has one
+#   decode_<name>   payload (bytes or the parser's memoryview) -> record or list
+#
+# struct.error from a decoder means the payload was too short. Adding a
+# telemetry message is one table entry; flight_export.py builds its numpy
+# layouts from the same fields.
+
+# Directions: replies the FC sends when asked, and commands it receives
+FROM_FC = "from_fc"
+TO_FC = "to_fc"
+
+
+# Betaflight 4.5 arming disable flags, by bit (armingDisableFlags_e)
+ARMING_DISABLE_FLAG_NAMES = (
+    "NOGYRO", "FAILSAFE", "RXLOSS", "NOT_DISARMED", "BOXFAILSAFE", "RUNAWAY", "CRASH",
+    "THROTTLE", "ANGLE", "BOOTGRACE", "NOPREARM", "LOAD", "CALIB", "CLI", "CMS", "BST",
+    "MSP", "PARALYZE", "GPS", "RESCUE_SW", "RPMFILTER", "REBOOT_REQD", "DSHOT_BBANG",
+    "NO_ACC_CAL", "MOTOR_PROTO", "ARMSWITCH",
+)
+
+# MSP_STATUS_EX sensors bitmask
+SENSOR_ACC = 1 << 0
+SENSOR_BARO = 1 << 1
+SENSOR_MAG = 1 << 2
+SENSOR_GPS = 1 << 3
+SENSOR_RANGEFINDER = 1 << 4
+SENSOR_GYRO = 1 << 5
+
+
+# Bits newer firmware may add are reported by number
+_ARMING_DISABLE_NAMES32 = ARMING_DISABLE_FLAG_NAMES + tuple(
+    f"BIT{bit}" for bit in range(len(ARMING_DISABLE_FLAG_NAMES), 32))
+
+# Flag names for every value of each byte of the arming disable mask, so a
+# mask decodes with four lookups instead of a test per bit
+_ARMING_DISABLE_BYTES = tuple(
+    tuple(tuple(_ARMING_DISABLE_NAMES32[base + bit] for bit in range(8) if value & (1 << bit))
+          for value in range(256))
+    for base in range(0, 32, 8))
+
+
+# Names of the arming disable flags set in flags
+def arming_disable_reasons(flags):
+    low, mid, high, top = _ARMING_DISABLE_BYTES
+    return (low[flags & 0xFF] + mid[(flags >> 8) & 0xFF] +
+            high[(flags >> 16) & 0xFF] + top[(flags >> 24) & 0xFF])
+
+
+# MSP_STATUS_EX up to the arming disable flags, one layout per count of
+# extra flight mode bytes (0 on current firmware)
+_STATUS_EX_BASE = struct.Struct('<HHHIBH')
+_STATUS_EX = {}
+
+
+def _status_ex_struct(extra_mode_bytes):
+    layout = _STATUS_EX.get(extra_mode_bytes)
+    if layout is None:
+        layout = _STATUS_EX[extra_mode_bytes] = struct.Struct(f'<HHHIBHBBx{extra_mode_bytes}sBIB')
+    return layout
+
+
+class _Record:
+    __slots__ = ()
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class StatusEx(_Record):
+    __slots__ = ('cycle_time', 'i2c_errors', 'sensors', 'flight_mode_flags', 'pid_profile',
+                 'system_load', 'pid_profile_count', 'rate_profile', 'extra_flight_mode_flags',
+                 'arming_disable_count', 'arming_disable_flags', 'config_state')
+
+    def __init__(self, cycle_time, i2c_errors, sensors, flight_mode_flags, pid_profile,
+                 system_load, pid_profile_count=None, rate_profile=None,
+                 extra_flight_mode_flags=b'', arming_disable_count=None,
+                 arming_disable_flags=None, config_state=None):
+        self.cycle_time = cycle_time  # us
+        self.i2c_errors = i2c_errors
+        self.sensors = sensors  # SENSOR_* bits
+        self.flight_mode_flags = flight_mode_flags
+        self.pid_profile = pid_profile
+        self.system_load = system_load  # percent * 10
+        self.pid_profile_count = pid_profile_count
+        self.rate_profile = rate_profile
+        self.extra_flight_mode_flags = extra_flight_mode_flags
+        self.arming_disable_count = arming_disable_count
+        self.arming_disable_flags = arming_disable_flags  # None on firmware without them
+        self.config_state = config_state
+
+    @property
+    def armed(self):
+        return bool(self.flight_mode_flags & 1)  # BOXARM is flight mode bit 0
+
+    @property
+    def arming_disable_reasons(self):
+        return arming_disable_reasons(self.arming_disable_flags or 0)
+
+    def has_sensor(self, sensor):
+        return bool(self.sensors & sensor)
+
+    def __repr__(self):
+        reasons = ",".join(self.arming_disable_reasons) or "none"
+        return (f"StatusEx({'ARMED' if self.armed else 'disarmed'}, cycle {self.cycle_time} us, "
+                f"load {self.system_load / 10:.1f}%, arming disabled: {reasons})")
+
+
+def decode_status_ex(data):
+    if len(data) < 16:
+        return StatusEx(*_STATUS_EX_BASE.unpack_from(data))  # Pre-4.0 firmware
+    return StatusEx(*_status_ex_struct(data[15]).unpack_from(data))
+
+
+class EscTelemetry(_Record):
+    __slots__ = ('temperature', 'rpm')
+
+    def __init__(self, temperature, rpm):
+        self.temperature = temperature  # degrees C per motor
+        self.rpm = rpm  # per motor
+
+
+_U8 = struct.Struct('<B')
+_ESC_SENSOR_DATA = {}
+
+
+# Per-motor ESC telemetry (ESC sensor or bidirectional DShot)
+def decode_esc_sensor_data(data):
+    count = _U8.unpack_from(data)[0]
+    layout = _ESC_SENSOR_DATA.get(count)
+    if layout is None:
+        layout = _ESC_SENSOR_DATA[count] = struct.Struct('<x' + 'BH' * count)
+    values = layout.unpack_from(data)
+    return EscTelemetry(list(values[0::2]), list(values[1::2]))
+
+
+# MSP_ANALOG carries neither cell count nor capacity
+class _Analog(_Record):
+    __slots__ = ()
+    cells = 0
+    capacity = 0
+
+
+# One registry entry. Fields are (name, struct code[, scale[, fallback]]):
+# the raw value is divided by scale (Betaflight's fixed point units), and
+# extra fields are ones newer firmware appends; on older firmware they take
+# the value of their fallback field, or None. Array messages are a run of
+# one struct code instead of fields. Messages with a layout the table
+# cannot describe bring their own record and decoder.
+class MSPMessage:
+    __slots__ = ('name', 'cmd', 'direction', 'fields', 'extra', 'array', 'record', 'layout',
+                 'full_layout', 'decode', '_arrays')
+
+    def __init__(self, name, cmd, direction, fields=(), extra=(), array=None, record=None,
+                 decode=None, base=_Record):
+        self.name = name
+        self.cmd = cmd
+        self.direction = direction
+        self.fields = tuple(fields)
+        self.extra = tuple(extra)
+        self.array = array
+        self.record = record
+        self.layout = struct.Struct('<' + ''.join(f[1] for f in self.fields))
+        self.full_layout = struct.Struct(self.layout.format + ''.join(f[1] for f in self.extra))
+        self._arrays = {}
+        if decode is not None:
+            self.decode = decode
+        elif array is not None:
+            self.decode = self._decode_array
+        else:
+            if not isinstance(record, type):
+                record = record or "".join(part.title() for part in name.split("_"))
+                self.record = _record_type(record, [f[0] for f in self.fields + self.extra], base)
+            self.decode = _compile_decoder(self)
+
+    def _array_layout(self, count):
+        layout = self._arrays.get(count)
+        if layout is None:
+            layout = self._arrays[count] = struct.Struct(f'<{count}{self.array}')
+        return layout
+
+    def _decode_array(self, data):
+        return list(self._array_layout(len(data) // struct.calcsize(self.array)).unpack_from(data))
+
+    # Payload bytes for this message: one value per field (all of them,
+    # extras included) in engineering units, or the array items
+    def encode(self, *values):
+        if self.array is not None:
+            return self._array_layout(len(values)).pack(*values)
+        fields = self.fields + self.extra
+        if len(values) == len(self.fields):
+            fields, layout = self.fields, self.layout
+        else:
+            layout = self.full_layout
+        return layout.pack(*(round(v * f[2]) if len(f) > 2 and f[2] != 1 else v
+                             for f, v in zip(fields, values)))
+
+    def __repr__(self):
+        return f"MSPMessage({self.name}, {self.cmd}, {self.direction})"
+
+
+# Slotted _Record subclass with a generated positional __init__
+def _record_type(name, slots, base=_Record):
+    args = ", ".join(slots)
+    body = "".join(f"\n    self.{slot} = {slot}" for slot in slots) or "\n    pass"
+    namespace = {}
+    exec(f"def __init__(self, {args}):{body}", namespace)
+    return type(name, (base,), {"__slots__": tuple(slots), "__init__": namespace["__init__"],
+                                "__module__": __name__})
+
+
+# Straight-line decoder for a fixed layout: one unpack_from, the scaling
+# inlined, and the extra fields only unpacked when the payload has them
+def _compile_decoder(message):
+    def values(fields, count):
+        exprs = []
+        for i, field in enumerate(fields):
+            if i >= count:
+                fallback = field[3] if len(field) > 3 else None
+                exprs.append(exprs[[f[0] for f in fields].index(fallback)] if fallback else "None")
+            elif len(field) > 2 and field[2] != 1:
+                exprs.append(f"v{i} / {float(field[2])!r}")
+            else:
+                exprs.append(f"v{i}")
+        return ", ".join(exprs)
+
+    def names(count):
+        return "".join(f"v{i}, " for i in range(count))
+
+    fields = message.fields + message.extra
+    base = len(message.fields)
+    source = "def decode(data):\n"
+    if message.extra:
+        source += (f"    if len(data) >= {message.full_layout.size}:\n"
+                   f"        {names(len(fields))}= full_unpack(data)\n"
+                   f"        return record({values(fields, len(fields))})\n")
+    source += (f"    {names(base)}= unpack(data)\n"
+               f"    return record({values(fields, base)})\n")
+    namespace = {"unpack": message.layout.unpack_from,
+                 "full_unpack": message.full_layout.unpack_from, "record": message.record}
+    exec(source, namespace)
+    return namespace["decode"]
+
+
+MESSAGES = (
+    MSPMessage("API_VERSION", 1, FROM_FC, record="ApiVersion",
+               fields=(("protocol", "B"), ("api_major", "B"), ("api_minor", "B"))),
+    MSPMessage("FC_VARIANT", 2, FROM_FC, record="FcVariant", fields=(("identifier", "4s"),)),
+    MSPMessage("FC_VERSION", 3, FROM_FC, record="FcVersion",
+               fields=(("major", "B"), ("minor", "B"), ("patch", "B"))),
+    MSPMessage("STATUS", 101, FROM_FC, record="Status",
+               fields=(("cycle_time", "H"), ("i2c_errors", "H"), ("sensors", "H"),
+                       ("flight_mode_flags", "I"), ("pid_profile", "B"))),
+    # acc, gyro and mag x/y/z in raw sensor units
+    MSPMessage("RAW_IMU", 102, FROM_FC, record="RawImu",
+               fields=tuple((f"{sensor}_{axis}", "h") for sensor in ("acc", "gyro", "mag")
+                            for axis in "xyz")),
+    MSPMessage("MOTOR", 104, FROM_FC, array="H"),  # Motor outputs, us or DShot value
+    MSPMessage("RX", 105, FROM_FC, array="H"),  # Channels, us
+    # Degrees (roll/pitch in 0.1 deg)
+    MSPMessage("ATTITUDE", 108, FROM_FC, record="Attitude",
+               fields=(("roll", "h", 10), ("pitch", "h", 10), ("yaw", "h"))),
+    # m and m/s (cm on the wire)
+    MSPMessage("ALTITUDE", 109, FROM_FC, record="AltitudeReading",
+               fields=(("altitude", "i", 100), ("vario", "h", 100))),
+    # V, A and 0-1023 rssi; Betaflight 4.x appends the voltage in 0.01 V
+    MSPMessage("ANALOG", 110, FROM_FC, record="AnalogReading", base=_Analog,
+               fields=(("vbat", "B", 10), ("mah_drawn", "H"), ("rssi", "H"),
+                       ("current", "h", 100)),
+               extra=(("voltage", "H", 100, "vbat"),)),
+    # cells and capacity are 0 when unknown; state 0 OK, 1 warning, 2 critical, ...
+    MSPMessage("BATTERY_STATE", 130, FROM_FC, record="BatteryReading",
+               fields=(("cells", "B"), ("capacity", "H"), ("vbat", "B", 10), ("mah_drawn", "H"),
+                       ("current", "H", 100), ("state", "B")),
+               extra=(("voltage", "H", 100, "vbat"),)),
+    MSPMessage("ESC_SENSOR_DATA", 134, FROM_FC, record=EscTelemetry,
+               decode=decode_esc_sensor_data),
+    MSPMessage("STATUS_EX", 150, FROM_FC, record=StatusEx, decode=decode_status_ex),
+    MSPMessage("SET_RAW_RC", 200, TO_FC, array="H"),  # Channels, us
+    MSPMessage("SET_MOTOR", 214, TO_FC, array="H"),  # 8 motor outputs, us
+    # Direct arm/disarm as arm.py sends it; sitl_fc.py answers it, stock
+    # Betaflight does not implement it
+    MSPMessage("SET_ARMED", 216, TO_FC, record="ArmCommand", fields=(("armed", "B"),)),
+)
+
+REGISTRY = {}
+_EXPORTS = {}
+for _message in MESSAGES:
+    if _message.cmd in REGISTRY or _message.name in REGISTRY:
+        raise ValueError(f"Duplicate MESSAGES entry: {_message}")
+    REGISTRY[_message.cmd] = REGISTRY[_message.name] = _message
+    _EXPORTS["MSP_" + _message.name] = _message.cmd
+    if _message.record is not None:
+        _EXPORTS[_message.record.__name__] = _message.record
+    _EXPORTS["decode_" + _message.name.lower()] = _message.decode
+for _name, _value in _EXPORTS.items():
+    if globals().get(_name, _value) is not _value:
+        raise ValueError(f"MESSAGES export {_name} shadows a module name")
+globals().update(_EXPORTS)
+del _message, _name, _value
+
+__all__ = [
+    "FROM_FC", "TO_FC", "ARMING_DISABLE_FLAG_NAMES", "SENSOR_ACC", "SENSOR_BARO", "SENSOR_MAG",
+    "SENSOR_GPS", "SENSOR_RANGEFINDER", "SENSOR_GYRO", "arming_disable_reasons", "MSPMessage",
+    "MESSAGES", "REGISTRY", "decode",
+] + list(_EXPORTS)
+
+
+# Decode a reply payload by command ID
+def decode(cmd, data):
+    return REGISTRY[cmd].decode(data)
@@ -0,0 +1,266 @@
+import struct
+
+# MSP framing shared by every script that talks to the flight controller.
+# Nothing in here touches the serial port, so the encoder and parser can be
+# reused by the transport, the tools and anything that replays raw bytes.
+
+MSP_V1_REQUEST = b'$M<'
+MSP_V1_RESPONSE = b'$M>'
+MSP_V1_ERROR = b'$M!'
+MSP_V2_REQUEST = b'$X<'
+MSP_V2_RESPONSE = b'$X>'
+MSP_V2_ERROR = b'$X!'
+
+DIRECTION_REQUEST = 0x3C  # '<'
+DIRECTION_RESPONSE = 0x3E  # '>'
+DIRECTION_ERROR = 0x21  # '!'
+
+_PROTO_V1 = 0x4D  # 'M'
+_PROTO_V2 = 0x58  # 'X'
+_V1_HEADER = struct.Struct('<3sBB')  # $M< + size + cmd
+_V2_HEADER = struct.Struct('<3sBHH')  # $X< + flags + cmd + size
+_V1_MAX_PAYLOAD = 255
+_V2_MAX_PAYLOAD = 0xFFFF
+
+# Longest payload the parser accepts by default. Betaflight's MSP reply
+# buffer is 512 bytes (dataflash reads aside); a longer v2 size field is
+# taken as corruption instead of waiting for up to 64 KB that never comes.
+MAX_PAYLOAD = 512
+
+# XOR of all bytes in data, folded on one big integer instead of a Python loop
+def xor_checksum(data, initial=0):
+    n = len(data)
+    if n == 0:
+        return initial
+    x = int.from_bytes(data, 'little')
+    while n > 1:
+        half = (n + 1) // 2
+        x = (x & ((1 << (half * 8)) - 1)) ^ (x >> (half * 8))
+        n = half
+    return (x ^ initial) & 0xFF
+
+
+# CRC-8/DVB-S2 (polynomial 0xD5) as used by MSP v2, one table lookup per byte
+def _crc8_table(poly=0xD5):
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC8_DVB_S2_TABLE = _crc8_table()
+
+
+def crc8_dvb_s2(data, crc=0):
+    table = CRC8_DVB_S2_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+
+# Frame preambles by direction byte, so encoding does not build them per call
+_V1_PREAMBLE = {d: b'$M' + bytes((d,)) for d in (DIRECTION_REQUEST, DIRECTION_RESPONSE,
+                                                  DIRECTION_ERROR)}
+_V2_PREAMBLE = {d: b'$X' + bytes((d,)) for d in (DIRECTION_REQUEST, DIRECTION_RESPONSE,
+                                                  DIRECTION_ERROR)}
+
+
+# Build one MSP v1 frame: $M< + size + cmd + payload + xor(size, cmd, payload).
+# The frame is assembled in one preallocated bytearray.
+def encode_v1(cmd, payload=b'', direction=DIRECTION_REQUEST):
+    if payload is None:
+        payload = b''
+    elif not isinstance(payload, (bytes, bytearray, memoryview)):
+        payload = bytes(payload)
+    size = len(payload)
+    if size > _V1_MAX_PAYLOAD:
+        raise ValueError(f"MSP v1 payload too large: {size} bytes")
+    if not 0 <= cmd <= 0xFF:
+        raise ValueError(f"MSP v1 command out of range: {cmd}")
+    frame = bytearray(6 + size)
+    _V1_HEADER.pack_into(frame, 0, _V1_PREAMBLE.get(direction) or b'$M' + bytes((direction,)),
+                         size, cmd)
+    frame[5:5 + size] = payload
+    frame[-1] = xor_checksum(payload, size ^ cmd)
+    return frame
+
+
+# Build one MSP v2 frame: $X< + flags + cmd(u16) + size(u16) + payload + crc8.
+# The CRC covers everything between the header and the CRC byte itself.
+def encode_v2(cmd, payload=b'', direction=DIRECTION_REQUEST, flags=0):
+    if payload is None:
+        payload = b''
+    elif not isinstance(payload, (bytes, bytearray, memoryview)):
+        payload = bytes(payload)
+    size = len(payload)
+    if size > _V2_MAX_PAYLOAD:
+        raise ValueError(f"MSP v2 payload too large: {size} bytes")
+    if not 0 <= cmd <= 0xFFFF:
+        raise ValueError(f"MSP v2 command out of range: {cmd}")
+    frame = bytearray(9 + size)
+    _V2_HEADER.pack_into(frame, 0, _V2_PREAMBLE.get(direction) or b'$X' + bytes((direction,)),
+                         flags, cmd, size)
+    frame[8:8 + size] = payload
+    frame[-1] = crc8_dvb_s2(memoryview(frame)[3:-1])
+    return frame
+
+
+# Pick the framing for a request: v2 when negotiated, or whenever the
+# command ID or payload does not fit in a v1 frame
+def encode(cmd, payload=b'', version=1, direction=DIRECTION_REQUEST):
+    if version >= 2 or cmd > 0xFF or (payload is not None and len(payload) > _V1_MAX_PAYLOAD):
+        return encode_v2(cmd, payload, direction)
+    return encode_v1(cmd, payload, direction)
+
+
+# payload is a read-only memoryview into the chunk of bytes it was parsed
+# from; bytes(frame.payload) makes an owned copy
+class MSPFrame:
+    __slots__ = ('cmd', 'payload', 'direction', 'version')
+
+    def __init__(self, cmd, payload, direction=DIRECTION_RESPONSE, version=1):
+        self.cmd = cmd
+        self.payload = payload
+        self.direction = direction
+        self.version = version
+
+    @property
+    def is_error(self):
+        return self.direction == DIRECTION_ERROR
+
+    def __repr__(self):
+        return (f"MSPFrame(cmd={self.cmd}, len={len(self.payload)}, "
+                f"dir={chr(self.direction)!r}, v{self.version})")
+
+
+# Incremental MSP frame parser.
+#
+# Each chunk the UART hands us becomes the receive buffer as is. Only the
+# unfinished tail of the previous chunk (at most one partial frame) is
+# copied in front of it. The buffer is immutable, so frames can point into
+# it: payloads are memoryview slices, and checksums run over views, so no
+# bytes are copied per frame. The parser walks the buffer with a small
+# state machine (SYNC -> HEADER -> PAYLOAD), verifies the v1 XOR checksum
+# or v2 CRC8 and emits complete frames. Anything that does not look like a
+# frame - line noise, a truncated reply, a bad checksum, a size over
+# max_payload - is skipped by resyncing on the next '$'.
+class MSPParser:
+    STATE_SYNC = 0
+    STATE_HEADER = 1
+    STATE_PAYLOAD = 2
+
+    def __init__(self, directions=(DIRECTION_RESPONSE, DIRECTION_ERROR), max_payload=MAX_PAYLOAD):
+        self.max_payload = max_payload
+        self._buf = b''
+        self._view = memoryview(self._buf)
+        self._pos = 0
+        self._state = self.STATE_SYNC
+        self._frame_len = 0
+        self._version = 1
+        self.directions = frozenset(directions)
+
+        # Link statistics
+        self.frames = 0
+        self.checksum_errors = 0
+        self.oversize_frames = 0
+        self.dropped_bytes = 0
+
+    def reset(self):
+        self._buf = b''
+        self._view = memoryview(self._buf)
+        self._pos = 0
+        self._state = self.STATE_SYNC
+        self._frame_len = 0
+        self._version = 1
+
+    @property
+    def pending(self):
+        return len(self._buf) - self._pos
+
+    # Append raw bytes and return the list of complete frames they finished
+    def feed(self, data):
+        if data:
+            if not isinstance(data, bytes):
+                data = bytes(data)
+            if self._pos < len(self._buf):
+                data = self._buf[self._pos:] + data
+            self._buf = data
+            self._view = memoryview(data)
+            self._pos = 0
+        frames = []
+        frame = self._next_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self._next_frame()
+        return frames
+
+    def _resync(self, start):
+        # Skip the '$' we locked onto and look for the next one
+        self.dropped_bytes += 1
+        self._pos = start + 1
+        self._state = self.STATE_SYNC
+
+    def _next_frame(self):
+        buf = self._buf
+        end = len(buf)
+        while True:
+            start = self._pos
+
+            if self._state == self.STATE_SYNC:
+                sync = buf.find(b'$', start)
+                if sync < 0:
+                    self.dropped_bytes += end - start
+                    self._pos = end
+                    return None
+                self.dropped_bytes += sync - start
+                self._pos = start = sync
+                self._state = self.STATE_HEADER
+
+            if self._state == self.STATE_HEADER:
+                if end - start < 3:
+                    return None
+                proto = buf[start + 1]
+                if proto not in (_PROTO_V1, _PROTO_V2) or buf[start + 2] not in self.directions:
+                    self._resync(start)
+                    continue
+                if proto == _PROTO_V1:
+                    if end - start < 5:
+                        return None
+                    self._version = 1
+                    size = buf[start + 3]
+                    self._frame_len = 5 + size + 1
+                else:
+                    if end - start < 8:
+                        return None
+                    self._version = 2
+                    size = buf[start + 6] | (buf[start + 7] << 8)
+                    self._frame_len = 8 + size + 1
+                if size > self.max_payload:
+                    self.oversize_frames += 1
+                    self._resync(start)
+                    continue
+                self._state = self.STATE_PAYLOAD
+
+            # STATE_PAYLOAD: wait until the whole frame is buffered
+            frame_end = start + self._frame_len
+            if frame_end > end:
+                return None
+            body = self._view[start + 3:frame_end - 1]
+            if self._version == 1:
+                valid = xor_checksum(body) == buf[frame_end - 1]
+            else:
+                valid = crc8_dvb_s2(body) == buf[frame_end - 1]
+            if not valid:
+                self.checksum_errors += 1
+                self._resync(start)
+                continue
+
+            self._pos = frame_end
+            self._state = self.STATE_SYNC
+            self.frames += 1
+            if self._version == 1:
+                return MSPFrame(buf[start + 4], body[2:], buf[start + 2], 1)
+            return MSPFrame(body[1] | (body[2] << 8), body[5:], buf[start + 2], 2)
@@ -0,0 +1,610 @@
+import array
+import collections
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import serial
+
+from msp_messages import MSP_API_VERSION, MSP_FC_VARIANT, MSP_FC_VERSION, MSP_SET_RAW_RC
+from msp_protocol import MSPParser, encode, encode_v1, encode_v2
+from rc_override import RCOverride
+
+# Serial read timeout used by the transport. Reads return as soon as any
+# bytes are available, so this only bounds how long an idle read blocks
+# before the caller's own deadline is re-checked.
+READ_SLICE = 0.01
+
+READY_TIMEOUT = 5.0  # seconds the handshake waits for the FC to start answering
+READY_POLL = 0.05  # seconds between readiness probes
+
+
+# Batch requests are a command ID or (cmd, data); both become (cmd, data)
+def split_request(request):
+    if isinstance(request, int):
+        return request, None
+    return request
+
+
+# Result of one pipelined batch of requests: the reply frame per command and
+# how long it took from the single write until the last reply arrived
+class MSPSnapshot:
+    __slots__ = ('frames', 'commands', 'sent_at', 'latency')
+
+    def __init__(self, commands, sent_at):
+        self.frames = {}
+        self.commands = commands
+        self.sent_at = sent_at
+        self.latency = None
+
+    def add(self, frame, now):
+        self.frames[frame.cmd] = frame
+        self.latency = now - self.sent_at
+
+    @property
+    def complete(self):
+        return len(self.frames) == len(self.commands)
+
+    @property
+    def missing(self):
+        return [cmd for cmd in self.commands if cmd not in self.frames]
+
+    # Reply payload for cmd, or None if it never arrived or was rejected
+    def payload(self, cmd):
+        frame = self.frames.get(cmd)
+        if frame is None or frame.is_error:
+            return None
+        return frame.payload
+
+
+# What the flight controller told us during the readiness handshake
+class FCInfo:
+    __slots__ = ('msp_version', 'protocol', 'api_version', 'variant', 'fc_version',
+                 'ready_after')
+
+    def __init__(self, msp_version, protocol, api_version, variant=None, fc_version=None,
+                 ready_after=0.0):
+        self.msp_version = msp_version  # framing used from now on, 1 or 2
+        self.protocol = protocol
+        self.api_version = api_version  # (major, minor)
+        self.variant = variant  # e.g. 'BTFL', or None if not answered
+        self.fc_version = fc_version  # (major, minor, patch) or None
+        self.ready_after = ready_after  # seconds from handshake start to first reply
+
+    def api_at_least(self, major, minor):
+        return self.api_version >= (major, minor)
+
+    def __repr__(self):
+        version = '.'.join(map(str, self.fc_version)) if self.fc_version else '?'
+        return (f"FCInfo({self.variant or '?'} {version}, API {self.api_version[0]}."
+                f"{self.api_version[1]}, MSP v{self.msp_version}, "
+                f"ready after {self.ready_after * 1000:.0f} ms)")
+
+
+# Open the flight controller UART with settings suited to bulk reads
+def open_msp_port(port, baudrate=115200):
+    return serial.Serial(port, baudrate, timeout=READ_SLICE)
+
+
+# Open the port and wait until the FC answers (see MSPTransport.handshake).
+# Returns the ready transport; raises TimeoutError if the FC never answers.
+def connect_msp(port, baudrate=115200, timeout=READY_TIMEOUT):
+    transport = MSPTransport(open_msp_port(port, baudrate))
+    if transport.handshake(timeout) is None:
+        transport.close()
+        raise TimeoutError(f"No MSP reply from {port} within {timeout:.1f}s")
+    return transport
+
+
+# Buffered MSP transport over an open serial port.
+#
+# Instead of one ser.read() per header field, each read pulls everything the
+# UART has buffered in a single call and hands it to the frame parser.
+# Decoded frames queue up until a caller asks for them.
+class MSPTransport:
+    def __init__(self, ser):
+        self.ser = ser
+        self.version = 1  # MSP framing used for requests, set by handshake()
+        self.info = None  # FCInfo from handshake()
+        self.parser = MSPParser()
+        self._frames = collections.deque()
+        self.bytes_read = 0
+        self.reads = 0
+
+    def send(self, cmd, data=None):
+        self.ser.write(encode(cmd, data, self.version))
+
+    # Write an already encoded frame, e.g. the RCOverride buffer
+    def write_frame(self, frame):
+        self.ser.write(frame)
+
+    # Encode several requests and push them to the UART in one write
+    def send_many(self, requests):
+        frames = []
+        commands = []
+        for request in requests:
+            cmd, data = split_request(request)
+            frames.append(encode(cmd, data, self.version))
+            commands.append(cmd)
+        self.ser.write(b''.join(frames))
+        return commands
+
+    # Read whatever the UART has (blocking at most one read slice) and parse it
+    def poll(self):
+        waiting = self.ser.in_waiting
+        chunk = self.ser.read(waiting if waiting > 0 else 1)
+        if chunk:
+            self.reads += 1
+            self.bytes_read += len(chunk)
+            self._frames.extend(self.parser.feed(chunk))
+        return len(self._frames)
+
+    # Hand over every frame decoded so far
+    def drain(self):
+        frames = list(self._frames)
+        self._frames.clear()
+        return frames
+
+    # Next decoded frame of any command, or None after timeout seconds
+    def read_frame(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while not self._frames:
+            if time.monotonic() >= deadline:
+                return None
+            self.poll()
+        return self._frames.popleft()
+
+    # Next frame for cmd; unrelated frames that arrive first are discarded
+    def read_response(self, cmd, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = self.read_frame(max(0.0, deadline - time.monotonic()))
+            if frame is None or frame.cmd == cmd:
+                return frame
+
+    def request(self, cmd, data=None, timeout=1.0):
+        self.send(cmd, data)
+        return self.read_response(cmd, timeout)
+
+    # Pipelined poll: one write for all requests, replies matched as they
+    # arrive. Frames for other commands are discarded.
+    def request_many(self, requests, timeout=1.0):
+        commands = list(dict.fromkeys(self.send_many(requests)))
+        snapshot = MSPSnapshot(commands, time.monotonic())
+        wanted = set(commands)
+        deadline = snapshot.sent_at + timeout
+        while wanted:
+            frame = self.read_frame(max(0.0, deadline - time.monotonic()))
+            if frame is None:
+                break
+            if frame.cmd in wanted:
+                wanted.discard(frame.cmd)
+                snapshot.add(frame, time.monotonic())
+        return snapshot
+
+    # Swap in a freshly opened port after a reconnect. Half-parsed bytes and
+    # undelivered frames from the old connection are dropped.
+    def reopen(self, ser):
+        try:
+            self.ser.close()
+        except (serial.SerialException, OSError):
+            pass
+        self.ser = ser
+        self.parser.reset()
+        self._frames.clear()
+
+    # Readiness handshake, in place of a fixed sleep after opening the port:
+    # drop whatever is buffered (boot messages, replies meant for a previous
+    # process), then probe MSP_API_VERSION in v1 and v2 framing every
+    # READY_POLL seconds until the FC answers. A v2 reply switches to MSP v2.
+    # FC_VARIANT/FC_VERSION follow in one pipelined request. Returns the
+    # FCInfo (also kept as self.info), or None on timeout.
+    def handshake(self, timeout=READY_TIMEOUT, poll=READY_POLL):
+        start = time.monotonic()
+        deadline = start + timeout
+        self.ser.reset_input_buffer()
+        self.parser.reset()
+        self._frames.clear()
+        probe = encode_v1(MSP_API_VERSION) + encode_v2(MSP_API_VERSION)
+
+        reply = None
+        ready_after = 0.0
+        while reply is None and time.monotonic() < deadline:
+            self.ser.write(probe)
+            probe_end = min(deadline, time.monotonic() + poll)
+            # Once the v1 reply is in, the v2 one follows at once if supported
+            while True:
+                frame = self.read_response(MSP_API_VERSION, max(0.0, probe_end - time.monotonic()))
+                if frame is None:
+                    break
+                if frame.is_error:
+                    continue
+                if reply is None:
+                    ready_after = time.monotonic() - start
+                if reply is None or frame.version == 2:
+                    reply = frame
+                if frame.version == 2:
+                    break
+        if reply is None or len(reply.payload) < 3:
+            return None
+
+        self.version = reply.version
+        protocol, major, minor = reply.payload[:3]
+        # Older firmware may ignore these; do not spend the whole timeout on them
+        snapshot = self.request_many((MSP_FC_VARIANT, MSP_FC_VERSION), 5 * poll)
+        variant = snapshot.payload(MSP_FC_VARIANT)
+        fc_version = snapshot.payload(MSP_FC_VERSION)
+        self.info = FCInfo(
+            self.version, protocol, (major, minor),
+            bytes(variant[:4]).decode('ascii', 'replace') if variant else None,
+            tuple(fc_version[:3]) if fc_version and len(fc_version) >= 3 else None,
+            ready_after)
+        return self.info
+
+    def close(self):
+        self.ser.close()
+
+
+# Link health counters kept by MSPMultiplexer: reply latency, missed and
+# rejected replies, and outages/reconnects (see link_watchdog.py)
+class LinkHealth:
+    __slots__ = ('requests', 'replies', 'timeouts', 'error_replies', 'writes_dropped',
+                 'outages', 'reconnects', 'outage_max', 'outage_total', 'link_up',
+                 '_outage_start', '_latency', '_index', 'latency_max', 'latency_sum')
+
+    def __init__(self, history=256):
+        self.requests = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.error_replies = 0
+        self.writes_dropped = 0
+        self.outages = 0
+        self.reconnects = 0
+        self.outage_max = 0.0
+        self.outage_total = 0.0
+        self.link_up = True
+        self._outage_start = None
+        self._latency = array.array('d', [0.0] * history)
+        self._index = 0
+        self.latency_max = 0.0
+        self.latency_sum = 0.0
+
+    def reply(self, latency, error):
+        self.replies += 1
+        if error:
+            self.error_replies += 1
+        self._latency[self._index % len(self._latency)] = latency
+        self._index += 1
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def link_down(self, now):
+        if self.link_up:
+            self.link_up = False
+            self.outages += 1
+            self._outage_start = now
+
+    def link_restored(self, now):
+        if not self.link_up:
+            outage = now - self._outage_start
+            self.outage_total += outage
+            self.outage_max = max(self.outage_max, outage)
+            self.reconnects += 1
+            self.link_up = True
+
+    def latency_percentile(self, pct):
+        n = min(self._index, len(self._latency))
+        if n == 0:
+            return 0.0
+        samples = sorted(self._latency[:n])
+        return samples[min(n - 1, int(pct / 100.0 * n))]
+
+    @property
+    def error_rate(self):
+        return (self.timeouts + self.error_replies) / self.requests if self.requests else 0.0
+
+    def as_dict(self):
+        return {
+            "link_up": self.link_up,
+            "requests": self.requests,
+            "replies": self.replies,
+            "timeouts": self.timeouts,
+            "error_replies": self.error_replies,
+            "error_rate": self.error_rate,
+            "latency_mean_ms": self.latency_sum / self.replies * 1000.0 if self.replies else 0.0,
+            "latency_p99_ms": self.latency_percentile(99) * 1000.0,
+            "latency_max_ms": self.latency_max * 1000.0,
+            "writes_dropped": self.writes_dropped,
+            "outages": self.outages,
+            "reconnects": self.reconnects,
+            "outage_max_ms": self.outage_max * 1000.0,
+        }
+
+
+# Request/response multiplexer over one transport.
+#
+# A single reader thread owns the port and routes every decoded frame to the
+# oldest waiter registered for that command ID, then to any subscribed
+# callbacks. Senders share a write lock, so telemetry polling and control
+# output can run from different threads without stealing each other's
+# replies.
+#
+# If `reconnect` is set (LinkWatchdog does this), a port error does not end
+# the reader. It calls reconnect(reason), which returns a new serial port or
+# None to give up. While the link is down writes are dropped instead of
+# raising, and the last pre-encoded frame written (the RC override stream)
+# is replayed as soon as the new port is open.
+class MSPMultiplexer:
+    def __init__(self, transport):
+        self.transport = transport
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._waiters = collections.defaultdict(collections.deque)
+        self._listeners = collections.defaultdict(list)
+        self._running = False
+        self._thread = None
+        self.error = None
+        self.unclaimed = 0
+        self.health = LinkHealth()
+        self.reconnect = None
+        self.last_frame = None
+        self.last_rx = time.monotonic()
+        self._reconnect_reason = None
+
+    @property
+    def version(self):
+        return self.transport.version
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="msp-reader", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # Write under the lock; while reconnecting, or on a write error with a
+    # reconnect handler installed, the write is dropped instead of raising
+    def _write(self, write, *args):
+        with self._write_lock:
+            if not self.health.link_up:
+                self.health.writes_dropped += 1
+                return
+            try:
+                write(*args)
+            except (serial.SerialException, OSError) as e:
+                if self.reconnect is None:
+                    raise
+                self.health.writes_dropped += 1
+                self.request_reconnect(e)
+
+    def send(self, cmd, data=None):
+        self._write(self.transport.send, cmd, data)
+
+    def write_frame(self, frame):
+        self.last_frame = frame
+        self._write(self.transport.write_frame, frame)
+
+    # Ask the reader thread to drop and re-open the port (e.g. replies stalled)
+    def request_reconnect(self, reason):
+        if self._reconnect_reason is None:
+            self._reconnect_reason = reason
+
+    # Send cmd and return a Future that resolves to its reply frame
+    def submit(self, cmd, data=None):
+        future = Future()
+        with self._lock:
+            if self.error is not None:
+                future.set_exception(self.error)
+                return future
+            self._waiters[cmd].append((future, time.monotonic()))
+            self.health.requests += 1
+        self.send(cmd, data)
+        return future
+
+    # Blocking request; returns the reply frame or None on timeout
+    def request(self, cmd, data=None, timeout=1.0):
+        future = self.submit(cmd, data)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            self.cancel(cmd, future)
+            return None
+
+    # Register waiters for every request, then send them all in one write
+    def submit_many(self, requests):
+        requests = [split_request(request) for request in requests]
+        futures = []
+        now = time.monotonic()
+        with self._lock:
+            for cmd, data in requests:
+                future = Future()
+                if self.error is not None:
+                    future.set_exception(self.error)
+                else:
+                    self._waiters[cmd].append((future, now))
+                    self.health.requests += 1
+                futures.append(future)
+        if self.error is None:
+            self._write(self.transport.send_many, requests)
+        return futures
+
+    # Pipelined poll through the reader thread; returns an MSPSnapshot
+    def request_many(self, requests, timeout=1.0):
+        commands = [split_request(request)[0] for request in requests]
+        snapshot = MSPSnapshot(list(dict.fromkeys(commands)), time.monotonic())
+        futures = self.submit_many(requests)
+        pending = set(futures)
+        deadline = snapshot.sent_at + timeout
+        while pending:
+            done, pending = wait(pending, max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            now = time.monotonic()
+            for future in done:
+                if future.exception() is None:
+                    snapshot.add(future.result(), now)
+        for cmd, future in zip(commands, futures):
+            if future in pending:
+                self.cancel(cmd, future)
+        return snapshot
+
+    # Call callback(frame) for every frame of cmd, requested or not.
+    # cmd None subscribes to every frame (e.g. a flight recorder).
+    def subscribe(self, cmd, callback):
+        with self._lock:
+            self._listeners[cmd].append(callback)
+
+    def unsubscribe(self, cmd, callback):
+        with self._lock:
+            if callback in self._listeners[cmd]:
+                self._listeners[cmd].remove(callback)
+
+    # Give up on a submitted request so a late reply goes to the next waiter
+    def cancel(self, cmd, future):
+        future.cancel()
+        with self._lock:
+            waiters = self._waiters[cmd]
+            for i, (waiter, _) in enumerate(waiters):
+                if waiter is future:
+                    del waiters[i]
+                    self.health.timeouts += 1
+                    break
+
+    def _dispatch(self, frame):
+        with self._lock:
+            waiters = self._waiters.get(frame.cmd)
+            future, sent_at = waiters.popleft() if waiters else (None, None)
+            listeners = tuple(self._listeners.get(frame.cmd, ()))
+            taps = tuple(self._listeners.get(None, ()))
+        claimed = bool(listeners)
+        if future is not None:
+            self.health.reply(time.monotonic() - sent_at, frame.is_error)
+            try:
+                future.set_result(frame)
+                claimed = True
+            except InvalidStateError:
+                pass  # Timed out and cancelled while we were reading
+        for callback in listeners + taps:
+            callback(frame)
+        if not claimed:
+            self.unclaimed += 1
+
+    def _fail_all(self, error):
+        with self._lock:
+            self.error = error
+            pending = [f for waiters in self._waiters.values() for f, _ in waiters]
+            self._waiters.clear()
+        for future in pending:
+            try:
+                future.set_exception(error)
+            except InvalidStateError:
+                pass
+
+    # Runs on the reader thread: get a new port from the reconnect handler,
+    # swap it in and replay the RC override frame. False if it gave up.
+    def _recover(self, reason):
+        with self._write_lock:
+            self.health.link_down(time.monotonic())
+        ser = self.reconnect(reason)
+        if ser is None:
+            return False
+        with self._write_lock:
+            self.transport.reopen(ser)
+            try:
+                if self.last_frame is not None:
+                    self.transport.write_frame(self.last_frame)
+            except (serial.SerialException, OSError) as e:
+                self.request_reconnect(e)
+                return True
+            self.last_rx = time.monotonic()
+            self.health.link_restored(self.last_rx)
+        return True
+
+    def _run(self):
+        try:
+            while self._running:
+                if self._reconnect_reason is not None:
+                    reason, self._reconnect_reason = self._reconnect_reason, None
+                    if not self._recover(reason):
+                        raise reason if isinstance(reason, Exception) else \
+                            serial.SerialException(str(reason))
+                    continue
+                try:
+                    self.transport.poll()
+                except (serial.SerialException, OSError) as e:
+                    if self.reconnect is None:
+                        raise
+                    self.request_reconnect(e)
+                    continue
+                frames = self.transport.drain()
+                if frames:
+                    self.last_rx = time.monotonic()
+                for frame in frames:
+                    self._dispatch(frame)
+        except Exception as e:
+            self._running = False
+            self._fail_all(e)
+
+
+# Common base for the per-script MSP helper classes
+class MSPClient:
+    def __init__(self, port, baudrate=115200, timeout=1.0):
+        self.ser = open_msp_port(port, baudrate)
+        self.transport = MSPTransport(self.ser)
+        # Wait only as long as the FC actually needs to start answering
+        self.info = self.transport.handshake()
+        if self.info is None:
+            print(f"Warning: no MSP reply from {port} within {READY_TIMEOUT:.0f}s")
+        self.timeout = timeout
+        self.rc = None
+
+    def send_cmd(self, cmd, data=None):
+        self.transport.send(cmd, data)
+
+    # Poll several commands in one round trip; returns an MSPSnapshot
+    def request_many(self, requests):
+        return self.transport.request_many(requests, self.timeout)
+
+    # MSP_SET_RAW_RC through a reusable RCOverride frame buffer
+    def set_raw_rc(self, channels):
+        if self.rc is None or self.rc.count != len(channels):
+            self.rc = RCOverride(channels, self.transport.version)
+        else:
+            self.rc.set_channels(channels)
+        self.transport.write_frame(self.rc.frame)
+        return self.read_response(MSP_SET_RAW_RC)
+
+    # Reply payload for cmd, taken from a pipelined request_many() snapshot
+    # when one is given and requested on its own otherwise
+    def _payload(self, cmd, snapshot=None):
+        if snapshot is not None:
+            return snapshot.payload(cmd)
+        self.send_cmd(cmd)
+        return self.read_response(cmd)
+
+    def read_response(self, cmd):
+        frame = self.transport.read_response(cmd, self.timeout)
+        if frame is None:
+            print(f"Error: No response for command {cmd}")
+            return None
+        if frame.is_error:
+            print(f"Error: Flight controller rejected command {cmd}")
+            return None
+        return frame.payload
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,359 @@
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from battery_monitor import INTERNAL_RESISTANCE, guess_cells, state_of_charge
+from control_loop import ControlLoop
+from msp_messages import (MSP_ALTITUDE, MSP_ANALOG, MSP_BATTERY_STATE, MSP_MOTOR, MSP_RX,
+                          MSP_SET_RAW_RC, MSP_STATUS_EX, REGISTRY, SENSOR_ACC, SENSOR_BARO,
+                          SENSOR_GYRO, arming_disable_reasons, decode_altitude, decode_analog,
+                          decode_battery_state, decode_motor, decode_rx, decode_status_ex)
+from motor_bench import MotorBench, step
+from msp_transport import MSPMultiplexer, connect_msp
+from rc_override import AUX1, DEFAULT_CHANNELS, PITCH, ROLL, THROTTLE, YAW, RCOverride
+
+# One-shot preflight over a single MSP connection, replacing the separate
+# battery/receiver/motor/arm scripts.
+#
+# Checks run as a dependency graph on a thread pool. Each one starts as soon
+# as the checks it depends on have passed, and is skipped if one of them is
+# NO-GO:
+#
+#   rc_link ── telemetry ─┬─ battery ─┬─ motors
+#                         ├─ arming ──┘
+#                         ├─ rx
+#                         └─ sensors
+#   sonar (HC-SR04, independent of the FC link)
+#
+# `telemetry` fetches everything the checks below it decode in one pipelined
+# MSP batch. `rc_link` keeps a neutral RC override stream (throttle low,
+# AUX1 disarmed) running for the whole preflight, like the flight script
+# does, so the FC's RX-loss flags reflect the real MSP receiver state.
+#
+#   MSP_PORT=/dev/ttyACM0 python preflight.py            # human-readable report
+#   python preflight.py --json > preflight.json          # structured report
+#   python preflight.py --spin-motors                    # PROPS OFF: spin the motors
+#
+# Exit status is 0 for GO and 1 for NO-GO.
+
+GO = "GO"
+WARN = "WARN"
+NOGO = "NO-GO"
+SKIPPED = "SKIPPED"
+
+RC_RATE_HZ = 20
+ARMING_SETTLE = 1.5  # seconds to wait for RX-loss flags to clear once RC is streaming
+MIN_CHARGE = 0.5  # NO-GO below this state of charge
+WARN_CHARGE = 0.8  # WARN below this
+STICK_RANGE = (900, 2100)
+STICK_CENTER = 1500
+STICK_DEADBAND = 50  # us either side of center that still counts as centered
+THROTTLE_LOW = 1100
+ARM_SWITCH_LOW = 1300
+MOTOR_TEST_VALUE = 1100
+MOTOR_IDLE_MAX = 1050
+MOTOR_TEST_TIME = 0.2  # seconds all motors spin for
+MOTOR_COUNT = 4
+SONAR_SAMPLES = 5
+
+
+class CheckResult:
+    __slots__ = ('name', 'status', 'detail', 'data', 'duration')
+
+    def __init__(self, name, status, detail, data=None, duration=0.0):
+        self.name = name
+        self.status = status
+        self.detail = detail
+        self.data = data or {}
+        self.duration = duration
+
+    def as_dict(self):
+        return {"status": self.status, "detail": self.detail,
+                "duration_ms": round(self.duration * 1000.0, 1), "data": self.data}
+
+
+class Preflight:
+    def __init__(self, mux, spin_motors=False, sonar_backend=None, timeout=0.5):
+        self.mux = mux
+        self.spin_motors = spin_motors
+        self.sonar_backend = sonar_backend
+        self.timeout = timeout
+        self.results = {}
+        self.telemetry = {}
+        self._rc_loop = None
+        self._rc_thread = None
+
+        # name: (function, dependencies)
+        self.checks = {
+            "rc_link": (self.check_rc_link, ()),
+            "telemetry": (self.check_telemetry, ("rc_link",)),
+            "battery": (self.check_battery, ("telemetry",)),
+            "rx": (self.check_rx, ("telemetry",)),
+            "arming": (self.check_arming, ("telemetry",)),
+            "sensors": (self.check_sensors, ("telemetry",)),
+            "motors": (self.check_motors, ("battery", "arming")),
+            "sonar": (self.check_sonar, ()),
+        }
+
+    # --- checks: each returns (status, detail, data) ----------------------
+
+    def check_rc_link(self):
+        rc = RCOverride(DEFAULT_CHANNELS, self.mux.version)
+        self._rc_loop = ControlLoop(RC_RATE_HZ)
+
+        def step(now, dt):
+            self.mux.write_frame(rc.frame)
+            return False
+
+        self._rc_thread = threading.Thread(target=self._rc_loop.run, args=(step,),
+                                           name="preflight-rc", daemon=True)
+        self._rc_thread.start()
+        channels = rc.channels()
+        ack = self.mux.request(MSP_SET_RAW_RC, REGISTRY[MSP_SET_RAW_RC].encode(*channels),
+                               self.timeout)
+        if ack is None or ack.is_error:
+            return NOGO, "FC does not accept MSP_SET_RAW_RC (MSP receiver not enabled?)", {}
+        return GO, f"RC override streaming at {RC_RATE_HZ} Hz", {}
+
+    def check_telemetry(self):
+        decoders = {
+            MSP_STATUS_EX: ("status", decode_status_ex),
+            MSP_BATTERY_STATE: ("battery", decode_battery_state),
+            MSP_ANALOG: ("analog", decode_analog),
+            MSP_RX: ("rx", decode_rx),
+            MSP_MOTOR: ("motors", decode_motor),
+            MSP_ALTITUDE: ("altitude", decode_altitude),
+        }
+        snapshot = self.mux.request_many(list(decoders), self.timeout)
+        for cmd, (name, decode) in decoders.items():
+            data = snapshot.payload(cmd)
+            try:
+                self.telemetry[name] = decode(data) if data is not None else None
+            except struct.error:
+                self.telemetry[name] = None
+        missing = [name for name, value in self.telemetry.items() if value is None]
+        latency = (snapshot.latency or 0.0) * 1000.0
+        data = {"latency_ms": round(latency, 2), "missing": missing}
+        if self.telemetry["status"] is None or self.telemetry["rx"] is None:
+            return NOGO, f"no reply for {', '.join(missing)}", data
+        if missing:
+            return WARN, f"{len(decoders)} queries in one batch ({latency:.1f} ms), " \
+                         f"no reply for {', '.join(missing)}", data
+        return GO, f"{len(decoders)} queries in one batch ({latency:.1f} ms)", data
+
+    def check_battery(self):
+        reading = self.telemetry["battery"] or self.telemetry["analog"]
+        if reading is None:
+            return NOGO, "no battery telemetry", {}
+        voltage, current = reading.voltage, reading.current
+        cells = reading.cells or guess_cells(voltage)
+        if voltage <= 0 or not cells:
+            return NOGO, "no battery voltage (battery connected? voltage meter configured?)", {}
+        charge = state_of_charge(voltage / cells + current * INTERNAL_RESISTANCE)
+        data = {"voltage": voltage, "cells": cells, "cell_voltage": round(voltage / cells, 3),
+                "charge": round(charge, 3)}
+        detail = f"{voltage:.2f}V {cells}S ({voltage / cells:.2f}V/cell), {charge * 100:.0f}% charge"
+        if charge < MIN_CHARGE:
+            return NOGO, detail + f", below {MIN_CHARGE * 100:.0f}%", data
+        if charge < WARN_CHARGE:
+            return WARN, detail, data
+        return GO, detail, data
+
+    def check_rx(self):
+        channels = self.telemetry["rx"]
+        data = {"channels": channels}
+        if len(channels) <= AUX1:
+            return NOGO, f"only {len(channels)} RC channels", data
+        low, high = STICK_RANGE
+        bad = [i + 1 for i, value in enumerate(channels[:4]) if not low <= value <= high]
+        if bad:
+            return NOGO, f"channels {bad} out of range {low}-{high}", data
+        off_center = [f"{name} {channels[i]}" for name, i in (("roll", ROLL), ("pitch", PITCH),
+                                                             ("yaw", YAW))
+                      if abs(channels[i] - STICK_CENTER) > STICK_DEADBAND]
+        if off_center:
+            return NOGO, (f"sticks not centered ({', '.join(off_center)}, "
+                          f"{STICK_CENTER}±{STICK_DEADBAND})"), data
+        if channels[THROTTLE] > THROTTLE_LOW:
+            return NOGO, f"throttle not low ({channels[THROTTLE]})", data
+        if channels[AUX1] >= ARM_SWITCH_LOW:
+            return NOGO, f"arm switch (AUX1) not in disarmed position ({channels[AUX1]})", data
+        return GO, f"{len(channels)} channels, sticks centered, throttle low, AUX1 disarmed", data
+
+    def check_arming(self):
+        status = self.telemetry["status"]
+        if status.armed:
+            return NOGO, "FC is already armed", {}
+        flags = status.arming_disable_flags
+        if flags is None:
+            return WARN, "firmware does not report arming disable flags", {}
+        # RXLOSS/FAILSAFE clear a moment after the RC override stream starts
+        deadline = time.monotonic() + ARMING_SETTLE
+        while flags and time.monotonic() < deadline:
+            time.sleep(0.05)
+            frame = self.mux.request(MSP_STATUS_EX, timeout=self.timeout)
+            if frame is not None and not frame.is_error:
+                flags = decode_status_ex(frame.payload).arming_disable_flags or 0
+        reasons = arming_disable_reasons(flags)
+        data = {"arming_disable_flags": flags, "reasons": reasons}
+        if reasons:
+            return NOGO, f"arming disabled: {', '.join(reasons)}", data
+        return GO, "no arming disable flags", data
+
+    def check_sensors(self):
+        status = self.telemetry["status"]
+        sensors = status.sensors
+        data = {"sensors": sensors, "cycle_time": status.cycle_time,
+                "i2c_errors": status.i2c_errors, "system_load": status.system_load}
+        if not sensors & SENSOR_GYRO or not sensors & SENSOR_ACC:
+            return NOGO, "gyro/accelerometer not detected", data
+        if status.cycle_time <= 0:
+            return NOGO, "FC loop not running", data
+        problems = []
+        if not sensors & SENSOR_BARO:
+            problems.append("no barometer")
+        if status.i2c_errors:
+            problems.append(f"{status.i2c_errors} I2C errors")
+        if self.telemetry["altitude"] is None:
+            problems.append("no MSP_ALTITUDE")
+        detail = f"gyro+acc ok, loop {status.cycle_time} us, load {status.system_load}"
+        if problems:
+            return WARN, detail + "; " + ", ".join(problems), data
+        return GO, detail, data
+
+    def check_motors(self):
+        motors = self.telemetry["motors"]
+        if motors is None:
+            return WARN, "no MSP_MOTOR reply", {}
+        idle = motors[:MOTOR_COUNT]
+        if not self.spin_motors:
+            if any(value > MOTOR_IDLE_MAX for value in idle):
+                return WARN, f"outputs not idle while disarmed: {idle}", {"motors": idle}
+            return GO, f"outputs idle {idle} (run with --spin-motors to spin, PROPS OFF)", \
+                {"motors": idle}
+        bench = MotorBench(self.mux, MOTOR_COUNT, timeout=self.timeout)
+        results = bench.run(step(MOTOR_TEST_VALUE, MOTOR_TEST_TIME))
+        data = {"motors": {motor: result.as_dict() for motor, result in results.items()}}
+        failed = {motor: result.problems for motor, result in results.items() if not result.passed}
+        if failed:
+            return NOGO, "; ".join(f"M{motor}: {', '.join(problems)}"
+                                   for motor, problems in failed.items()), data
+        worst = max(result.latency_max or 0.0 for result in results.values())
+        return GO, f"all {MOTOR_COUNT} motors followed {MOTOR_TEST_VALUE} " \
+            f"(latency <= {worst * 1000:.0f} ms)", data
+
+    def check_sonar(self):
+        from hcsr04 import HCSR04
+
+        try:
+            sonar = HCSR04(self.sonar_backend)
+        except (ImportError, RuntimeError) as e:
+            return SKIPPED, f"no HC-SR04 ({e})", {}
+        try:
+            readings = [sonar.measure() for _ in range(SONAR_SAMPLES)]
+        finally:
+            sonar.backend.close()
+        valid = [r for r in readings if r is not None]
+        data = {"readings": readings}
+        if len(valid) < SONAR_SAMPLES // 2 + 1:
+            return NOGO, f"only {len(valid)}/{SONAR_SAMPLES} echoes", data
+        return GO, f"{len(valid)}/{SONAR_SAMPLES} echoes, {min(valid):.2f} m to ground", data
+
+    # --- graph runner -----------------------------------------------------
+
+    def _run_check(self, name):
+        start = time.monotonic()
+        try:
+            status, detail, data = self.checks[name][0]()
+        except Exception as e:
+            status, detail, data = NOGO, f"error: {e!r}", {}
+        return CheckResult(name, status, detail, data, time.monotonic() - start)
+
+    def run(self):
+        start = time.monotonic()
+        pending = dict(self.checks)
+        running = {}
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.checks)) as pool:
+                while pending or running:
+                    for name, (_, depends) in list(pending.items()):
+                        if not all(dep in self.results for dep in depends):
+                            continue
+                        del pending[name]
+                        blocked = [dep for dep in depends if self.results[dep].status in (NOGO, SKIPPED)]
+                        if blocked:
+                            self.results[name] = CheckResult(name, SKIPPED, f"blocked by {', '.join(blocked)}")
+                        else:
+                            running[pool.submit(self._run_check, name)] = name
+                    if not running:
+                        continue
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.results[running.pop(future)] = future.result()
+        finally:
+            self.close()
+
+        go = all(result.status != NOGO for result in self.results.values())
+        return {
+            "go": go,
+            "duration_ms": round((time.monotonic() - start) * 1000.0, 1),
+            "checks": {name: self.results[name].as_dict() for name in self.checks},
+        }
+
+    def close(self):
+        if self._rc_loop is not None:
+            self._rc_loop.stop()
+            self._rc_thread.join()
+            self._rc_loop = None
+
+
+def print_report(report, port, info):
+    verdict = "GO" if report["go"] else "NO-GO"
+    print(f"PREFLIGHT {verdict}  ({report['duration_ms'] / 1000.0:.2f}s, {info} on {port})")
+    for name, check in report["checks"].items():
+        print(f"  {name:10} {check['status']:8} {check['detail']}  [{check['duration_ms']:.0f} ms]")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Preflight go/no-go check over one MSP connection")
+    parser.add_argument("--port", default=os.environ.get("MSP_PORT", "/dev/ttyACM0"))
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--spin-motors", action="store_true",
+                        help="spin the motors briefly (PROPS OFF!)")
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    try:
+        transport = connect_msp(args.port, args.baudrate)
+    except Exception as e:
+        report = {"go": False, "duration_ms": round((time.monotonic() - start) * 1000.0, 1),
+                  "checks": {"link": CheckResult("link", NOGO, str(e)).as_dict()}}
+        print(json.dumps(report, indent=2) if args.json else f"PREFLIGHT NO-GO  link: {e}")
+        return 1
+
+    mux = MSPMultiplexer(transport).start()
+    try:
+        report = Preflight(mux, args.spin_motors).run()
+    finally:
+        mux.stop()
+        transport.close()
+    connect_ms = transport.info.ready_after * 1000.0
+    report["checks"] = dict(link=CheckResult("link", GO, repr(transport.info),
+                                             duration=connect_ms / 1000.0).as_dict(),
+                            **report["checks"])
+    report["duration_ms"] = round((time.monotonic() - start) * 1000.0, 1)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args.port, transport.info)
+    return 0 if report["go"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
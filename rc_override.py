@@ -0,0 +1,89 @@
+import struct
+
+from msp_messages import MSP_SET_RAW_RC
+from msp_protocol import DIRECTION_REQUEST, crc8_dvb_s2, xor_checksum
+
+# MSP_SET_RAW_RC encoder for RC override.
+#
+# This is the hottest code in the system: the flight loops send it on every
+# tick. The whole frame lives in one preallocated bytearray. Channel updates
+# patch the payload in place with struct.pack_into. For MSP v1 the XOR
+# checksum is patched with just the bytes that changed. For MSP v2 the CRC8
+# is recomputed over the short payload.
+
+# Channel order follows Betaflight's default AETR1234 map
+ROLL = 0
+PITCH = 1
+THROTTLE = 2
+YAW = 3
+AUX1 = 4
+AUX2 = 5
+AUX3 = 6
+AUX4 = 7
+
+# [Roll, Pitch, Throttle, Yaw, AUX1, AUX2, AUX3, AUX4]
+DEFAULT_CHANNELS = (1500, 1500, 1000, 1500, 1000, 1500, 1500, 1500)
+
+_CHANNEL = struct.Struct('<H')
+
+
+class RCOverride:
+    __slots__ = ('count', 'version', 'frame', '_payload_offset', '_channels', '_checksum')
+
+    def __init__(self, channels=DEFAULT_CHANNELS, version=1):
+        self.count = len(channels)
+        self.version = version
+        size = 2 * self.count
+        self._channels = struct.Struct(f'<{self.count}H')
+
+        if version >= 2:
+            # $X< flags cmd(u16) size(u16) payload crc8
+            self._payload_offset = 8
+            self.frame = bytearray(8 + size + 1)
+            struct.pack_into('<3sBHH', self.frame, 0, b'$X' + bytes((DIRECTION_REQUEST,)),
+                             0, MSP_SET_RAW_RC, size)
+        else:
+            # $M< size cmd payload xor
+            self._payload_offset = 5
+            self.frame = bytearray(5 + size + 1)
+            struct.pack_into('<3sBB', self.frame, 0, b'$M' + bytes((DIRECTION_REQUEST,)),
+                             size, MSP_SET_RAW_RC)
+        self.set_channels(channels)
+
+    def _finish(self):
+        # Recompute the trailing checksum over the whole frame body
+        body = memoryview(self.frame)[3:-1]
+        if self.version >= 2:
+            self.frame[-1] = crc8_dvb_s2(body)
+        else:
+            self.frame[-1] = xor_checksum(body)
+
+    def __getitem__(self, index):
+        return _CHANNEL.unpack_from(self.frame, self._payload_offset + 2 * index)[0]
+
+    def __setitem__(self, index, value):
+        self.set_channel(index, value)
+
+    # Update one channel in place
+    def set_channel(self, index, value):
+        if not 0 <= index < self.count:
+            raise IndexError(f"RC channel {index} out of range (0-{self.count - 1})")
+        frame = self.frame
+        offset = self._payload_offset + 2 * index
+        old = frame[offset] ^ frame[offset + 1]
+        _CHANNEL.pack_into(frame, offset, value)
+        if self.version >= 2:
+            self._finish()
+        else:
+            frame[-1] ^= old ^ frame[offset] ^ frame[offset + 1]
+
+    # Overwrite every channel with one pack_into call
+    def set_channels(self, channels):
+        self._channels.pack_into(self.frame, self._payload_offset, *channels)
+        self._finish()
+
+    def set_throttle(self, value):
+        self.set_channel(THROTTLE, value)
+
+    def channels(self):
+        return list(self._channels.unpack_from(self.frame, self._payload_offset))
@@ -1,87 +1,35 @@
+import os
 import serial
 import struct
 import time
 
-class MSP:
-    def __init__(self, port, baudrate=115200):
-        self.ser = serial.Serial(port, baudrate, timeout=1)
-        time.sleep(2)  # Wait for connection to establish
-        
-    def send_cmd(self, cmd, data=None):
-        if data is None:
-            data = []
-        size = len(data)
-        checksum = 0
-        
-        # Calculate checksum
-        checksum ^= size
-        checksum ^= cmd
-        for i in data:
-            checksum ^= i
-        
-        # Construct message
-        msg = b'$M<' + struct.pack('<BB', size, cmd)
-        msg += bytes(data)
-        msg += struct.pack('<B', checksum)
-        
-        # Send message
-        self.ser.write(msg)
-        
-    def read_response(self, cmd):
-        header = self.ser.read(3)  # $M>
-        if len(header) != 3:
-            print("Error: No proper header received")
-            return None
-            
-        size = ord(self.ser.read(1))
-        command = ord(self.ser.read(1))
-        
-        if command != cmd:
-            print(f"Error: Expected command {cmd}, got {command}")
-            return None
-            
-        data = self.ser.read(size)
-        checksum = ord(self.ser.read(1))
-        
-        return data
-    
-    def get_rx_status(self):
-        # MSP_RX = 105
-        self.send_cmd(105)
-        data = self.read_response(105)
+from msp_messages import MSP_RX, MSP_STATUS_EX, decode_rx, decode_status_ex
+from msp_transport import MSPClient
+
+class MSP(MSPClient):
+    def get_rx_status(self, snapshot=None):
+        data = self._payload(MSP_RX, snapshot)
         
         if data is None:
             print("Failed to get receiver data")
             return None
             
-        channels = []
-        for i in range(0, len(data), 2):
-            # Convert 2 bytes to an RC value
-            if i+1 < len(data):
-                ch_value = data[i] + (data[i+1] << 8)
-                channels.append(ch_value)
-        
-        return channels
+        return decode_rx(data)
     
-    def get_arming_status(self):
-        # MSP_STATUS_EX = 150
-        self.send_cmd(150)
-        data = self.read_response(150)
+    def get_arming_status(self, snapshot=None):
+        data = self._payload(MSP_STATUS_EX, snapshot)
         
-        if data and len(data) >= 14:
-            arming_flags = data[2] + (data[3] << 8)
-            arming_disable_flags = data[6] + (data[7] << 8) + (data[8] << 16) + (data[9] << 24)
-            return {
-                "armed": bool(arming_flags & 1),
-                "arming_flags": arming_flags,
-                "arming_disable_flags": arming_disable_flags
-            }
-        return None
+        if not data:
+            return None
+        try:
+            return decode_status_ex(data)
+        except struct.error:
+            return None  # Short payload
 
 # Test script
 if __name__ == "__main__":
-    # Change this to your actual serial port
-    serial_port = "/dev/ttyACM0"  # Use ACM0 as mentioned in your setup
+    # Change this to your actual serial port (or set MSP_PORT, e.g. to a sitl_fc.py pty)
+    serial_port = os.environ.get("MSP_PORT", "/dev/ttyACM0")  # Use ACM0 as mentioned in your setup
     
     try:
         print(f"Connecting to flight controller on {serial_port}...")
@@ -92,7 +40,9 @@ if __name__ == "__main__":
         print("Move sticks on your transmitter to see values change.")
         
         for i in range(10):  # Read 10 times with delay
-            channels = msp.get_rx_status()
+            # MSP_RX and MSP_STATUS_EX in one pipelined round trip
+            snapshot = msp.request_many([MSP_RX, MSP_STATUS_EX])
+            channels = msp.get_rx_status(snapshot)
             
             if channels:
                 print("\nReceiver channel values:")
@@ -120,14 +70,15 @@ if __name__ == "__main__":
                 print("❌ Failed to read receiver values")
             
             # Get arming status
-            arming_status = msp.get_arming_status()
+            arming_status = msp.get_arming_status(snapshot)
             if arming_status:
-                print(f"Armed: {'YES' if arming_status['armed'] else 'NO'}")
-                print(f"Arming flags: {arming_status['arming_flags']}")
-                print(f"Arming disable flags: {arming_status['arming_disable_flags']}")
-                if arming_status['arming_disable_flags'] & 1:
+                reasons = arming_status.arming_disable_reasons
+                print(f"Armed: {'YES' if arming_status.armed else 'NO'}")
+                print(f"Flight mode flags: {arming_status.flight_mode_flags}")
+                print(f"Arming disable flags: {', '.join(reasons) or 'none'}")
+                if "RXLOSS" in reasons:
                     print("⚠️ RXLOSS flag set - No receiver signal detected!")
-                if arming_status['arming_disable_flags'] & 32:
+                if "MSP" in reasons:
                     print("⚠️ MSP flag set - Arming via MSP disabled!")
             
             time.sleep(1)
@@ -0,0 +1,325 @@
+import argparse
+import collections
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from msp_messages import MSP_RX, decode_rx
+from msp_transport import MSPMultiplexer, connect_msp
+from rc_override import PITCH, ROLL, THROTTLE, YAW
+
+# Receiver link monitor.
+#
+# Polls MSP_RX as fast as the link answers. DEPTH requests are kept in
+# flight, and each reply immediately queues the next request. Rolling
+# statistics over the last `window` seconds are kept per channel:
+#
+#   jitter      standard deviation of the value (stick noise when held still)
+#   spread      max - min
+#   updates     value changes per second (roughly the RX frame rate while
+#               the stick is moving or noisy)
+#   violations  samples outside 900-2100 us
+#
+# plus poll rate, poll interval jitter, timeouts and dropouts (gaps between
+# replies longer than DROPOUT_GAP). The statistics are updated
+# incrementally, so one reply costs a decode plus a few additions per
+# channel. If the link itself fails (the multiplexer's reader gives up),
+# polling stops and the error is reported as a problem.
+#
+#   MSP_PORT=/dev/ttyACM0 python rx_monitor.py              # live table
+#   python rx_monitor.py --duration 10 --json               # one report
+
+DEPTH = 2  # MSP_RX requests in flight
+WINDOW = 5.0  # seconds of samples the rolling statistics cover
+DROPOUT_GAP = 0.1  # seconds without a reply that count as a dropout
+CHANNEL_RANGE = (900, 2100)
+JITTER_WARN = 3.0  # us standard deviation
+CHANNEL_NAMES = {ROLL: "Roll", PITCH: "Pitch", THROTTLE: "Throttle", YAW: "Yaw"}
+
+
+def channel_name(index):
+    return CHANNEL_NAMES.get(index, f"AUX{index - 3}")
+
+
+class ChannelStats:
+    __slots__ = ('index', 'value', 'mean', 'jitter', 'low', 'high', 'updates', 'violations',
+                 'violations_total')
+
+    def __init__(self, index):
+        self.index = index
+        self.value = None
+        self.mean = 0.0
+        self.jitter = 0.0
+        self.low = self.high = None
+        self.updates = 0.0  # changes per second over the window
+        self.violations = 0  # in the window
+        self.violations_total = 0
+
+    @property
+    def spread(self):
+        return 0 if self.low is None else self.high - self.low
+
+    def as_dict(self):
+        return {"name": channel_name(self.index), "value": self.value,
+                "mean": round(self.mean, 1), "jitter": round(self.jitter, 2),
+                "spread": self.spread, "updates_hz": round(self.updates, 1),
+                "violations": self.violations, "violations_total": self.violations_total}
+
+
+class RXMonitor:
+    def __init__(self, mux, window=WINDOW, depth=DEPTH, timeout=0.5, clock=time.monotonic):
+        self.mux = mux
+        self.window = window
+        self.depth = depth
+        self.timeout = timeout
+        self.clock = clock
+        self.samples = collections.deque()  # (t, channels, changed, out of range) in the window
+        self.intervals = collections.deque()
+        self.polls = 0
+        self.timeouts = 0
+        self.dropouts = 0  # since start
+        self.longest_gap = 0.0
+        self.error = None  # Link failure that stopped the monitor
+        self._dropouts = collections.deque()  # (t, gap) in the window
+        self.violations_total = []
+        self._sum = []
+        self._sum_sq = []
+        self._changes = []
+        self._out_of_range = []
+        self._interval_sum = 0.0
+        self._interval_sum_sq = 0.0
+        self._last = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="rx-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        mux = self.mux
+        pending = collections.deque(mux.submit(MSP_RX) for _ in range(self.depth))
+        try:
+            while self._running:
+                future = pending.popleft()
+                try:
+                    frame = future.result(self.timeout)
+                except FutureTimeoutError:
+                    mux.cancel(MSP_RX, future)
+                    self.timeouts += 1
+                    frame = None
+                except Exception as e:
+                    # The multiplexer failed every request: the link is gone
+                    # and nothing will reply, so stop instead of spinning
+                    with self._lock:
+                        now = self.clock()
+                        self.error = e
+                        self.dropouts += 1
+                        self._dropouts.append(
+                            (now, now - self._last[0] if self._last is not None else 0.0))
+                    self._running = False
+                    break
+                pending.append(mux.submit(MSP_RX))
+                if frame is not None and not frame.is_error:
+                    try:
+                        self.add_sample(self.clock(), decode_rx(frame.payload))
+                    except struct.error:
+                        pass
+        finally:
+            for future in pending:
+                mux.cancel(MSP_RX, future)
+
+    def _resize(self, count):
+        grow = count - len(self._sum)
+        self._sum += [0] * grow
+        self._sum_sq += [0] * grow
+        self._changes += [0] * grow
+        self._out_of_range += [0] * grow
+        self.violations_total += [0] * grow
+
+    # Feed one MSP_RX reply; normally called from the monitor thread
+    def add_sample(self, t, channels):
+        low, high = CHANNEL_RANGE
+        with self._lock:
+            if len(channels) > len(self._sum):
+                self._resize(len(channels))
+            self.polls += 1
+            last = self._last
+            if last is not None:
+                gap = t - last[0]
+                if gap > DROPOUT_GAP:
+                    self.dropouts += 1
+                    self._dropouts.append((t, gap))
+                self.longest_gap = max(self.longest_gap, gap)
+                self.intervals.append(gap)
+                self._interval_sum += gap
+                self._interval_sum_sq += gap * gap
+            previous = last[1] if last is not None else channels
+            changed = [i for i, v in enumerate(channels)
+                       if i >= len(previous) or v != previous[i]]
+            out = [i for i, v in enumerate(channels) if v < low or v > high]
+            for i, v in enumerate(channels):
+                self._sum[i] += v
+                self._sum_sq[i] += v * v
+            for i in changed:
+                self._changes[i] += 1
+            for i in out:
+                self._out_of_range[i] += 1
+                self.violations_total[i] += 1
+            sample = (t, channels, changed, out)
+            self.samples.append(sample)
+            self._last = sample
+            self._expire(t)
+
+    def _expire(self, now):
+        dropouts = self._dropouts
+        while dropouts and now - dropouts[0][0] > self.window:
+            dropouts.popleft()
+        samples = self.samples
+        while samples and now - samples[0][0] > self.window:
+            _, channels, changed, out = samples.popleft()
+            for i, v in enumerate(channels):
+                self._sum[i] -= v
+                self._sum_sq[i] -= v * v
+            for i in changed:
+                self._changes[i] -= 1
+            for i in out:
+                self._out_of_range[i] -= 1
+            if self.intervals:
+                gap = self.intervals.popleft()
+                self._interval_sum -= gap
+                self._interval_sum_sq -= gap * gap
+
+    # Rolling statistics now: (summary dict, [ChannelStats])
+    def stats(self):
+        with self._lock:
+            if self.error is None:
+                self._expire(self.clock())  # Age out the window even when replies stop
+            samples = self.samples
+            n = len(samples)
+            span = samples[-1][0] - samples[0][0] if n > 1 else 0.0
+            channels = []
+            count = len(self._sum)
+            lows = [None] * count
+            highs = [None] * count
+            for _, values, _, _ in samples:
+                for i, v in enumerate(values):
+                    if lows[i] is None or v < lows[i]:
+                        lows[i] = v
+                    if highs[i] is None or v > highs[i]:
+                        highs[i] = v
+            for i in range(count):
+                stats = ChannelStats(i)
+                if n:
+                    stats.value = samples[-1][1][i] if i < len(samples[-1][1]) else None
+                    stats.mean = self._sum[i] / n
+                    stats.jitter = max(0.0, self._sum_sq[i] / n - stats.mean ** 2) ** 0.5
+                    stats.low, stats.high = lows[i], highs[i]
+                    stats.updates = self._changes[i] / span if span else 0.0
+                stats.violations = self._out_of_range[i]
+                stats.violations_total = self.violations_total[i]
+                channels.append(stats)
+            intervals = len(self.intervals)
+            mean_interval = self._interval_sum / intervals if intervals else 0.0
+            variance = self._interval_sum_sq / intervals - mean_interval ** 2 if intervals else 0.0
+            interval_jitter = max(0.0, variance) ** 0.5
+            summary = {
+                "polls": self.polls,
+                "poll_rate_hz": round((n - 1) / span, 1) if span else 0.0,
+                "interval_jitter_ms": round(interval_jitter * 1000.0, 2),
+                "timeouts": self.timeouts,
+                "dropouts": self.dropouts,
+                "window_dropouts": len(self._dropouts),
+                "window_longest_dropout_ms": round(
+                    max((gap for _, gap in self._dropouts), default=0.0) * 1000.0, 1),
+                "longest_gap_ms": round(self.longest_gap * 1000.0, 1),
+                "error": None if self.error is None else str(self.error),
+                "violations": sum(self._out_of_range),
+            }
+        return summary, channels
+
+    # Human-readable problems in the current window (plus a link failure,
+    # which ends monitoring), [] when the link looks clean
+    def problems(self):
+        summary, channels = self.stats()
+        problems = []
+        if summary["error"] is not None:
+            problems.append(f"link failed: {summary['error']}")
+        if summary["window_dropouts"]:
+            problems.append(f"{summary['window_dropouts']} dropouts in the last "
+                            f"{self.window:g} s (longest "
+                            f"{summary['window_longest_dropout_ms']:.0f} ms)")
+        for stats in channels:
+            name = channel_name(stats.index)
+            if stats.violations:
+                problems.append(f"{name}: {stats.violations} samples outside "
+                                f"{CHANNEL_RANGE[0]}-{CHANNEL_RANGE[1]}")
+            if stats.jitter > JITTER_WARN:
+                problems.append(f"{name}: jitter {stats.jitter:.1f} us")
+        return problems
+
+
+def print_stats(summary, channels):
+    print(f"RX {summary['poll_rate_hz']:6.1f} Hz  "
+          f"interval jitter {summary['interval_jitter_ms']:.2f} ms  "
+          f"timeouts {summary['timeouts']}  dropouts {summary['dropouts']}  "
+          f"longest gap {summary['longest_gap_ms']:.0f} ms")
+    for stats in channels:
+        print(f"  CH{stats.index + 1:<2} {channel_name(stats.index):8} {stats.value!s:>5}  "
+              f"mean {stats.mean:7.1f}  jitter {stats.jitter:5.2f}  spread {stats.spread:4}  "
+              f"updates {stats.updates:6.1f}/s  out of range {stats.violations}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Live receiver channel statistics over MSP")
+    parser.add_argument("--port", default=os.environ.get("MSP_PORT", "/dev/ttyACM0"))
+    parser.add_argument("--baudrate", type=int, default=115200)
+    parser.add_argument("--window", type=float, default=WINDOW, help="seconds of statistics")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between printouts")
+    parser.add_argument("--json", action="store_true", help="print one JSON report at the end")
+    args = parser.parse_args(argv)
+
+    transport = connect_msp(args.port, args.baudrate)
+    mux = MSPMultiplexer(transport).start()
+    monitor = RXMonitor(mux, args.window).start()
+    end = None if args.duration is None else time.monotonic() + args.duration
+    try:
+        while end is None or time.monotonic() < end:
+            left = args.interval if end is None else end - time.monotonic()
+            time.sleep(max(0.0, min(args.interval, left)))
+            if not args.json:
+                print_stats(*monitor.stats())
+                for problem in monitor.problems():
+                    print(f"  ! {problem}")
+            if monitor.error is not None:
+                break  # Link failed; the statistics will not change any more
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.stop()
+        mux.stop()
+        transport.close()
+    if args.json:
+        summary, channels = monitor.stats()
+        summary["channels"] = [stats.as_dict() for stats in channels]
+        summary["problems"] = monitor.problems()
+        print(json.dumps(summary, indent=2))
+    return 1 if monitor.error is not None else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
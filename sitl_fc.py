@@ -0,0 +1,436 @@
+import argparse
+import bisect
+import heapq
+import os
+import random
+import select
+import struct
+import sys
+import threading
+import time
+import tty
+
+from battery_monitor import LIPO_DISCHARGE
+from msp_messages import (MSP_ALTITUDE, MSP_ANALOG, MSP_API_VERSION, MSP_BATTERY_STATE,
+                          MSP_ESC_SENSOR_DATA, MSP_FC_VARIANT, MSP_FC_VERSION, MSP_MOTOR, MSP_RX,
+                          MSP_SET_ARMED, MSP_SET_MOTOR, MSP_SET_RAW_RC, MSP_STATUS, MSP_STATUS_EX)
+from msp_protocol import (DIRECTION_ERROR, DIRECTION_REQUEST, DIRECTION_RESPONSE,
+                          MSPParser, encode_v1, encode_v2)
+
+# Software-in-the-loop flight controller stand-in.
+#
+# Opens a pseudo-terminal and answers MSP on it the way a Betaflight board
+# would, so the scripts in this repo and autonomous_flight() can run on any
+# Linux machine by pointing MSP_PORT at the pty:
+#
+#   python sitl_fc.py --link /tmp/ttyFC &
+#   MSP_PORT=/tmp/ttyFC python battery_status_check.py
+#
+# or fly the whole autonomous sequence (or a mission) against it in-process:
+#
+#   python sitl_fc.py --fly 1.json
+#
+# The model is deliberately simple: a point mass moving vertically under
+# thrust from the mean motor output, motors that spin up with a first-order
+# lag (reported as ESC telemetry), a LiPo pack with internal resistance,
+# RC override via MSP_SET_RAW_RC with AUX1 arming, and a failsafe disarm
+# when RC frames stop. Replies can be delayed (latency) and have random
+# bits flipped (corruption). time_scale runs the simulated clock (physics,
+# battery, failsafe timers) faster than wall time for soak tests.
+
+API_VERSION = (0, 1, 46)  # MSP protocol 0, API 1.46 (Betaflight 4.5)
+FC_VERSION = (4, 5, 1)
+
+# Betaflight arming disable flag bits
+ARMING_DISABLED_FAILSAFE = 1 << 1
+ARMING_DISABLED_RXLOSS = 1 << 2
+ARMING_DISABLED_THROTTLE = 1 << 7
+ARMING_DISABLED_COUNT = 26
+
+GRAVITY = 9.81
+PHYSICS_DT = 0.005  # simulated seconds per physics step
+HOVER_THROTTLE = 1500  # mean motor output that balances gravity
+DRAG = 0.8  # 1/s, linear vertical drag
+RC_TIMEOUT = 1.0  # simulated seconds without RC before failsafe
+
+CELL_COUNT = 4
+CAPACITY_MAH = 1500
+INTERNAL_RESISTANCE = 0.015  # ohm per cell
+IDLE_CURRENT = 0.5  # amps
+MAX_CURRENT = 40.0  # amps at full throttle
+
+MAX_RPM = 30000  # motor speed at full output
+ESC_TIME_CONSTANT = 0.04  # seconds, first-order motor spin-up/down
+ESC_TEMPERATURE = 35  # degrees C
+
+_DISCHARGE_CHARGE = [c for _, c in LIPO_DISCHARGE]
+
+
+# Inverse of battery_monitor.state_of_charge: resting volts per cell
+def _resting_cell_voltage(charge):
+    i = min(max(bisect.bisect_left(_DISCHARGE_CHARGE, charge), 1), len(LIPO_DISCHARGE) - 1)
+    (v0, c0), (v1, c1) = LIPO_DISCHARGE[i - 1], LIPO_DISCHARGE[i]
+    return v0 + (v1 - v0) * (charge - c0) / (c1 - c0)
+
+
+class SimulatedFC:
+    def __init__(self, latency=0.0, corruption=0.0, time_scale=1.0, seed=None,
+                 link_path=None, cycle_time=125, boot_time=0.0):
+        self.latency = latency  # seconds added to every reply
+        self.corruption = corruption  # probability that any reply byte gets a bit flipped
+        self.time_scale = time_scale
+        self.link_path = link_path
+        self.cycle_time = cycle_time  # us, reported in MSP_STATUS_EX
+        self.boot_time = boot_time  # seconds after start() before MSP is answered
+        self._booted_at = 0.0
+        self._random = random.Random(seed)
+        self._parser = MSPParser(directions=(DIRECTION_REQUEST,))
+        self._replies = []
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._unplugged_until = None  # see disconnect()
+        self._mute_until = 0.0  # see stall()
+
+        self.handlers = {
+            MSP_API_VERSION: self._api_version,
+            MSP_FC_VARIANT: self._fc_variant,
+            MSP_FC_VERSION: self._fc_version,
+            MSP_STATUS: self._status,
+            MSP_STATUS_EX: self._status_ex,
+            MSP_RX: self._rx,
+            MSP_MOTOR: self._motor,
+            MSP_ALTITUDE: self._altitude,
+            MSP_ANALOG: self._analog,
+            MSP_BATTERY_STATE: self._battery_state,
+            MSP_ESC_SENSOR_DATA: self._esc_sensor_data,
+            MSP_SET_RAW_RC: self._set_raw_rc,
+            MSP_SET_MOTOR: self._set_motor,
+            MSP_SET_ARMED: self._set_armed,
+        }
+
+        # Vehicle state
+        self.sim_time = 0.0
+        self.altitude = 0.0  # meters
+        self.velocity = 0.0  # m/s, up is positive
+        self.armed = False
+        self.channels = [1500, 1500, 1000, 1500, 1000, 1500, 1500, 1500]
+        self.last_rc = None  # sim time of the last MSP_SET_RAW_RC
+        self.motor_override = [1000] * 8
+        self.motors = [1000] * 8
+        self.rpm = [0.0] * 4
+        self.mah_drawn = 0.0
+        self.current = IDLE_CURRENT
+        self.voltage = CELL_COUNT * 4.2
+
+        # Link statistics
+        self.requests = 0
+        self.replies_sent = 0
+        self.replies_dropped = 0
+        self.bytes_corrupted = 0
+
+    # --- pty plumbing -----------------------------------------------------
+
+    def _plug(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        self._master, self._slave = master, slave
+        self.port = os.ttyname(slave)
+        if self.link_path:
+            if os.path.lexists(self.link_path):
+                os.unlink(self.link_path)
+            os.symlink(self.port, self.link_path)
+            self.port = self.link_path
+
+    def _unplug(self):
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        self._replies.clear()
+        self._parser.reset()
+
+    def start(self):
+        self._plug()
+        self._booted_at = time.monotonic() + self.boot_time
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="sitl-fc", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._unplug()
+        if self.link_path and os.path.islink(self.link_path):
+            os.unlink(self.link_path)
+
+    # Simulate a USB CDC reset: the pty hangs up (reads on the host side fail)
+    # and a new one appears after duration seconds, behind the same --link
+    # symlink. The vehicle model keeps running meanwhile.
+    def disconnect(self, duration=0.05):
+        self._unplugged_until = time.monotonic() + duration
+
+    # Keep the port open but stop answering for duration seconds
+    def stall(self, duration):
+        self._mute_until = time.monotonic() + duration
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        wall = time.monotonic()
+        while self._running:
+            timeout = PHYSICS_DT / self.time_scale
+            if self._unplugged_until is not None:
+                if self._master is not None:
+                    self._unplug()
+                elif time.monotonic() >= self._unplugged_until:
+                    self._unplugged_until = None
+                    self._plug()
+            if self._replies:
+                timeout = max(0.0, min(timeout, self._replies[0][0] - time.monotonic()))
+            if self._master is None:
+                time.sleep(timeout)
+                readable = False
+            else:
+                readable, _, _ = select.select([self._master], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except (BlockingIOError, OSError):
+                    data = b''
+                for frame in self._parser.feed(data):
+                    self._handle(frame)
+
+            now = time.monotonic()
+            elapsed = (now - wall) * self.time_scale
+            wall = now
+            with self._lock:
+                while elapsed > 0:
+                    dt = min(PHYSICS_DT, elapsed)
+                    self._step(dt)
+                    elapsed -= dt
+            self._flush(now)
+
+    def _handle(self, frame):
+        self.requests += 1
+        now = time.monotonic()
+        if now < self._mute_until or now < self._booted_at:
+            return
+        handler = self.handlers.get(frame.cmd)
+        with self._lock:
+            payload = handler(frame.payload) if handler is not None else None
+        direction = DIRECTION_RESPONSE if payload is not None else DIRECTION_ERROR
+        encoder = encode_v2 if frame.version == 2 else encode_v1
+        reply = encoder(frame.cmd, payload or b'', direction)
+        if self.corruption:
+            reply = self._corrupt(reply)
+        self._sequence += 1
+        heapq.heappush(self._replies, (time.monotonic() + self.latency, self._sequence, reply))
+
+    def _corrupt(self, reply):
+        reply = bytearray(reply)
+        for i in range(len(reply)):
+            if self._random.random() < self.corruption:
+                reply[i] ^= 1 << self._random.randrange(8)
+                self.bytes_corrupted += 1
+        return bytes(reply)
+
+    def _flush(self, now):
+        while self._master is not None and self._replies and self._replies[0][0] <= now:
+            _, _, reply = heapq.heappop(self._replies)
+            try:
+                os.write(self._master, reply)
+                self.replies_sent += 1
+            except (BlockingIOError, OSError):
+                self.replies_dropped += 1  # Nobody is reading the pty
+
+    # --- vehicle model ----------------------------------------------------
+
+    def _step(self, dt):
+        self.sim_time += dt
+        rc_lost = self.last_rc is None or self.sim_time - self.last_rc > RC_TIMEOUT
+        if self.armed and rc_lost:
+            self.armed = False  # Failsafe
+
+        throttle = self.channels[2]
+        if self.armed:
+            self.motors = [min(2000, max(1000, throttle))] * 4 + [1000] * 4
+            output = sum(self.motors[:4]) / 4.0
+            thrust = GRAVITY * (output - 1000) / (HOVER_THROTTLE - 1000)
+        else:
+            self.motors = list(self.motor_override)
+            output = 1000
+            thrust = 0.0
+
+        # Motors lag their output through the ESC and rotor inertia
+        blend = min(1.0, dt / ESC_TIME_CONSTANT)
+        for i in range(len(self.rpm)):
+            target = MAX_RPM * (self.motors[i] - 1000) / 1000.0
+            self.rpm[i] += (target - self.rpm[i]) * blend
+
+        accel = thrust - GRAVITY - DRAG * self.velocity
+        self.velocity += accel * dt
+        self.altitude += self.velocity * dt
+        if self.altitude <= 0.0:
+            self.altitude = 0.0
+            self.velocity = max(0.0, self.velocity)
+
+        # Battery: quadratic current draw, LiPo open-circuit voltage, sag
+        level = (output - 1000) / 1000.0
+        self.current = IDLE_CURRENT + MAX_CURRENT * level * level
+        self.mah_drawn += self.current * dt / 3.6
+        remaining = max(0.0, 1.0 - self.mah_drawn / CAPACITY_MAH)
+        cell = _resting_cell_voltage(remaining) - self.current * INTERNAL_RESISTANCE
+        self.voltage = CELL_COUNT * cell
+
+    def _arming_disable_flags(self):
+        flags = 0
+        if self.last_rc is None or self.sim_time - self.last_rc > RC_TIMEOUT:
+            flags |= ARMING_DISABLED_RXLOSS | ARMING_DISABLED_FAILSAFE
+        if not self.armed and self.channels[2] > 1050:
+            flags |= ARMING_DISABLED_THROTTLE
+        return flags
+
+    def _try_arm(self):
+        if self._arming_disable_flags() == 0:
+            self.armed = True
+        return self.armed
+
+    # --- MSP handlers: return the reply payload, or None for an error -----
+
+    def _api_version(self, payload):
+        return bytes(API_VERSION)
+
+    def _fc_variant(self, payload):
+        return b'BTFL'
+
+    def _fc_version(self, payload):
+        return bytes(FC_VERSION)
+
+    def _status_common(self):
+        return struct.pack('<HHHIBH', self.cycle_time, 0, 0b100011,
+                           1 if self.armed else 0, 0, 5)
+
+    def _status(self, payload):
+        return self._status_common() + b'\x00'
+
+    def _status_ex(self, payload):
+        return self._status_common() + struct.pack(
+            '<BBBBIB', 3, 0, 0, ARMING_DISABLED_COUNT, self._arming_disable_flags(), 0)
+
+    def _rx(self, payload):
+        return struct.pack(f'<{len(self.channels)}H', *self.channels)
+
+    def _motor(self, payload):
+        return struct.pack('<8H', *self.motors)
+
+    def _altitude(self, payload):
+        return struct.pack('<ihi', int(self.altitude * 100), int(self.velocity * 100),
+                           int(self.altitude * 100))
+
+    def _analog(self, payload):
+        return struct.pack('<BHHhH', min(255, int(self.voltage * 10)), int(self.mah_drawn),
+                           1023, int(self.current * 100), int(self.voltage * 100))
+
+    def _battery_state(self, payload):
+        return struct.pack('<BHBHHBH', CELL_COUNT, CAPACITY_MAH, min(255, int(self.voltage * 10)),
+                           int(self.mah_drawn), int(self.current * 100), 0,
+                           int(self.voltage * 100))
+
+    def _esc_sensor_data(self, payload):
+        data = struct.pack('<B', len(self.rpm))
+        for rpm in self.rpm:
+            data += struct.pack('<BH', ESC_TEMPERATURE, int(rpm))
+        return data
+
+    def _set_raw_rc(self, payload):
+        count = len(payload) // 2
+        if count == 0:
+            return None
+        channels = list(struct.unpack_from(f'<{count}H', payload))
+        self.channels[:count] = channels
+        self.last_rc = self.sim_time
+        # AUX1 high arms (throttle low), AUX1 low disarms
+        aux1 = self.channels[4]
+        if aux1 > 1700 and not self.armed:
+            self._try_arm()
+        elif aux1 < 1300:
+            self.armed = False
+        return b''
+
+    def _set_motor(self, payload):
+        if self.armed:
+            return None  # Betaflight ignores motor test while armed
+        count = min(8, len(payload) // 2)
+        values = struct.unpack_from(f'<{count}H', payload)
+        self.motor_override[:count] = [v if v else 1000 for v in values]
+        return b''
+
+    def _set_armed(self, payload):
+        if not payload:
+            return None
+        if payload[0]:
+            self._try_arm()
+        else:
+            self.armed = False
+        return b''
+
+
+# Run autonomous_flight() in-process against the simulator, with the sonar
+# reading the simulated altitude
+def fly(sim, mission_path=None):
+    import full_autonomous_flight
+    from hcsr04 import SimulatedBackend
+
+    full_autonomous_flight.MSP_PORT = sim.port
+    backend = SimulatedBackend(lambda: sim.altitude, noise=0.01)
+    full_autonomous_flight.autonomous_flight(mission_path, altimeter_backend=backend)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MSP flight controller simulator on a pty")
+    parser.add_argument("--latency", type=float, default=0.0, help="reply delay in seconds")
+    parser.add_argument("--corruption", type=float, default=0.0,
+                        help="per-byte probability of a flipped bit in replies")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="simulated seconds per wall-clock second")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--boot-time", type=float, default=0.0,
+                        help="seconds before the simulated FC starts answering")
+    parser.add_argument("--link", default=None, help="create a symlink to the pty at this path")
+    parser.add_argument("--fly", nargs="?", const="", default=None, metavar="MISSION",
+                        help="run autonomous_flight() against the simulator (optionally a mission)")
+    args = parser.parse_args(argv)
+
+    sim = SimulatedFC(args.latency, args.corruption, args.time_scale, args.seed, args.link,
+                      boot_time=args.boot_time)
+    sim.start()
+    print(f"Simulated flight controller on {sim.port}")
+    try:
+        if args.fly is not None:
+            fly(sim, args.fly or None)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+        print(f"Requests: {sim.requests}, replies: {sim.replies_sent}, "
+              f"dropped: {sim.replies_dropped}, corrupted bytes: {sim.bytes_corrupted}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
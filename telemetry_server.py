@@ -0,0 +1,786 @@
+import argparse
+import base64
+import hashlib
+import os
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+
+from control_loop import ControlLoop
+from msp_messages import (MSP_ALTITUDE, MSP_BATTERY_STATE, MSP_MOTOR, MSP_RX, MSP_STATUS_EX,
+                          REGISTRY)
+from msp_transport import MSPMultiplexer, connect_msp
+
+# Ground-station telemetry publisher.
+#
+# Streams the latest flight state to any number of ground-station clients
+# over UDP and/or a local WebSocket. The flight process only drops the
+# newest sample into TelemetryState: MSP replies are picked up by tapping
+# the multiplexer, and controller state by a couple of attribute stores.
+# One publisher thread owns every socket, so nothing in the control loop
+# ever waits on a client. A frame is built from the latest state at most
+# once per change and sent to each client whose rate limit allows.
+# Samples are coalesced, never queued: a client that is slow to drain its
+# socket gets the newest frame once it can take one, and the stale ones in
+# between are dropped (counted as coalesced).
+#
+# Frame layout (little-endian):
+#
+#   header    magic b'TL', u8 format version, u8 section count,
+#             u32 sequence (state updates so far), f64 monotonic time
+#   sections  u8 tag, u8 length, payload; one per piece of state known:
+#     SECTION_ALTITUDE  f32 altitude m, f32 vario m/s           (MSP_ALTITUDE)
+#     SECTION_BATTERY   f32 voltage V, f32 current A, u16 mAh drawn,
+#                       u8 cells, u8 state                     (MSP_BATTERY_STATE)
+#     SECTION_STATUS    u8 armed, u32 arming disable flags,
+#                       u16 cycle time us                      (MSP_STATUS_EX)
+#     SECTION_RC        u16 per channel, us                    (MSP_RX)
+#     SECTION_MOTORS    u16 per motor                          (MSP_MOTOR)
+#     SECTION_ESTIMATE  f32 altitude m, f32 velocity m/s       (altitude estimator)
+#     SECTION_CONTROL   f32 setpoint m, f32 altitude m, u16 throttle
+#
+# UDP clients subscribe by sending "SUB [rate_hz]" to the server port and
+# have to repeat it within CLIENT_TIMEOUT; "UNSUB" ends the stream.
+# WebSocket clients connect to ws://host:port/?rate=5 and get one binary
+# message per frame; a "SUB rate_hz" text message changes the rate. Pings
+# are answered, a close is echoed, and protocol errors (unmasked or
+# oversized frames) close the connection with the RFC 6455 status code.
+#
+# Subscriptions are not authenticated, so everything binds to loopback
+# unless an address is given explicitly. Serving the LAN (e.g.
+# --udp 0.0.0.0:15550) is an opt-in.
+#
+#   MSP_PORT=/dev/ttyACM0 python telemetry_server.py serve --ws 127.0.0.1:8765
+#   python telemetry_server.py listen --rate 5
+#   python telemetry_server.py listen --server 192.168.4.1:15550    # Pi serving --udp 0.0.0.0:15550
+
+FORMAT_VERSION = 1
+UDP_PORT = 15550  # Clear of MAVLink's 14550
+WS_PORT = 8765
+DEFAULT_RATE_HZ = 10.0  # per client, unless it asks for another rate
+MAX_RATE_HZ = 50.0
+CLIENT_TIMEOUT = 5.0  # seconds a UDP subscription (or a stuck WebSocket send) lasts
+MAX_CLIENTS = 16
+WS_SEND_BUFFER = 4096  # bytes; keeps the kernel from queueing seconds of stale frames
+POLL_INTERVAL = 0.1  # longest the publisher thread sleeps, bounds stop() latency
+
+SECTION_ALTITUDE = 1
+SECTION_BATTERY = 2
+SECTION_STATUS = 3
+SECTION_RC = 4
+SECTION_MOTORS = 5
+SECTION_ESTIMATE = 6
+SECTION_CONTROL = 7
+
+# MSP replies the state keeps, and what is served from them
+TELEMETRY_COMMANDS = (MSP_ALTITUDE, MSP_BATTERY_STATE, MSP_STATUS_EX, MSP_RX, MSP_MOTOR)
+
+_HEADER = struct.Struct('<2sBBId')
+_SECTION = struct.Struct('<BB')
+_PAIR = struct.Struct('<ff')
+_BATTERY = struct.Struct('<ffHBB')
+_STATUS = struct.Struct('<BIH')
+_CONTROL = struct.Struct('<ffH')
+_U16_ARRAYS = {}
+
+
+def _u16_array(count):
+    layout = _U16_ARRAYS.get(count)
+    if layout is None:
+        layout = _U16_ARRAYS[count] = struct.Struct(f'<{count}H')
+    return layout
+
+
+def _pack_u16s(values):
+    return _u16_array(len(values)).pack(*values)
+
+
+# MSP reply -> section payload, from the registry's decoded record
+_MSP_SECTIONS = (
+    (MSP_ALTITUDE, SECTION_ALTITUDE, lambda r: _PAIR.pack(r.altitude, r.vario)),
+    (MSP_BATTERY_STATE, SECTION_BATTERY,
+     lambda r: _BATTERY.pack(r.voltage, r.current, r.mah_drawn, r.cells, r.state)),
+    (MSP_STATUS_EX, SECTION_STATUS,
+     lambda r: _STATUS.pack(r.armed, r.arming_disable_flags or 0, r.cycle_time)),
+    (MSP_RX, SECTION_RC, _pack_u16s),
+    (MSP_MOTOR, SECTION_MOTORS, _pack_u16s),
+)
+
+# Section tag -> (name, field names or None for a u16 array, layout)
+_SECTION_LAYOUTS = {
+    SECTION_ALTITUDE: ("altitude", ("altitude", "vario"), _PAIR),
+    SECTION_BATTERY: ("battery", ("voltage", "current", "mah_drawn", "cells", "state"), _BATTERY),
+    SECTION_STATUS: ("status", ("armed", "arming_disable_flags", "cycle_time"), _STATUS),
+    SECTION_RC: ("rc", None, None),
+    SECTION_MOTORS: ("motors", None, None),
+    SECTION_ESTIMATE: ("estimate", ("altitude", "velocity"), _PAIR),
+    SECTION_CONTROL: ("control", ("setpoint", "altitude", "throttle"), _CONTROL),
+}
+
+
+def encode_frame(seq, t, sections):
+    parts = [_HEADER.pack(b'TL', FORMAT_VERSION, len(sections), seq & 0xFFFFFFFF, t)]
+    for tag, payload in sections:
+        parts.append(_SECTION.pack(tag, len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+# Frame -> {"seq", "time", section name: {field: value} or [values]}
+def decode_frame(data):
+    magic, version, count, seq, t = _HEADER.unpack_from(data)
+    if magic != b'TL' or version != FORMAT_VERSION:
+        raise ValueError(f"not a telemetry frame (magic {magic!r}, version {version})")
+    result = {"seq": seq, "time": t}
+    offset = _HEADER.size
+    for _ in range(count):
+        tag, length = _SECTION.unpack_from(data, offset)
+        offset += _SECTION.size
+        payload = data[offset:offset + length]
+        offset += length
+        if tag not in _SECTION_LAYOUTS:
+            continue  # Newer sender; skip what we do not know
+        name, fields, layout = _SECTION_LAYOUTS[tag]
+        if fields is None:
+            result[name] = list(_u16_array(length // 2).unpack_from(payload))
+        else:
+            result[name] = dict(zip(fields, layout.unpack_from(payload)))
+    return result
+
+
+# Latest flight state. Writers (the multiplexer's reader thread, the
+# control and telemetry loops) only store and bump a counter; decoding and
+# packing happen on the publisher thread, once per change.
+class TelemetryState:
+    def __init__(self, commands=TELEMETRY_COMMANDS, clock=time.monotonic):
+        self.commands = frozenset(commands)
+        self.clock = clock
+        self.version = 0
+        self.updated = 0.0
+        self._payloads = {}  # MSP command -> latest reply payload
+        self._values = {}  # section tag -> packed payload
+        self._lock = threading.Lock()
+        self._frame = (None, b'')
+        self.on_change = None  # called after every update, e.g. to wake the publisher
+
+    # Multiplexer tap: mux.subscribe(None, state.record_frame)
+    def record_frame(self, frame):
+        if frame.cmd not in self.commands or frame.is_error:
+            return
+        payload = bytes(frame.payload)
+        with self._lock:
+            self._payloads[frame.cmd] = payload
+            self.version += 1
+            self.updated = self.clock()
+        if self.on_change is not None:
+            self.on_change()
+
+    def _set(self, tag, payload):
+        with self._lock:
+            self._values[tag] = payload
+            self.version += 1
+            self.updated = self.clock()
+        if self.on_change is not None:
+            self.on_change()
+
+    def update_estimate(self, altitude, velocity):
+        self._set(SECTION_ESTIMATE, _PAIR.pack(altitude, velocity))
+
+    def update_control(self, setpoint, altitude, throttle):
+        self._set(SECTION_CONTROL, _CONTROL.pack(setpoint, altitude, int(throttle)))
+
+    # (version, frame bytes) for the current state, rebuilt only when it changed
+    def frame(self):
+        with self._lock:
+            version = self.version
+            if self._frame[0] == version:
+                return self._frame
+            payloads = dict(self._payloads)
+            values = dict(self._values)
+            updated = self.updated
+        sections = []
+        for cmd, tag, pack in _MSP_SECTIONS:
+            payload = payloads.get(cmd)
+            if payload is None:
+                continue
+            try:
+                sections.append((tag, pack(REGISTRY[cmd].decode(payload))))
+            except struct.error:
+                pass  # Short reply; serve the other sections
+        sections.extend(sorted(values.items()))
+        frame = (version, encode_frame(version, updated, sections))
+        with self._lock:
+            if self._frame[0] is None or self._frame[0] < version:
+                self._frame = frame
+        return frame
+
+
+def _clamp_rate(rate):
+    return max(0.1, min(MAX_RATE_HZ, rate))
+
+
+class _Client:
+    __slots__ = ('address', 'interval', 'next_due', 'sent_version', 'last_seen', 'frames_sent',
+                 'coalesced')
+
+    def __init__(self, address, rate, now):
+        self.address = address
+        self.interval = 1.0 / _clamp_rate(rate)
+        self.next_due = now
+        self.sent_version = None
+        self.last_seen = now
+        self.frames_sent = 0
+        self.coalesced = 0  # state updates never sent to it (rate limit, slow socket)
+
+    @property
+    def rate(self):
+        return 1.0 / self.interval
+
+    def as_dict(self):
+        return {"address": f"{self.address[0]}:{self.address[1]}",
+                "rate_hz": round(self.rate, 1), "frames_sent": self.frames_sent,
+                "coalesced": self.coalesced}
+
+
+class _WebSocketClient(_Client):
+    __slots__ = ('sock', 'open', 'inbuf', 'out', 'message', 'message_opcode')
+
+    def __init__(self, sock, address, rate, now):
+        super().__init__(address, rate, now)
+        self.sock = sock
+        self.open = False  # Handshake done
+        self.inbuf = bytearray()
+        self.out = b''  # Unsent bytes: at most one frame, plus any pongs
+        self.message = None  # Fragments of an unfinished data message
+        self.message_opcode = 0
+
+
+_WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_WS_MAX_REQUEST = 8192
+_WS_MAX_MESSAGE = 1024  # bytes; clients only send short SUB commands and pings
+
+# Close status codes (RFC 6455 7.4.1)
+WS_CLOSE_NORMAL = 1000
+WS_CLOSE_PROTOCOL_ERROR = 1002
+WS_CLOSE_TOO_BIG = 1009
+
+
+def _ws_message(payload, opcode=0x2):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('<BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+# Complete client -> server frames in buf as (fin, opcode, payload);
+# consumed bytes are removed. Raises ValueError(close code, reason) for
+# frames the server must not accept: unmasked (clients always mask),
+# reserved bits set, control frames over 125 bytes or fragmented, and
+# anything over _WS_MAX_MESSAGE, as soon as its header says so.
+def _ws_read(buf):
+    frames = []
+    while len(buf) >= 2:
+        fin = bool(buf[0] & 0x80)
+        opcode = buf[0] & 0x0F
+        length = buf[1] & 0x7F
+        if buf[0] & 0x70:
+            raise ValueError(WS_CLOSE_PROTOCOL_ERROR, "reserved bits set")
+        if not buf[1] & 0x80:
+            raise ValueError(WS_CLOSE_PROTOCOL_ERROR, "unmasked client frame")
+        if opcode >= 0x8 and (length > 125 or not fin):
+            raise ValueError(WS_CLOSE_PROTOCOL_ERROR, "bad control frame")
+        offset = 2
+        if length == 126:
+            if len(buf) < 4:
+                break
+            length = struct.unpack_from('>H', buf, 2)[0]
+            offset = 4
+        elif length == 127:
+            if len(buf) < 10:
+                break
+            length = struct.unpack_from('>Q', buf, 2)[0]
+            offset = 10
+        if length > _WS_MAX_MESSAGE:
+            raise ValueError(WS_CLOSE_TOO_BIG, f"{length} byte frame")
+        if len(buf) < offset + 4 + length:
+            break
+        mask = buf[offset:offset + 4]
+        offset += 4
+        payload = bytes(b ^ mask[i & 3] for i, b in enumerate(buf[offset:offset + length]))
+        del buf[:offset + length]
+        frames.append((fin, opcode, payload))
+    return frames
+
+
+# "SUB [rate]" from a client: the rate it asks for, or None if not a subscribe
+def _parse_subscribe(text):
+    parts = text.split()
+    if not parts or parts[0].upper() != "SUB":
+        return None
+    try:
+        return float(parts[1]) if len(parts) > 1 else DEFAULT_RATE_HZ
+    except ValueError:
+        return DEFAULT_RATE_HZ
+
+
+class TelemetryServer:
+    def __init__(self, state=None, udp_address=("127.0.0.1", UDP_PORT), ws_address=None,
+                 max_clients=MAX_CLIENTS, clock=time.monotonic):
+        self.state = state if state is not None else TelemetryState(clock=clock)
+        self.udp_address = udp_address
+        self.ws_address = ws_address
+        self.max_clients = max_clients
+        self.clock = clock
+        self.udp_clients = {}  # address -> _Client
+        self.ws_clients = {}  # socket -> _WebSocketClient
+        self._udp = None
+        self._listener = None
+        self._selector = None
+        self._wake_r = self._wake_w = None
+        self._waiting = False  # Publisher asleep until the state changes
+        self._running = False
+        self._thread = None
+
+    # Bind the sockets (OSError if a port is taken) and start publishing
+    def start(self):
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self.state.on_change = self._on_change
+        try:
+            if self.udp_address is not None:
+                self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self._udp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._udp.bind(self.udp_address)
+                self._udp.setblocking(False)
+                self.udp_address = self._udp.getsockname()
+                self._selector.register(self._udp, selectors.EVENT_READ)
+            if self.ws_address is not None:
+                self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._listener.bind(self.ws_address)
+                self._listener.listen(self.max_clients)
+                self._listener.setblocking(False)
+                self.ws_address = self._listener.getsockname()
+                self._selector.register(self._listener, selectors.EVENT_READ)
+        except OSError:
+            self._close_sockets()
+            raise
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self.state.on_change = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._close_sockets()
+
+    def _close_sockets(self):
+        for client in list(self.ws_clients.values()):
+            self._drop(client)
+        for sock in (self._udp, self._listener, self._wake_r, self._wake_w):
+            if sock is not None:
+                sock.close()
+        self._udp = self._listener = self._wake_r = self._wake_w = None
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
+    def clients(self):
+        return [client.as_dict() for client in list(self.udp_clients.values()) +
+                list(self.ws_clients.values())]
+
+    # Runs on the writer's thread: one flag check per update, and a single
+    # byte to the wake socket only while the publisher sleeps on the state
+    def _on_change(self):
+        if self._waiting:
+            self._waiting = False
+            try:
+                self._wake_w.send(b'\0')
+            except OSError:
+                pass  # Already has a wakeup pending
+
+    def _run(self):
+        selector = self._selector
+        while self._running:
+            now = self.clock()
+            self._expire(now)
+            self._publish(now)
+            # Clients that have seen the current state wait for the next
+            # change instead of their next slot. The flag goes up before the
+            # version is read, so an update in between still wakes us.
+            self._waiting = True
+            version = self.state.version
+            due = [c.next_due for c in self.udp_clients.values() if c.sent_version != version]
+            due += [c.next_due for c in self.ws_clients.values()
+                    if c.open and not c.out and c.sent_version != version]
+            timeout = POLL_INTERVAL if not due else min(POLL_INTERVAL, min(due) - self.clock())
+            events = selector.select(max(0.0, timeout))
+            self._waiting = False
+            for key, mask in events:
+                sock = key.fileobj
+                if sock is self._wake_r:
+                    self._drain_wake()
+                elif sock is self._udp:
+                    self._read_udp()
+                elif sock is self._listener:
+                    self._accept()
+                else:
+                    client = self.ws_clients.get(sock)
+                    if client is None:
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        self._read_ws(client)
+                    if mask & selectors.EVENT_WRITE and sock in self.ws_clients:
+                        self._flush(client)
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(64):
+                pass
+        except OSError:
+            pass
+
+    # Send the latest frame to every client that is due and has not seen it
+    def _publish(self, now):
+        frame = None
+        for client in list(self.udp_clients.values()) + list(self.ws_clients.values()):
+            if now < client.next_due:
+                continue
+            if frame is None:
+                version, frame = self.state.frame()
+            if client.sent_version == version:
+                continue  # Nothing new since the last frame it got
+            if isinstance(client, _WebSocketClient):
+                if not client.open:
+                    continue
+                if client.out:
+                    continue  # Still sending the previous one
+                client.out = _ws_message(frame)
+                self._flush(client)
+            else:
+                try:
+                    self._udp.sendto(frame, client.address)
+                except OSError:
+                    # Socket buffer full, or ICMP unreachable (it expires);
+                    # try again next slot rather than right away
+                    client.next_due = now + client.interval
+                    continue
+            if client.sent_version is not None and version - client.sent_version > 1:
+                client.coalesced += version - client.sent_version - 1
+            client.sent_version = version
+            client.frames_sent += 1
+            client.next_due = max(client.next_due + client.interval, now)
+
+    def _expire(self, now):
+        for address, client in list(self.udp_clients.items()):
+            if now - client.last_seen > CLIENT_TIMEOUT:
+                del self.udp_clients[address]
+        for client in list(self.ws_clients.values()):
+            if now - client.last_seen > CLIENT_TIMEOUT and (client.out or not client.open):
+                self._drop(client)  # Stuck handshake, or not reading at all
+
+    def _read_udp(self):
+        while True:
+            try:
+                data, address = self._udp.recvfrom(256)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue  # ICMP error from an earlier send
+            now = self.clock()
+            text = data.decode('ascii', 'replace')
+            rate = _parse_subscribe(text)
+            if rate is not None:
+                client = self.udp_clients.get(address)
+                if client is None:
+                    if len(self.udp_clients) + len(self.ws_clients) >= self.max_clients:
+                        continue
+                    client = self.udp_clients[address] = _Client(address, rate, now)
+                client.interval = 1.0 / _clamp_rate(rate)
+                client.last_seen = now
+            elif text.strip().upper() == "UNSUB":
+                self.udp_clients.pop(address, None)
+
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        if len(self.udp_clients) + len(self.ws_clients) >= self.max_clients:
+            sock.close()
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, WS_SEND_BUFFER)
+        client = _WebSocketClient(sock, address, DEFAULT_RATE_HZ, self.clock())
+        self.ws_clients[sock] = client
+        self._selector.register(sock, selectors.EVENT_READ)
+
+    def _drop(self, client):
+        self.ws_clients.pop(client.sock, None)
+        try:
+            self._selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def _read_ws(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(client)
+            return
+        client.inbuf += data
+        client.last_seen = self.clock()
+        if not client.open:
+            self._handshake(client)
+            return
+        try:
+            frames = _ws_read(client.inbuf)
+        except ValueError as e:
+            self._close(client, e.args[0])
+            return
+        for fin, opcode, payload in frames:
+            # Control frames may come between the fragments of a message
+            if opcode == 0x8:  # Close: echo the client's status code
+                self._close(client, struct.unpack('>H', payload[:2])[0]
+                            if len(payload) >= 2 else WS_CLOSE_NORMAL)
+                return
+            if opcode == 0x9:  # Ping; the pong goes out after any pending frame
+                client.out += _ws_message(payload, 0xA)
+                self._flush(client)
+                if client.sock not in self.ws_clients:
+                    return
+                continue
+            if opcode == 0xA:
+                continue  # Unsolicited pong
+            if (opcode == 0x0) != (client.message is not None):
+                # Continuation without a message, or a new one before the last ended
+                self._close(client, WS_CLOSE_PROTOCOL_ERROR)
+                return
+            if opcode != 0x0:
+                client.message = bytearray()
+                client.message_opcode = opcode
+            client.message += payload
+            if len(client.message) > _WS_MAX_MESSAGE:
+                self._close(client, WS_CLOSE_TOO_BIG)
+                return
+            if not fin:
+                continue
+            message, client.message = bytes(client.message), None
+            if client.message_opcode == 0x1:
+                rate = _parse_subscribe(message.decode('utf-8', 'replace'))
+                if rate is not None:
+                    client.interval = 1.0 / _clamp_rate(rate)
+        if len(client.inbuf) > _WS_MAX_REQUEST:
+            self._drop(client)
+
+    # Best-effort close frame after whatever is still pending, then drop
+    def _close(self, client, code=WS_CLOSE_NORMAL):
+        try:
+            client.sock.send(client.out + _ws_message(struct.pack('>H', code), 0x8))
+        except OSError:
+            pass
+        self._drop(client)
+
+    def _handshake(self, client):
+        end = client.inbuf.find(b'\r\n\r\n')
+        if end < 0:
+            if len(client.inbuf) > _WS_MAX_REQUEST:
+                self._drop(client)
+            return
+        request = bytes(client.inbuf[:end]).decode('latin-1').split('\r\n')
+        del client.inbuf[:end + 4]
+        headers = {}
+        for line in request[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if not request[0].startswith('GET ') or key is None:
+            client.sock.send(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            self._drop(client)
+            return
+        path = request[0].split()[1] if len(request[0].split()) > 1 else '/'
+        for param in path.partition('?')[2].split('&'):
+            name, _, value = param.partition('=')
+            if name == 'rate':
+                rate = _parse_subscribe(f"SUB {value}")
+                client.interval = 1.0 / _clamp_rate(rate)
+        accept = base64.b64encode(hashlib.sha1(key.encode('ascii') + _WS_GUID).digest())
+        client.out = (b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                      b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        client.open = True
+        client.next_due = self.clock()
+        self._flush(client)
+
+    # Push as much of client.out as the socket takes; wait for EVENT_WRITE
+    # for the rest instead of blocking
+    def _flush(self, client):
+        try:
+            sent = client.sock.send(client.out)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._drop(client)
+            return
+        client.out = client.out[sent:]
+        if client.out:
+            self._selector.modify(client.sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        else:
+            client.last_seen = self.clock()
+            self._selector.modify(client.sock, selectors.EVENT_READ)
+
+
+# UDP subscriber, e.g. for a ground-station laptop. Renews the subscription
+# every CLIENT_TIMEOUT / 3 while frames are read.
+class TelemetryClient:
+    def __init__(self, server, rate=DEFAULT_RATE_HZ, clock=time.monotonic):
+        self.server = server
+        self.rate = rate
+        self.clock = clock
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._renew_at = 0.0
+
+    def _subscribe(self):
+        now = self.clock()
+        if now >= self._renew_at:
+            self.sock.sendto(f"SUB {self.rate:g}".encode('ascii'), self.server)
+            self._renew_at = now + CLIENT_TIMEOUT / 3
+
+    # Next frame as decode_frame() returns it, or None on timeout
+    def read(self, timeout=1.0):
+        deadline = self.clock() + timeout
+        while True:
+            self._subscribe()
+            left = deadline - self.clock()
+            if left <= 0:
+                return None
+            self.sock.settimeout(min(left, CLIENT_TIMEOUT / 3))
+            try:
+                data, _ = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except ConnectionRefusedError:
+                continue  # Server not up yet
+            try:
+                return decode_frame(data)
+            except (ValueError, struct.error):
+                continue
+
+    def close(self):
+        try:
+            self.sock.sendto(b"UNSUB", self.server)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# "host:port" -> (host, port); a bare ":port" gets default_host
+def parse_address(text, default_host="127.0.0.1"):
+    host, _, port = text.rpartition(':')
+    return (host or default_host, int(port))
+
+
+def print_frame(frame):
+    parts = [f"#{frame['seq']}"]
+    if "altitude" in frame:
+        parts.append(f"alt {frame['altitude']['altitude']:.2f} m "
+                     f"({frame['altitude']['vario']:+.2f} m/s)")
+    if "estimate" in frame:
+        parts.append(f"est {frame['estimate']['altitude']:.2f} m")
+    if "battery" in frame:
+        parts.append(f"bat {frame['battery']['voltage']:.2f} V {frame['battery']['current']:.1f} A")
+    if "status" in frame:
+        parts.append("ARMED" if frame['status']['armed'] else "disarmed")
+    if "control" in frame:
+        parts.append(f"thr {frame['control']['throttle']}")
+    if "motors" in frame:
+        parts.append(f"motors {frame['motors'][:4]}")
+    print("  ".join(parts))
+
+
+def serve(args):
+    transport = connect_msp(args.port, args.baudrate)
+    mux = MSPMultiplexer(transport)
+    server = TelemetryServer(udp_address=parse_address(args.udp) if args.udp else None,
+                             ws_address=parse_address(args.ws) if args.ws else None)
+    mux.subscribe(None, server.state.record_frame)
+    mux.start()
+    server.start()
+    print(f"Serving telemetry: UDP {server.udp_address}, WebSocket {server.ws_address}")
+    loop = ControlLoop(args.poll_rate)
+
+    def step(now, dt):
+        mux.request_many(TELEMETRY_COMMANDS, timeout=loop.period)
+        return False
+
+    try:
+        loop.run(step, args.duration)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for client in server.clients():
+            print(f"  {client}")
+        server.stop()
+        mux.stop()
+        transport.close()
+    return 0
+
+
+def listen(args):
+    client = TelemetryClient(parse_address(args.server), args.rate)
+    end = None if args.duration is None else time.monotonic() + args.duration
+    try:
+        while end is None or time.monotonic() < end:
+            frame = client.read(1.0)
+            if frame is None:
+                print("no telemetry")
+            else:
+                print_frame(frame)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ground-station telemetry over UDP/WebSocket")
+    modes = parser.add_subparsers(dest="mode", required=True)
+    serve_parser = modes.add_parser("serve", help="poll the FC and publish its telemetry")
+    serve_parser.add_argument("--port", default=os.environ.get("MSP_PORT", "/dev/ttyACM0"))
+    serve_parser.add_argument("--baudrate", type=int, default=115200)
+    serve_parser.add_argument("--udp", default=f"127.0.0.1:{UDP_PORT}",
+                              help="UDP address to serve on (0.0.0.0:port for the LAN), "
+                                   "'' to disable")
+    serve_parser.add_argument("--ws", default="", help="WebSocket address, e.g. 127.0.0.1:8765")
+    serve_parser.add_argument("--poll-rate", type=float, default=DEFAULT_RATE_HZ)
+    serve_parser.add_argument("--duration", type=float, default=None)
+    listen_parser = modes.add_parser("listen", help="subscribe over UDP and print frames")
+    listen_parser.add_argument("--server", default=f"127.0.0.1:{UDP_PORT}")
+    listen_parser.add_argument("--rate", type=float, default=DEFAULT_RATE_HZ)
+    listen_parser.add_argument("--duration", type=float, default=None)
+    args = parser.parse_args(argv)
+    return serve(args) if args.mode == "serve" else listen(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,55 +1,17 @@
+import os
 import serial
 import struct
 import time
 
-class MSP:
-    def __init__(self, port, baudrate=115200):
-        self.ser = serial.Serial(port, baudrate, timeout=1)
-        time.sleep(2)  # Wait for connection to establish
-        
-    def send_cmd(self, cmd, data=None):
-        if data is None:
-            data = []
-        size = len(data)
-        checksum = 0
-        
-        # Calculate checksum
-        checksum ^= size
-        checksum ^= cmd
-        for i in data:
-            checksum ^= i
-        
-        # Construct message
-        msg = b'$M<' + struct.pack('<BB', size, cmd)
-        msg += bytes(data)
-        msg += struct.pack('<B', checksum)
-        
-        # Send message
-        self.ser.write(msg)
-        
-    def read_response(self, cmd):
-        header = self.ser.read(3)  # $M>
-        if len(header) != 3:
-            print("Error: No proper header received")
-            return None
-            
-        size = ord(self.ser.read(1))
-        command = ord(self.ser.read(1))
-        
-        if command != cmd:
-            print(f"Error: Expected command {cmd}, got {command}")
-            return None
-            
-        data = self.ser.read(size)
-        checksum = ord(self.ser.read(1))
-        
-        return data
-    
+from msp_messages import MSP_SET_ARMED, MSP_STATUS_EX, decode_status_ex
+from msp_transport import MSPClient
+
+class MSP(MSPClient):
     def disarm(self):
         # Method 1: Direct disarming via MSP_SET_ARMED
         print("Disarming using MSP_SET_ARMED...")
-        self.send_cmd(216, [0])  # MSP_SET_ARMED = 216
-        return self.read_response(216)
+        self.send_cmd(MSP_SET_ARMED, [0])
+        return self.read_response(MSP_SET_ARMED)
     
     def disarm_via_channels(self):
         # Method 2: Disarming via RC channels
@@ -64,30 +26,20 @@ class MSP:
         
         return True
     
-    def set_raw_rc(self, channels):
-        # MSP_SET_RAW_RC = 200
-        data = []
-        for ch in channels:
-            data.extend([ch & 0xFF, (ch >> 8) & 0xFF])
-        self.send_cmd(200, data)
-        return self.read_response(200)
-    
-    def get_status(self):
-        # MSP_STATUS_EX = 150
-        self.send_cmd(150)
-        data = self.read_response(150)
+    def get_status(self, snapshot=None):
+        data = self._payload(MSP_STATUS_EX, snapshot)
         
-        if data and len(data) >= 14:
-            arming_flags = data[2] + (data[3] << 8)
-            return {
-                "armed": bool(arming_flags & 1)
-            }
-        return None
+        if not data:
+            return None
+        try:
+            return decode_status_ex(data)
+        except struct.error:
+            return None  # Short payload
 
 # Main script
 if __name__ == "__main__":
-    # Change this to your actual serial port
-    serial_port = "/dev/ttyACM0"
+    # Change this to your actual serial port (or set MSP_PORT, e.g. to a sitl_fc.py pty)
+    serial_port = os.environ.get("MSP_PORT", "/dev/ttyACM0")
     
     try:
         print(f"Connecting to flight controller on {serial_port}...")
@@ -98,9 +50,9 @@ if __name__ == "__main__":
         # Check current arming status
         status = msp.get_status()
         if status:
-            print(f"Current state: {'ARMED' if status['armed'] else 'DISARMED'}")
+            print(f"Current state: {'ARMED' if status.armed else 'DISARMED'}")
             
-            if not status['armed']:
+            if not status.armed:
                 print("Drone is already disarmed.")
                 exit()
         
@@ -118,7 +70,7 @@ if __name__ == "__main__":
         # Verify disarmed status
         status = msp.get_status()
         if status:
-            if status['armed']:
+            if status.armed:
                 print("❌ DISARM FAILED! Drone is still armed!")
                 print("Try disconnecting the battery if safe to do so.")
             else:
@@ -0,0 +1,51 @@
+import pytest
+
+from altitude_estimator import MAX_EXTRAPOLATION, AltitudeEstimator
+
+
+def climbing(estimator, rate=0.5, hz=50, seconds=4.0, baro_offset=None):
+    for i in range(int(seconds * hz)):
+        t = i / hz
+        estimator.add_sonar(rate * t, t)
+        if baro_offset is not None and i % 5 == 0:
+            estimator.add_baro(rate * t + baro_offset, t)
+    return t
+
+
+def test_tracks_a_steady_climb_from_sonar():
+    estimator = AltitudeEstimator(clock=lambda: 0.0)
+    t = climbing(estimator)
+    altitude, velocity = estimator.estimate(t)
+    assert altitude == pytest.approx(0.5 * t, abs=0.05)
+    assert velocity == pytest.approx(0.5, abs=0.05)
+    assert estimator.rejected["sonar"] == 0
+
+
+def test_outliers_are_gated_out():
+    estimator = AltitudeEstimator(clock=lambda: 0.0)
+    t = climbing(estimator)
+    assert not estimator.add_sonar(0.5 * t + 2.0, t + 0.02)  # Echo off something else
+    assert estimator.rejected["sonar"] == 1
+    assert estimator.altitude(t + 0.02) == pytest.approx(0.5 * (t + 0.02), abs=0.05)
+
+
+def test_sonar_beyond_its_range_is_ignored():
+    estimator = AltitudeEstimator(clock=lambda: 0.0)
+    assert not estimator.add_sonar(4.5, 0.1)
+    assert not estimator.add_sonar(None, 0.1)
+    assert estimator.accepted["sonar"] == estimator.rejected["sonar"] == 0
+
+
+def test_baro_offset_is_learned_as_a_bias():
+    estimator = AltitudeEstimator(clock=lambda: 0.0)
+    t = climbing(estimator, baro_offset=312.0)  # Pressure altitude above sea level
+    assert estimator.altitude(t) == pytest.approx(0.5 * t, abs=0.05)
+    assert estimator.rejected["baro"] == 0
+
+
+def test_extrapolation_is_capped():
+    estimator = AltitudeEstimator(clock=lambda: 0.0)
+    t = climbing(estimator)
+    altitude, velocity = estimator.estimate(t)
+    held = estimator.altitude(t + 10.0)
+    assert held == pytest.approx(altitude + velocity * MAX_EXTRAPOLATION)
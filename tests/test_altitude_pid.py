@@ -0,0 +1,58 @@
+import math
+
+import pytest
+
+from altitude_pid import AltitudeController
+
+
+def test_on_target_holds_hover_throttle():
+    controller = AltitudeController()
+    for _ in range(10):
+        assert controller.update(2.0, 2.0) == 1500
+
+
+def test_proportional_term_and_output_clamp():
+    controller = AltitudeController(kp=100.0, ki=0.0, kd=0.0)
+    assert controller.update(1.5, 1.0) == 1550
+    assert controller.update(20.0, 1.0) == 2000
+    assert controller.update(0.0, 20.0) == 1000
+
+
+def test_no_integrator_windup_while_saturated():
+    controller = AltitudeController(kp=600.0, ki=30.0, kd=0.0)
+    for _ in range(500):
+        assert controller.update(10.0, 0.0) == 2000
+    # Back on target: nothing was integrated while the output was pinned
+    assert controller.update(0.0, 0.0) == 1500
+
+
+def test_integrator_is_clamped():
+    controller = AltitudeController(kp=0.0, ki=30.0, kd=0.0, i_limit=200.0)
+    for _ in range(10000):
+        controller.update(0.5, 0.0)
+    assert controller.update(0.5, 0.0) == 1700
+    controller.reset()
+    assert controller.update(0.0, 0.0) == 1500
+
+
+def test_derivative_acts_on_measurement_only():
+    controller = AltitudeController(kp=0.0, ki=0.0, kd=60.0)
+    controller.update(1.0, 1.0)
+    # A setpoint step gives no derivative kick
+    assert controller.update(3.0, 1.0) == 1500
+    # Climbing brakes the throttle
+    assert controller.update(3.0, 1.1) < 1500
+
+
+def test_gain_schedule_band_selection():
+    controller = AltitudeController(ki=0.0, kd=0.0,
+                                    schedule=[(math.inf, 300.0, 0.0, 0.0), (1.0, 100.0, 0.0, 0.0)])
+    assert controller.update(0.6, 0.5) == 1510  # Below 1 m: first band
+    assert controller.update(1.1, 1.0) == 1530  # A band's bound belongs to the next band
+    assert controller.update(2.1, 2.0) == 1530
+    assert controller.update(0.6, 0.5) == 1510
+
+
+def test_dt_must_be_positive():
+    with pytest.raises(ValueError):
+        AltitudeController(dt=0)
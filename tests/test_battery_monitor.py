@@ -0,0 +1,116 @@
+import pytest
+
+from battery_monitor import (CRITICAL, INTERNAL_RESISTANCE, OK, STALE_AFTER, WARNING,
+                             BatteryMonitor, guess_cells, state_of_charge)
+from msp_messages import MSP_ANALOG, MSP_BATTERY_STATE, REGISTRY
+from msp_protocol import DIRECTION_ERROR, MSPFrame
+from msp_transport import MSPSnapshot
+
+CELLS = 4
+RESISTANCE = 0.02  # ohm per cell
+REST = 3.9  # resting volts per cell
+
+
+def loaded(current):
+    return CELLS * (REST - current * RESISTANCE)
+
+
+class FakeMux:
+    def __init__(self):
+        self.replies = {}
+
+    def request_many(self, requests, timeout=1.0):
+        snapshot = MSPSnapshot(tuple(requests), 0.0)
+        for cmd in requests:
+            if cmd in self.replies:
+                snapshot.add(self.replies[cmd], 0.0)
+        return snapshot
+
+
+def encode(cmd, *values):
+    return REGISTRY[cmd].encode(*values)
+
+
+def test_state_of_charge_interpolates_and_clamps():
+    assert state_of_charge(3.0) == 0.0
+    assert state_of_charge(4.3) == 1.0
+    assert state_of_charge(3.84) == pytest.approx(0.50)
+    assert state_of_charge(3.835) == pytest.approx(0.4875)
+    assert guess_cells(16.4) == 4 and guess_cells(12.0) == 3 and guess_cells(0) == 0
+
+
+def test_fits_internal_resistance_from_current_swings():
+    monitor = BatteryMonitor(None)
+    for i, current in enumerate((2, 18, 5, 20, 3, 12, 8, 15)):
+        state = monitor.add_sample(i * 0.5, loaded(current), current, 0, CELLS)
+    assert monitor.resistance == pytest.approx(RESISTANCE)
+    assert state.resting_cell_voltage == pytest.approx(REST)
+    assert state.charge == pytest.approx(state_of_charge(REST))
+
+
+def test_keeps_the_starting_resistance_at_steady_current():
+    monitor = BatteryMonitor(None)
+    for i in range(8):
+        monitor.add_sample(i * 0.5, loaded(10 + i * 0.1), 10 + i * 0.1, 0, CELLS)
+    assert monitor.resistance == INTERNAL_RESISTANCE
+
+
+def test_window_drops_old_samples():
+    monitor = BatteryMonitor(None, window=5.0)
+    for t in range(20):
+        monitor.add_sample(float(t), loaded(10), 10, 0, CELLS)
+    assert [s[0] for s in monitor.samples] == [14.0, 15.0, 16.0, 17.0, 18.0, 19.0]
+
+
+def test_coulomb_counting_caps_a_hopeful_voltage():
+    monitor = BatteryMonitor(None, capacity_mah=1000)
+    state = monitor.add_sample(0.0, CELLS * 4.2, 0, 600, CELLS)
+    assert state.remaining_mah == 400
+    assert state.charge == pytest.approx(0.4)
+
+
+def test_flight_time_from_capacity_and_mean_current():
+    levels = []
+    monitor = BatteryMonitor(None, capacity_mah=1500,
+                             listener=lambda level, reason: levels.append(level))
+    state = monitor.add_sample(0.0, CELLS * 4.2, 36.0, 0, CELLS)
+    # 1350 mAh above the 10% reserve at 10 mAh/s
+    assert state.flight_seconds == pytest.approx(135.0)
+    assert state.level == OK
+    monitor.add_sample(1.0, CELLS * 4.2, 36.0, 1100, CELLS)
+    assert monitor.level == WARNING  # 250 mAh usable: 25 s
+    monitor.add_sample(2.0, CELLS * 4.2, 36.0, 1250, CELLS)
+    assert monitor.level == CRITICAL and monitor.critical.is_set()
+    assert levels == [WARNING, CRITICAL]
+    monitor.add_sample(3.0, CELLS * 4.2, 1.0, 1250, CELLS)
+    assert monitor.level == CRITICAL  # Levels never come back down
+
+
+def test_brownout_is_critical():
+    monitor = BatteryMonitor(None)
+    monitor.add_sample(0.0, CELLS * 3.2, 40.0, 0, CELLS)
+    assert monitor.level == CRITICAL and "under load" in monitor.reason
+
+
+def test_step_falls_back_to_analog_and_goes_stale():
+    mux = FakeMux()
+    monitor = BatteryMonitor(mux)
+    monitor._last_sample = 0.0
+    mux.replies[MSP_BATTERY_STATE] = MSPFrame(MSP_BATTERY_STATE, b'', DIRECTION_ERROR)
+    mux.replies[MSP_ANALOG] = MSPFrame(MSP_ANALOG, encode(MSP_ANALOG, 16.0, 120, 900, 8.0))
+    monitor._step(1.0, 0.5)
+    assert monitor.state.voltage == pytest.approx(16.0)
+    assert monitor.state.current == pytest.approx(8.0)
+    assert monitor.cells == 4  # Guessed: MSP_ANALOG has no cell count
+
+    mux.replies = {MSP_BATTERY_STATE: MSPFrame(MSP_BATTERY_STATE, encode(
+        MSP_BATTERY_STATE, 4, 1500, 16.4, 130, 12.5, 0, 16.42))}
+    monitor._step(1.5, 0.5)
+    assert monitor.state.voltage == pytest.approx(16.42)
+    assert monitor.state.mah_drawn == 130
+
+    mux.replies = {}
+    monitor._step(1.5 + STALE_AFTER / 2, 0.5)
+    assert monitor.level == OK and monitor.missed == 1
+    monitor._step(1.5 + STALE_AFTER + 0.1, 0.5)
+    assert monitor.level == CRITICAL and monitor.reason == "no battery telemetry"
@@ -0,0 +1,92 @@
+import pytest
+
+import control_loop
+from control_loop import ControlLoop
+
+RATE = 64  # Period 1/64 s, exact in binary so deadlines compare exactly
+PERIOD = 1.0 / RATE
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(control_loop.time, "sleep", clock.sleep)
+    return clock
+
+
+# Run a loop whose step n takes durations.get(n, 0) periods; returns the
+# tick times (in periods) and the stats
+def run(clock, durations, ticks, **kwargs):
+    loop = ControlLoop(RATE, spin=0.0, clock=clock, **kwargs)
+    times = []
+
+    def step(now, dt):
+        times.append(now / PERIOD)
+        clock.now += durations.get(len(times) - 1, 0) * PERIOD
+        return len(times) == ticks
+
+    return times, loop.run(step)
+
+
+def test_deadlines_do_not_drift_with_step_time(clock):
+    times, stats = run(clock, {n: 0.5 for n in range(10)}, 10)
+    assert times == list(range(10))
+    assert stats.ticks == 10
+    assert stats.overruns == 0 and stats.skipped == 0
+
+
+def test_late_ticks_catch_up(clock):
+    times, stats = run(clock, {1: 2.5}, 6)
+    # Deadlines 2 and 3 run back to back as soon as the slow step ends
+    assert times == [0, 1, 3.5, 3.5, 4, 5]
+    assert stats.overruns == 1
+    assert stats.skipped == 0
+    assert stats.jitter_max == 1.5 * PERIOD
+
+
+def test_too_far_behind_skips_missed_deadlines(clock):
+    times, stats = run(clock, {1: 5.5}, 4)
+    # 6.5 periods in at deadline 2: deadlines 2-6 are dropped, not replayed
+    assert times == [0, 1, 7, 8]
+    assert stats.skipped == 5
+
+
+def test_duration_and_stop(clock):
+    loop = ControlLoop(RATE, spin=0.0, clock=clock)
+    stats = loop.run(lambda now, dt: False, duration=10 * PERIOD)
+    assert stats.ticks == 10
+
+    loop = ControlLoop(RATE, spin=0.0, clock=clock)
+    stats = loop.run(lambda now, dt: loop.stop())
+    assert stats.ticks == 1
+
+
+def test_dt_is_time_since_previous_tick(clock):
+    dts = []
+    ControlLoop(RATE, spin=0.0, clock=clock).run(lambda now, dt: dts.append(dt) or len(dts) == 3)
+    assert dts == [0.0, PERIOD, PERIOD]
+
+
+def test_jitter_percentiles():
+    stats = control_loop.LoopStats(PERIOD)
+    for jitter in range(100):
+        stats.record(jitter / 1000.0, 0.0)
+    assert stats.jitter_percentile(50) == 0.05
+    assert stats.as_dict()["jitter_p50_ms"] == 50.0
+    assert stats.jitter_max == 0.099
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        ControlLoop(0)
@@ -0,0 +1,46 @@
+import struct
+
+from flight_export import decode_analog, decode_battery
+from flight_recorder import FlightLog, FlightRecorder
+from msp_messages import MSP_ANALOG, MSP_BATTERY_STATE, decode_analog as decode_analog_reply
+from msp_messages import decode_battery_state
+from msp_protocol import MSPFrame
+
+
+def export(tmp_path, cmd, payloads, decode):
+    path = str(tmp_path / "flight.bin")
+    recorder = FlightRecorder(path)
+    for payload in payloads:
+        recorder.record_frame(MSPFrame(cmd, payload))
+    recorder.close()
+    log = FlightLog(path)
+    try:
+        return decode(log)
+    finally:
+        log.close()
+
+
+def test_pre_4x_battery_replies_fall_back_to_vbat(tmp_path):
+    full = struct.pack('<BHBHHBH', 4, 1500, 168, 100, 1234, 0, 1681)
+    short = full[:9]  # Pre-4.x layout, no 0.01 V voltage
+    battery = export(tmp_path, MSP_BATTERY_STATE, [short, full, short], decode_battery)
+    assert len(battery) == 3
+    assert list(battery['voltage']) == [16.8, 16.81, 16.8]
+    assert list(battery['current']) == [12.34] * 3
+    # Same values as the registry decoder gives per reply
+    assert battery['voltage'][0] == decode_battery_state(short).voltage
+    assert battery['voltage'][1] == decode_battery_state(full).voltage
+
+
+def test_pre_4x_analog_replies_fall_back_to_vbat(tmp_path):
+    full = struct.pack('<BHHhH', 121, 50, 1023, -25, 1212)
+    analog = export(tmp_path, MSP_ANALOG, [full[:7], full], decode_analog)
+    assert list(analog['voltage']) == [decode_analog_reply(full[:7]).voltage, 12.12]
+    assert list(analog['current']) == [-0.25, -0.25]
+
+
+def test_replies_shorter_than_the_base_layout_are_dropped(tmp_path):
+    full = struct.pack('<BHBHHBH', 4, 1500, 168, 100, 1234, 0, 1681)
+    battery = export(tmp_path, MSP_BATTERY_STATE, [full, full[:5]], decode_battery)
+    assert len(battery) == 1
+    assert battery['voltage'][0] == 16.81
@@ -0,0 +1,40 @@
+import sys
+import threading
+
+from flight_recorder import FlightLog, FlightRecorder
+
+PRODUCERS = 4
+PER_PRODUCER = 5000
+
+
+def test_concurrent_producers_keep_records_intact(tmp_path):
+    path = str(tmp_path / "flight.bin")
+    recorder = FlightRecorder(path)
+    start = threading.Barrier(PRODUCERS)
+
+    def produce(stream):
+        start.wait()
+        for i in range(PER_PRODUCER):
+            recorder.record_values(stream, (float(stream), float(i)))
+
+    # Switch threads as often as possible to expose interleaving
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=produce, args=(stream,))
+                   for stream in range(1, PRODUCERS + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    recorder.close()
+    assert recorder.records == PRODUCERS * PER_PRODUCER
+
+    with FlightLog(path) as log:
+        assert log.corrupt_records == 0
+        assert len(log) == PRODUCERS * PER_PRODUCER
+        for stream in range(1, PRODUCERS + 1):
+            values = [v for _, v in log.values(stream)]
+            assert values == [(float(stream), float(i)) for i in range(PER_PRODUCER)]
@@ -0,0 +1,10 @@
+from hcsr04 import MedianFilter
+
+
+def test_filter_restarts_from_the_accepted_jump():
+    f = MedianFilter(size=5, max_jump=0.5)
+    for _ in range(7):
+        assert f.add(1.0) == 1.0
+    # Four rejects, then the fifth jump in a row is accepted as real
+    results = [f.add(3.0) for _ in range(9)]
+    assert results == [None] * 4 + [3.0] * 5
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+import serial
+
+from link_watchdog import LinkWatchdog
+from msp_messages import MSP_STATUS_EX
+from msp_transport import MSPMultiplexer, connect_msp
+from sitl_fc import SimulatedFC
+
+
+class Events:
+    def __init__(self):
+        self.seen = []
+        self.changed = threading.Condition()
+
+    def __call__(self, event, detail):
+        with self.changed:
+            self.seen.append(event)
+            self.changed.notify_all()
+
+    def wait_for(self, *events, timeout=3.0):
+        with self.changed:
+            assert self.changed.wait_for(lambda: list(events) == self.seen[:len(events)],
+                                         timeout), self.seen
+
+
+@pytest.fixture
+def link(tmp_path):
+    with SimulatedFC(link_path=str(tmp_path / "fc")) as sim:
+        transport = connect_msp(sim.port, timeout=2.0)
+        mux = MSPMultiplexer(transport).start()
+        events = Events()
+        watchdog = LinkWatchdog(mux, deadline=0.2, listener=events).start()
+        yield sim, mux, watchdog, events
+        watchdog.stop()
+        mux.stop()
+        transport.close()
+
+
+def test_reopens_the_port_after_a_usb_reset(link):
+    sim, mux, watchdog, events = link
+    assert mux.request(MSP_STATUS_EX, timeout=1.0) is not None
+    sim.disconnect(0.1)
+    events.wait_for("lost", "restored")
+    assert watchdog.attempts >= 2  # The node is gone for a while: backoff retries
+    assert mux.request(MSP_STATUS_EX, timeout=1.0) is not None
+    assert mux.health.outages == 1 and mux.health.reconnects == 1
+    assert mux.health.link_up
+
+
+def test_heartbeat_keeps_a_quiet_link_up(link):
+    sim, mux, watchdog, events = link
+    time.sleep(1.0)  # No traffic of our own; heartbeats answer within the deadline
+    assert events.seen == []
+    assert mux.health.requests >= 2
+
+
+def test_reconnects_when_replies_stop(link):
+    sim, mux, watchdog, events = link
+    sim.stall(0.5)
+    events.wait_for("lost")
+    assert mux.health.outages == 1
+    events.wait_for("lost", "restored")
+    time.sleep(0.5)
+    assert mux.request(MSP_STATUS_EX, timeout=1.0) is not None
+
+
+class FakeMux:
+    def __init__(self):
+        self.transport = type("Transport", (), {})()
+        self.transport.ser = serial.serial_for_url("loop://", timeout=0)
+        self.running = True
+        self.reconnect = None
+
+
+def test_gives_up_after_max_outage():
+    events = Events()
+    opens = []
+
+    def opener(port, baudrate):
+        opens.append(time.monotonic())
+        raise serial.SerialException("no such device")
+
+    mux = FakeMux()
+    watchdog = LinkWatchdog(mux, port="/dev/null", baudrate=115200, max_outage=0.3,
+                            backoff=(0.01, 0.08), opener=opener, listener=events)
+    start = time.monotonic()
+    assert watchdog._reconnect("read failed") is None
+    assert events.seen == ["lost", "failed"]
+    assert time.monotonic() - start <= 0.3
+    gaps = [b - a for a, b in zip(opens, opens[1:])]
+    assert gaps[0] == pytest.approx(0.01, abs=0.01)
+    assert max(gaps) == pytest.approx(0.08, abs=0.02)  # Doubling stops at the cap
+    assert not mux.transport.ser.is_open
@@ -0,0 +1,48 @@
+import pytest
+
+import full_autonomous_flight
+from mission import FAILED, MissionAction, MissionError, MissionRunner, compile_mission
+
+
+def mission(*waypoints):
+    return {"version": 1, "mission": {"waypoints": [
+        {"action": action, "params": params, "lat": 18.9, "lon": 73.1, "alt": alt}
+        for action, alt, params in waypoints]}}
+
+
+@pytest.mark.parametrize("timeout", [0, -1])
+def test_non_positive_timeout_is_rejected(timeout):
+    with pytest.raises(MissionError, match="params.timeout"):
+        compile_mission(mission(("TAKEOFF", 0, {}), ("WAYPOINT", 4, {"timeout": timeout}),
+                                ("LAND", 0, {})))
+
+
+def test_landing_timeout_fails_the_mission():
+    land = MissionAction(0, "LAND", 0.0, timeout=1.0)
+    runner = MissionRunner([land])
+    assert runner.step(0.0, 3.0) is not None
+    assert runner.step(1.5, 3.0) is None
+    assert runner.status == FAILED
+
+
+class FakeLink:
+    version = 1
+
+    def write_frame(self, frame):
+        pass
+
+
+def test_failed_landing_hands_over_to_controlled_descent(monkeypatch):
+    throttles = []
+    landings = []
+    monkeypatch.setattr(full_autonomous_flight, "read_altitude", lambda: 3.0)
+    monkeypatch.setattr(full_autonomous_flight, "send_throttle",
+                        lambda link, rc, throttle: throttles.append(throttle))
+    monkeypatch.setattr(full_autonomous_flight, "land",
+                        lambda link, controller, rc, rate_hz: landings.append(controller))
+
+    actions = [MissionAction(0, "LAND", 0.0, timeout=0.1)]
+    runner = full_autonomous_flight.fly_mission(FakeLink(), actions, rate_hz=100)
+    assert runner.status == FAILED
+    assert len(landings) == 1
+    assert throttles and 1000 not in throttles  # Never cut while still airborne
@@ -0,0 +1,91 @@
+import struct
+
+import pytest
+
+from motor_bench import (LATENCY_LIMIT, MOTOR_STOP, PROFILES, MotorBench, Profile, _response,
+                         _steps, ramp, step)
+from msp_transport import MSPMultiplexer, connect_msp
+from sitl_fc import SimulatedFC
+
+PERIOD = 0.005
+
+
+def test_profile_steps_and_ramps():
+    profile = Profile(step(1100, 0.5) + ramp(1100, 1300, 1.0) + step(1200, 0.5))
+    assert profile.duration == 2.0 and profile.peak == 1300
+    assert profile.value(0.0) == 1100 and profile.value(0.49) == 1100
+    assert profile.value(1.0) == 1200
+    assert profile.value(1.49) == 1298
+    assert profile.value(1.6) == 1200
+    assert profile.value(5.0) == 1200  # Holds the last value past the end
+
+
+def test_small_changes_are_ramp_not_steps():
+    commands = [(0.0, [1100]), (1.0, [1110]), (1.1, [1120]), (2.0, [1000])]
+    assert _steps(commands, 0, 3.0) == [(0.0, 1000, 1100, 1.0), (2.0, 1120, 1000, 3.0)]
+
+
+def test_step_response_latency_and_settling():
+    # Output starts moving 20 ms after the step and overshoots once
+    samples = [(t * PERIOD, value) for t, value in enumerate(
+        [1000] * 4 + [1020, 1060, 1110, 1135, 1105, 1100, 1098, 1101, 1100])]
+    latency, settling, settled = _response(samples, 0.0, 1000, 1100, 10)
+    assert latency == pytest.approx(0.020)
+    assert settling == pytest.approx(0.040)  # The overshoot restarts the band
+    assert settled == [1105, 1100, 1098, 1101, 1100]
+    assert _response(samples[:4], 0.0, 1000, 1100, 10)[:2] == (None, None)
+
+
+def analyse(response):
+    bench = MotorBench(None, motor_count=1)
+    commands = [(0.0, [1200]), (0.5, [MOTOR_STOP])]
+    outputs = [(i * PERIOD, [response(i * PERIOD)]) for i in range(200)]
+    return bench._analyse(0, commands, outputs, [], 1.0)
+
+
+def test_analyse_measures_a_lagging_motor():
+    lag = 0.03
+    result = analyse(lambda t: 1200 if lag <= t < 0.5 + lag else MOTOR_STOP)
+    assert result.steps == 2 and result.passed, result.problems
+    assert result.latency == pytest.approx(lag + PERIOD, abs=PERIOD)
+    assert result.mismatch == 0
+
+
+def test_analyse_flags_a_dead_or_slow_motor():
+    assert "no output response to 1000->1200" in analyse(lambda t: MOTOR_STOP).problems
+    slow = analyse(lambda t: 1200 if 2 * LATENCY_LIMIT <= t < 0.5 else MOTOR_STOP)
+    assert any(problem.startswith("latency") for problem in slow.problems)
+
+
+@pytest.fixture
+def mux():
+    with SimulatedFC() as sim:
+        transport = connect_msp(sim.port, timeout=2.0)
+        mux = MSPMultiplexer(transport).start()
+        yield sim, mux
+        mux.stop()
+        transport.close()
+
+
+def test_bench_runs_against_the_simulator(mux):
+    sim, mux = mux
+    bench = MotorBench(mux)
+    results = bench.run(PROFILES["step"], motors=[1, 3])
+    assert sorted(results) == [1, 3]
+    for result in results.values():
+        assert result.passed, result.problems
+        assert result.steps == 2 and result.samples > 50
+        assert result.latency < LATENCY_LIMIT
+    assert sim.motors[:4] == [MOTOR_STOP] * 4  # Stopped on the way out
+
+
+def test_bench_refuses_an_armed_fc_and_high_profiles(mux):
+    sim, mux = mux
+    bench = MotorBench(mux)
+    with pytest.raises(ValueError):
+        bench.run(step(1500, 0.1))
+    with sim._lock:
+        sim._set_raw_rc(struct.pack('<8H', 1500, 1500, 1000, 1500, 1800, 1500, 1500, 1500))
+    assert sim.armed
+    with pytest.raises(RuntimeError, match="armed"):
+        bench.run(PROFILES["step"])
@@ -0,0 +1,47 @@
+import asyncio
+from concurrent.futures import Future
+
+from msp_async import AsyncMSPClient
+from msp_protocol import MSPFrame
+from msp_transport import split_request
+
+
+class FakeMux:
+    def __init__(self, replies):
+        self.replies = replies
+        self.sent = []
+        self.cancelled = []
+
+    def submit_many(self, requests):
+        self.sent.append(requests)
+        futures = []
+        for cmd, _ in requests:
+            future = Future()
+            if cmd in self.replies:
+                future.set_result(MSPFrame(cmd, self.replies[cmd]))
+            futures.append(future)
+        return futures
+
+    def cancel(self, cmd, future):
+        self.cancelled.append(cmd)
+
+
+def test_split_request():
+    assert split_request(105) == (105, None)
+    assert split_request((200, b'\x01')) == (200, b'\x01')
+
+
+def test_request_many_takes_ids_and_pairs():
+    mux = FakeMux({105: b'\xdc\x05', 200: b''})
+    client = AsyncMSPClient(mux, timeout=0.05)
+    payloads = asyncio.run(client.request_many([105, (200, b'\x01'), 150]))
+    assert mux.sent == [[(105, None), (200, b'\x01'), (150, None)]]
+    assert {cmd: payload and bytes(payload) for cmd, payload in payloads.items()} == {
+        105: b'\xdc\x05', 200: b'', 150: None}
+    assert mux.cancelled == [150]  # Unanswered request withdrawn
+
+
+def test_request_many_with_nothing_to_send():
+    mux = FakeMux({})
+    assert asyncio.run(AsyncMSPClient(mux).request_many([])) == {}
+    assert mux.sent == []
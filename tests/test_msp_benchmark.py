@@ -0,0 +1,25 @@
+from msp_benchmark import _median, compare
+
+
+def test_compare_ignores_tail_metrics():
+    baseline = {"roundtrip": {"MSP_RX": {"mean_ms": 0.08, "p50_ms": 0.08, "p99_ms": 0.1,
+                                         "max_ms": 0.2}},
+                "loop": {"100hz": {"jitter_mean_ms": 0.01, "jitter_p50_ms": 0.01,
+                                   "jitter_p99_ms": 1.0, "jitter_max_ms": 1.2}}}
+    noisy = {"roundtrip": {"MSP_RX": {"mean_ms": 0.2, "p50_ms": 0.08, "p99_ms": 0.5,
+                                      "max_ms": 0.6}},
+             "loop": {"100hz": {"jitter_mean_ms": 0.1, "jitter_p50_ms": 0.01,
+                                "jitter_p99_ms": 3.4, "jitter_max_ms": 3.5}}}
+    assert compare(baseline, noisy) == []
+
+
+def test_compare_flags_median_latency_and_throughput():
+    baseline = {"roundtrip": {"MSP_RX": {"p50_ms": 0.08}}, "codec": {"encode_v1_per_sec": 4e5}}
+    slower = {"roundtrip": {"MSP_RX": {"p50_ms": 1.3}}, "codec": {"encode_v1_per_sec": 2e5}}
+    names = [name for name, _, _, _ in compare(baseline, slower)]
+    assert names == ["roundtrip.MSP_RX.p50_ms", "codec.encode_v1_per_sec"]
+
+
+def test_median_keeps_layout():
+    runs = [{"commit": "abc", "codec": {"encode_v1_per_sec": rate}} for rate in (3e5, 5e5, 4e5)]
+    assert _median(runs) == {"commit": "abc", "codec": {"encode_v1_per_sec": 4e5}}
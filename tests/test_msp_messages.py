@@ -0,0 +1,71 @@
+import struct
+
+import pytest
+
+import msp_messages
+from msp_messages import MSPMessage, FROM_FC
+
+
+def test_exports_come_from_the_table():
+    for message in msp_messages.MESSAGES:
+        assert getattr(msp_messages, "MSP_" + message.name) == message.cmd
+        assert getattr(msp_messages, "decode_" + message.name.lower()) == message.decode
+        assert msp_messages.REGISTRY[message.cmd] is msp_messages.REGISTRY[message.name]
+        assert "MSP_" + message.name in msp_messages.__all__
+
+
+def test_extra_fields_fall_back_on_older_firmware():
+    message = MSPMessage("TEST", 250, FROM_FC, record="TestReading",
+                         fields=(("vbat", "B", 10), ("current", "h", 100)),
+                         extra=(("voltage", "H", 100, "vbat"), ("rssi", "H")))
+    full = message.decode(struct.pack('<BhHH', 168, -25, 1681, 900))
+    assert (full.vbat, full.current, full.voltage, full.rssi) == (16.8, -0.25, 16.81, 900)
+    short = message.decode(struct.pack('<Bh', 168, -25))
+    assert (short.voltage, short.rssi) == (16.8, None)
+    assert message.decode(message.encode(16.8, -0.25, 16.81, 900)).as_dict() == full.as_dict()
+
+
+def test_short_payload_raises_struct_error():
+    with pytest.raises(struct.error):
+        msp_messages.decode(msp_messages.MSP_ALTITUDE, b'\x00\x01')
+
+
+def status_ex_payload(flight_modes=0, extra_modes=b'', arming_flags=0):
+    return struct.pack(f'<HHHIBHBBB{len(extra_modes)}sBIB', 125, 2, 0x23, flight_modes, 1, 57,
+                       3, 0, len(extra_modes), extra_modes, 26, arming_flags, 0)
+
+
+def test_status_ex_names_every_arming_disable_bit():
+    for bit, name in enumerate(msp_messages.ARMING_DISABLE_FLAG_NAMES):
+        assert msp_messages.arming_disable_reasons(1 << bit) == (name,)
+    assert msp_messages.arming_disable_reasons(1 << 30) == ("BIT30",)
+    flags = (1 << 2) | (1 << 7) | (1 << 16) | (1 << 25) | (1 << 31)
+    status = msp_messages.decode_status_ex(status_ex_payload(arming_flags=flags))
+    assert status.arming_disable_flags == flags
+    assert status.arming_disable_reasons == ("RXLOSS", "THROTTLE", "MSP", "ARMSWITCH", "BIT31")
+    assert msp_messages.decode_status_ex(status_ex_payload()).arming_disable_reasons == ()
+
+
+def test_status_ex_decodes_the_whole_payload():
+    status = msp_messages.decode_status_ex(status_ex_payload(flight_modes=1))
+    assert (status.cycle_time, status.i2c_errors, status.pid_profile, status.system_load) == \
+        (125, 2, 1, 57)
+    assert (status.pid_profile_count, status.rate_profile, status.config_state) == (3, 0, 0)
+    assert status.armed and status.has_sensor(msp_messages.SENSOR_GYRO)
+    assert not status.has_sensor(msp_messages.SENSOR_MAG)
+
+
+def test_status_ex_skips_extra_flight_mode_bytes():
+    status = msp_messages.decode_status_ex(
+        status_ex_payload(extra_modes=b'\x05\x80', arming_flags=1 << 2))
+    assert status.extra_flight_mode_flags == b'\x05\x80'
+    assert status.arming_disable_reasons == ("RXLOSS",)
+    assert status.arming_disable_count == 26
+
+
+def test_status_ex_from_pre_4_firmware():
+    status = msp_messages.decode_status_ex(status_ex_payload(flight_modes=1)[:15])
+    assert status.armed and status.system_load == 57
+    assert status.arming_disable_flags is None and status.arming_disable_reasons == ()
+    with pytest.raises(struct.error):
+        msp_messages.decode_status_ex(b'\x7d\x00\x02')
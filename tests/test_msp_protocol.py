@@ -0,0 +1,29 @@
+from msp_protocol import DIRECTION_RESPONSE, MSPParser, encode_v1, encode_v2
+
+
+def test_corrupt_v2_length_resyncs_on_the_next_frame():
+    reply = encode_v2(105, bytes(range(16)), DIRECTION_RESPONSE)
+    corrupt = bytearray(encode_v2(150, bytes(22), DIRECTION_RESPONSE))
+    corrupt[6:8] = (0xF000).to_bytes(2, 'little')  # Size field hit by line noise
+    parser = MSPParser()
+    frames = parser.feed(bytes(corrupt) + bytes(reply))
+    assert [(frame.cmd, bytes(frame.payload)) for frame in frames] == [(105, bytes(range(16)))]
+    assert parser.oversize_frames == 1
+    assert parser.pending == 0
+
+
+def test_payload_cap_is_configurable():
+    reply = encode_v2(0x3000, bytes(600), DIRECTION_RESPONSE)
+    assert MSPParser().feed(bytes(reply)) == []
+    frames = MSPParser(max_payload=1024).feed(bytes(reply))
+    assert len(frames) == 1 and len(frames[0].payload) == 600
+
+
+def test_frames_split_across_chunks():
+    stream = bytes(encode_v1(109, bytes(6), DIRECTION_RESPONSE) +
+                   encode_v2(105, bytes(16), DIRECTION_RESPONSE))
+    parser = MSPParser()
+    frames = []
+    for i in range(len(stream)):
+        frames.extend(parser.feed(stream[i:i + 1]))
+    assert [(frame.cmd, frame.version) for frame in frames] == [(109, 1), (105, 2)]
@@ -0,0 +1,29 @@
+import pytest
+
+from preflight import GO, NOGO, Preflight
+
+
+def check_rx(channels):
+    preflight = Preflight(mux=None)
+    preflight.telemetry["rx"] = channels
+    return preflight.check_rx()
+
+
+def test_neutral_sticks_are_go():
+    status, detail, _ = check_rx([1510, 1490, 1000, 1500, 1000, 1500, 1500, 1500])
+    assert status == GO
+    assert "sticks centered" in detail
+
+
+@pytest.mark.parametrize("channel", [0, 1, 3])
+def test_off_center_stick_is_nogo(channel):
+    channels = [1500, 1500, 1000, 1500, 1000, 1500, 1500, 1500]
+    channels[channel] = 1600
+    status, detail, _ = check_rx(channels)
+    assert status == NOGO
+    assert "not centered" in detail
+
+
+def test_throttle_and_arm_switch_still_checked():
+    assert check_rx([1500, 1500, 1200, 1500, 1000])[0] == NOGO
+    assert check_rx([1500, 1500, 1000, 1500, 1800])[0] == NOGO
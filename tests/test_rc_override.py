@@ -0,0 +1,52 @@
+import random
+import struct
+
+import pytest
+
+from msp_messages import MSP_SET_RAW_RC
+from msp_protocol import DIRECTION_REQUEST, MSPParser, encode_v1, encode_v2
+from rc_override import AUX1, DEFAULT_CHANNELS, THROTTLE, RCOverride
+
+
+def expected_frame(channels, version):
+    payload = struct.pack(f'<{len(channels)}H', *channels)
+    return (encode_v2 if version >= 2 else encode_v1)(MSP_SET_RAW_RC, payload)
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_frame_matches_the_encoder_after_every_update(version):
+    rc = RCOverride(DEFAULT_CHANNELS, version)
+    channels = list(DEFAULT_CHANNELS)
+    assert rc.frame == expected_frame(channels, version)
+    rng = random.Random(7)
+    for _ in range(500):
+        index, value = rng.randrange(len(channels)), rng.randrange(900, 2100)
+        rc.set_channel(index, value)
+        channels[index] = value
+        assert rc.frame == expected_frame(channels, version)
+    assert rc.channels() == channels
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_patched_frame_parses_with_a_valid_checksum(version):
+    rc = RCOverride(DEFAULT_CHANNELS, version)
+    rc.set_throttle(1375)
+    rc[AUX1] = 1800
+    parser = MSPParser(directions=(DIRECTION_REQUEST,))
+    frames = parser.feed(bytes(rc.frame))
+    assert parser.checksum_errors == 0
+    assert [frame.cmd for frame in frames] == [MSP_SET_RAW_RC]
+    assert struct.unpack('<8H', frames[0].payload)[THROTTLE] == 1375
+    assert rc[THROTTLE] == 1375 and rc[AUX1] == 1800
+
+
+def test_set_channels_rewrites_the_whole_frame():
+    rc = RCOverride(DEFAULT_CHANNELS)
+    rc.set_channels([1600] * 8)
+    assert rc.frame == expected_frame([1600] * 8, 1)
+
+
+def test_channel_index_is_checked():
+    rc = RCOverride(DEFAULT_CHANNELS)
+    with pytest.raises(IndexError):
+        rc.set_channel(8, 1500)
@@ -0,0 +1,111 @@
+import random
+import statistics
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from msp_transport import MSPMultiplexer, connect_msp
+from rx_monitor import DROPOUT_GAP, RXMonitor
+from sitl_fc import SimulatedFC
+
+PERIOD = 0.01
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def feed(monitor, clock, rows, period=PERIOD):
+    for channels in rows:
+        clock.now += period
+        monitor.add_sample(clock.now, channels)
+
+
+def test_rolling_stats_match_the_window():
+    clock = Clock()
+    monitor = RXMonitor(None, window=1.0, clock=clock)
+    rng = random.Random(7)
+    rows = [[1500 + rng.randint(-6, 6), 1500, 1000 + i % 7, 1500, 2150 if i % 50 == 0 else 1500]
+            for i in range(400)]
+    feed(monitor, clock, rows)
+    summary, channels = monitor.stats()
+
+    window = rows[-101:]  # Samples no more than a window old, both ends included
+    roll = [row[0] for row in window]
+    assert len(monitor.samples) == len(window)
+    assert channels[0].mean == pytest.approx(statistics.fmean(roll))
+    assert channels[0].jitter == pytest.approx(statistics.pstdev(roll))
+    assert channels[0].spread == max(roll) - min(roll)
+    assert channels[1].jitter == 0.0 and channels[1].updates == 0.0
+    # Each sample counts the channels it changed, so the oldest one compares
+    # against the sample just before the window
+    changes = sum(a[2] != b[2] for a, b in zip(rows[-102:], window))
+    assert channels[2].updates == pytest.approx(changes / 1.0)
+    assert channels[4].violations == 2 and channels[4].violations_total == 8
+    assert summary["poll_rate_hz"] == pytest.approx(1 / PERIOD)
+    assert summary["interval_jitter_ms"] == pytest.approx(0.0, abs=1e-3)
+    problems = monitor.problems()
+    assert problems[0].startswith("Roll: jitter")
+    aux = statistics.pstdev(row[4] for row in window)
+    assert problems[1:] == ["AUX1: 2 samples outside 900-2100", f"AUX1: jitter {aux:.1f} us"]
+
+
+def test_dropouts_are_counted_and_age_out():
+    clock = Clock()
+    monitor = RXMonitor(None, window=1.0, clock=clock)
+    feed(monitor, clock, [[1500] * 4] * 10)
+    feed(monitor, clock, [[1500] * 4], period=DROPOUT_GAP * 3)
+    summary, _ = monitor.stats()
+    assert summary["dropouts"] == summary["window_dropouts"] == 1
+    assert summary["window_longest_dropout_ms"] == pytest.approx(DROPOUT_GAP * 3000)
+    assert monitor.problems() == ["1 dropouts in the last 1 s (longest 300 ms)"]
+    clock.now += 2.0  # Replies stopped: the window still empties
+    summary, channels = monitor.stats()
+    assert summary["window_dropouts"] == 0 and summary["dropouts"] == 1
+    assert monitor.samples == type(monitor.samples)() and channels[0].value is None
+
+
+class FailedMux:
+    def __init__(self):
+        self.cancelled = 0
+
+    def submit(self, cmd, data=None):
+        future = Future()
+        future.set_exception(OSError("port gone"))
+        return future
+
+    def cancel(self, cmd, future):
+        self.cancelled += 1
+
+
+def test_link_failure_stops_polling():
+    mux = FailedMux()
+    monitor = RXMonitor(mux).start()
+    monitor._thread.join(1.0)
+    assert not monitor._thread.is_alive()
+    assert isinstance(monitor.error, OSError)
+    assert monitor.problems()[0] == "link failed: port gone"
+    assert mux.cancelled == monitor.depth - 1
+    monitor.stop()
+
+
+def test_polls_the_simulator():
+    with SimulatedFC() as sim:
+        transport = connect_msp(sim.port, timeout=2.0)
+        mux = MSPMultiplexer(transport).start()
+        monitor = RXMonitor(mux).start()
+        try:
+            time.sleep(0.5)
+        finally:
+            monitor.stop()
+            mux.stop()
+            transport.close()
+    summary, channels = monitor.stats()
+    assert summary["polls"] > 20 and summary["timeouts"] == 0 and summary["error"] is None
+    assert [stats.value for stats in channels[:5]] == [1500, 1500, 1000, 1500, 1000]
+    assert monitor.problems() == []
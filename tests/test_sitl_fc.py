@@ -0,0 +1,98 @@
+import struct
+
+import pytest
+
+from msp_messages import MSP_BATTERY_STATE, MSP_STATUS_EX, decode_battery_state, decode_status_ex
+from msp_transport import connect_msp
+from sitl_fc import (ARMING_DISABLED_RXLOSS, ARMING_DISABLED_THROTTLE, HOVER_THROTTLE,
+                     RC_TIMEOUT, SimulatedFC)
+
+
+def rc(sim, throttle, aux1):
+    channels = [1500, 1500, throttle, 1500, aux1, 1500, 1500, 1500]
+    return sim._set_raw_rc(struct.pack('<8H', *channels))
+
+
+def run(sim, seconds, dt=0.005, throttle=None, aux1=1800):
+    for _ in range(int(seconds / dt)):
+        if throttle is not None:
+            rc(sim, throttle, aux1)
+        sim._step(dt)
+
+
+def status(sim):
+    return decode_status_ex(sim._status_ex(b''))
+
+
+def test_arming_needs_rc_and_low_throttle():
+    sim = SimulatedFC()
+    assert status(sim).arming_disable_flags & ARMING_DISABLED_RXLOSS
+    rc(sim, 1400, 1000)
+    assert status(sim).arming_disable_flags == ARMING_DISABLED_THROTTLE
+    rc(sim, 1400, 1800)
+    assert not sim.armed
+    rc(sim, 1000, 1800)
+    assert sim.armed and status(sim).armed
+    rc(sim, 1000, 1000)
+    assert not sim.armed
+
+
+def test_failsafe_disarms_when_rc_stops():
+    sim = SimulatedFC()
+    rc(sim, 1000, 1800)
+    run(sim, RC_TIMEOUT * 0.9)
+    assert sim.armed
+    run(sim, RC_TIMEOUT * 0.2)
+    assert not sim.armed
+    assert status(sim).arming_disable_flags & ARMING_DISABLED_RXLOSS
+
+
+def test_climbs_above_hover_throttle_and_settles_at_hover():
+    sim = SimulatedFC()
+    rc(sim, 1000, 1800)
+    run(sim, 2.0, throttle=1700)
+    assert sim.altitude > 1.0 and sim.velocity > 0
+    run(sim, 8.0, throttle=HOVER_THROTTLE)
+    assert abs(sim.velocity) < 0.01  # Drag bleeds off the climb; hover thrust holds it
+    altitude = sim.altitude
+    run(sim, 2.0, throttle=HOVER_THROTTLE)
+    assert sim.altitude == pytest.approx(altitude, abs=0.02)
+
+
+def test_battery_sags_under_load():
+    sim = SimulatedFC()
+    rc(sim, 1000, 1800)
+    run(sim, 0.5, throttle=1000)
+    idle = decode_battery_state(sim._battery_state(b''))
+    run(sim, 0.5, throttle=1900)
+    loaded = decode_battery_state(sim._battery_state(b''))
+    assert loaded.current > idle.current + 20
+    assert loaded.voltage < idle.voltage - 0.3
+    assert loaded.mah_drawn > idle.mah_drawn
+
+
+def test_motor_test_is_refused_while_armed():
+    sim = SimulatedFC()
+    assert sim._set_motor(struct.pack('<8H', *[1100] * 8)) == b''
+    assert sim.motors[:4] == [1000] * 4
+    sim._step(0.005)
+    assert sim.motors[:4] == [1100] * 4
+    rc(sim, 1000, 1800)
+    assert sim._set_motor(struct.pack('<8H', *[1100] * 8)) is None
+
+
+def test_answers_msp_on_its_pty():
+    with SimulatedFC() as sim:
+        transport = connect_msp(sim.port, timeout=2.0)
+        try:
+            assert transport.info.variant == 'BTFL'
+            assert transport.version == 2
+            status = decode_status_ex(transport.request(MSP_STATUS_EX, timeout=1.0).payload)
+            assert not status.armed
+            battery = decode_battery_state(transport.request(MSP_BATTERY_STATE, timeout=1.0)
+                                           .payload)
+            assert battery.cells == 4
+            error = transport.request(9999 & 0xFF, timeout=1.0)  # Unknown command
+            assert error is not None and error.is_error
+        finally:
+            transport.close()
@@ -0,0 +1,265 @@
+import base64
+import hashlib
+import os
+import socket
+import struct
+import time
+
+import pytest
+
+from telemetry_server import (CLIENT_TIMEOUT, DEFAULT_RATE_HZ, POLL_INTERVAL, TelemetryClient,
+                              TelemetryServer, decode_frame)
+
+
+def test_idle_subscriber_costs_no_cpu():
+    server = TelemetryServer(udp_address=("127.0.0.1", 0)).start()
+    client = TelemetryClient(server.udp_address, rate=10)
+    try:
+        server.state.update_control(1.0, 0.5, 1500)
+        assert client.read(1.0)["control"]["throttle"] == 1500
+
+        # Subscribed, but nothing new to send: the publisher must sleep
+        cpu = time.process_time()
+        time.sleep(1.0)
+        assert time.process_time() - cpu < 0.1
+
+        # and still wake up for the next change
+        server.state.update_control(1.0, 0.7, 1600)
+        assert client.read(1.0)["control"]["throttle"] == 1600
+    finally:
+        client.close()
+        server.stop()
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+# --- WebSocket ---------------------------------------------------------------
+
+def ws_frame(payload, opcode=0x1, fin=True, mask=b'\x12\x34\x56\x78', length=None):
+    length = len(payload) if length is None else length
+    first = (0x80 if fin else 0) | opcode
+    masked = 0x80 if mask else 0
+    if length < 126:
+        header = struct.pack('>BB', first, masked | length)
+    elif length < 65536:
+        header = struct.pack('>BBH', first, masked | 126, length)
+    else:
+        header = struct.pack('>BBQ', first, masked | 127, length)
+    if not mask:
+        return header + payload
+    return header + mask + bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+
+
+def recv_exact(sock, count):
+    data = b''
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+# Next server frame as (opcode, payload); server frames are never masked
+def ws_recv(sock):
+    first, second = recv_exact(sock, 2)
+    assert not second & 0x80
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', recv_exact(sock, 8))[0]
+    return first & 0x0F, recv_exact(sock, length)
+
+
+# Skip telemetry until a frame with opcode arrives
+def ws_expect(sock, opcode):
+    while True:
+        got, payload = ws_recv(sock)
+        if got == opcode:
+            return payload
+
+
+def ws_closed(sock):
+    try:
+        return sock.recv(1) == b''
+    except ConnectionResetError:
+        return True
+
+
+@pytest.fixture
+def ws_server():
+    server = TelemetryServer(udp_address=None, ws_address=("127.0.0.1", 0)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def ws(ws_server):
+    key = base64.b64encode(os.urandom(16))
+    sock = socket.create_connection(ws_server.ws_address, timeout=2.0)
+    sock.sendall(b'GET /?rate=20 HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\n'
+                 b'Connection: Upgrade\r\nSec-WebSocket-Key: ' + key +
+                 b'\r\nSec-WebSocket-Version: 13\r\n\r\n')
+    response = b''
+    while not response.endswith(b'\r\n\r\n'):
+        response += recv_exact(sock, 1)
+    accept = base64.b64encode(hashlib.sha1(key + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11')
+                              .digest())
+    assert response.startswith(b'HTTP/1.1 101')
+    assert b'Sec-WebSocket-Accept: ' + accept in response
+    yield sock
+    sock.close()
+
+
+def ws_client(server):
+    wait_until(lambda: server.ws_clients)
+    return next(iter(server.ws_clients.values()))
+
+
+def test_ws_streams_frames_at_the_requested_rate(ws_server, ws):
+    assert ws_client(ws_server).rate == 20
+    ws_server.state.update_control(2.0, 1.5, 1400)
+    frame = decode_frame(ws_expect(ws, 0x2))
+    while "control" not in frame:  # The state as it was on subscribing
+        frame = decode_frame(ws_expect(ws, 0x2))
+    assert frame["control"]["throttle"] == 1400
+
+
+def test_ws_masked_text_changes_rate(ws_server, ws):
+    ws.sendall(ws_frame(b'SUB 5'))
+    assert wait_until(lambda: ws_client(ws_server).rate == 5)
+
+
+def test_ws_fragmented_message_with_ping_in_between(ws_server, ws):
+    ws.sendall(ws_frame(b'SU', opcode=0x1, fin=False))
+    ws.sendall(ws_frame(b'hello', opcode=0x9))
+    ws.sendall(ws_frame(b'B 25', opcode=0x0))
+    assert ws_expect(ws, 0xA) == b'hello'
+    assert wait_until(lambda: ws_client(ws_server).rate == 25)
+
+
+def test_ws_ping_is_answered_with_its_payload(ws):
+    ws.sendall(ws_frame(b'1234', opcode=0x9))
+    assert ws_expect(ws, 0xA) == b'1234'
+
+
+def test_ws_close_is_echoed(ws_server, ws):
+    ws.sendall(ws_frame(struct.pack('>H', 1001) + b'bye', opcode=0x8))
+    assert ws_expect(ws, 0x8)[:2] == struct.pack('>H', 1001)
+    assert ws_closed(ws)
+    assert wait_until(lambda: not ws_server.ws_clients)
+
+
+def test_ws_unmasked_frame_is_a_protocol_error(ws_server, ws):
+    ws.sendall(ws_frame(b'SUB 5', mask=None))
+    assert ws_expect(ws, 0x8) == struct.pack('>H', 1002)
+    assert ws_closed(ws)
+    assert wait_until(lambda: not ws_server.ws_clients)
+
+
+def test_ws_oversized_frame_is_refused_from_its_header(ws_server, ws):
+    ws.sendall(ws_frame(b'', length=1 << 20)[:14])  # Header only, no payload yet
+    assert ws_expect(ws, 0x8) == struct.pack('>H', 1009)
+    assert ws_closed(ws)
+
+
+def test_ws_oversized_fragmented_message_is_refused(ws):
+    chunk = b'x' * 600
+    ws.sendall(ws_frame(chunk, opcode=0x1, fin=False) + ws_frame(chunk, opcode=0x0, fin=False))
+    assert ws_expect(ws, 0x8) == struct.pack('>H', 1009)
+
+
+def test_ws_continuation_without_a_message_is_a_protocol_error(ws):
+    ws.sendall(ws_frame(b'B 5', opcode=0x0))
+    assert ws_expect(ws, 0x8) == struct.pack('>H', 1002)
+
+
+def test_ws_fragmented_control_frame_is_a_protocol_error(ws):
+    ws.sendall(ws_frame(b'ping', opcode=0x9, fin=False))
+    assert ws_expect(ws, 0x8) == struct.pack('>H', 1002)
+
+
+def test_ws_bad_handshake_gets_400(ws_server):
+    sock = socket.create_connection(ws_server.ws_address, timeout=2.0)
+    try:
+        sock.sendall(b'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        assert sock.recv(64).startswith(b'HTTP/1.1 400')
+        assert ws_closed(sock)
+    finally:
+        sock.close()
+
+
+# --- UDP subscriptions -------------------------------------------------------
+
+def test_udp_subscription_expires_unless_renewed():
+    now = [1000.0]
+    server = TelemetryServer(udp_address=("127.0.0.1", 0), clock=lambda: now[0]).start()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(b'SUB 20', server.udp_address)
+        assert wait_until(lambda: len(server.udp_clients) == 1)
+        client = next(iter(server.udp_clients.values()))
+        assert client.rate == 20
+
+        # Renewed just before the timeout: still subscribed, at the new rate
+        now[0] += CLIENT_TIMEOUT - 1.0
+        sock.sendto(b'SUB 2', server.udp_address)
+        assert wait_until(lambda: client.rate == 2)
+        now[0] += CLIENT_TIMEOUT - 1.0
+        time.sleep(2 * POLL_INTERVAL)
+        assert len(server.udp_clients) == 1
+
+        # Not renewed: gone after CLIENT_TIMEOUT
+        now[0] += 2.0
+        assert wait_until(lambda: not server.udp_clients)
+    finally:
+        sock.close()
+        server.stop()
+
+
+def test_udp_unsub_ends_the_stream():
+    server = TelemetryServer(udp_address=("127.0.0.1", 0)).start()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1.0)
+    try:
+        sock.sendto(b'SUB', server.udp_address)
+        assert wait_until(lambda: len(server.udp_clients) == 1)
+        assert next(iter(server.udp_clients.values())).rate == DEFAULT_RATE_HZ
+        server.state.update_control(1.0, 1.0, 1300)
+        frame = decode_frame(sock.recvfrom(4096)[0])
+        while "control" not in frame:  # The state as it was on subscribing
+            frame = decode_frame(sock.recvfrom(4096)[0])
+        assert frame["control"]["throttle"] == 1300
+
+        sock.sendto(b'UNSUB', server.udp_address)
+        assert wait_until(lambda: not server.udp_clients)
+        server.state.update_control(1.0, 1.0, 1350)
+        sock.settimeout(3 * POLL_INTERVAL)
+        with pytest.raises(socket.timeout):
+            sock.recvfrom(4096)
+    finally:
+        sock.close()
+        server.stop()
+
+
+def test_udp_subscribers_are_capped():
+    server = TelemetryServer(udp_address=("127.0.0.1", 0), max_clients=2).start()
+    socks = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(3)]
+    try:
+        for sock in socks:
+            sock.sendto(b'SUB 10', server.udp_address)
+        assert wait_until(lambda: len(server.udp_clients) == 2)
+        time.sleep(2 * POLL_INTERVAL)
+        assert len(server.udp_clients) == 2
+    finally:
+        for sock in socks:
+            sock.close()
+        server.stop()